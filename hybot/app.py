@@ -3,7 +3,7 @@
 from __future__ import annotations
 import os
 from argparse import ArgumentParser
-from typing import Optional, Coroutine
+from typing import Optional, Coroutine, List
 
 from attrdict import AttrDict
 
@@ -14,6 +14,7 @@ from hydb.api.client import HyDbClient
 from hydra.util.asyncc import AsyncMethods
 
 from .bot.hydra import HydraBot
+from .bot.hydra.shard import Shard
 from hybot.util.conf import Config
 
 VERSION = "0.0.1"
@@ -28,10 +29,11 @@ class HydraBotApp(HydraApp):
     asyncc: AsyncMethods
     db: HyDbClient
     bot: Optional[HydraBot]
+    bots: List[HydraBot]
     conf: AttrDict
 
     CONF = {
-        "bot": "HydraBot"
+        "bot": "HydraBot"  # Or a list of config sections with HydraBot settings, e.g. ["HydraBot", "HydraBotTestnet"].
     }
 
     @staticmethod
@@ -48,6 +50,7 @@ class HydraBotApp(HydraApp):
         HydraBotApp._ = self
         self.asyncc = AsyncMethods(self)
         self.bot = None
+        self.bots = []
 
         if not Config.exists():
             self.render("error", f"Default config created and needs editing at: {Config.APP_CONF}")
@@ -59,14 +62,12 @@ class HydraBotApp(HydraApp):
         self.db = HyDbClient()
 
     def run(self):
-        # TO DO: make bot a list and fork for each.
-        #   Complicates shell scenario however,
-        #   so that will need to load differently.
-        #
-
         bot = self.conf.get("bot", ...)
 
-        if bot is ... or bot != "HydraBot":
+        # Several bots (one config section each) share the DB client, prices and event stream.
+        names = [bot] if isinstance(bot, str) else list(bot) if isinstance(bot, (list, tuple)) else []
+
+        if not names or not all(isinstance(name, str) and name.startswith("HydraBot") for name in names):
             self.render(
                 name="error",
                 result=f"Unknown default bot class '{bot}' specified in: {Config.APP_CONF}" if bot is not ... else
@@ -75,14 +76,28 @@ class HydraBotApp(HydraApp):
 
             exit(-2)
 
-        if bot == "HydraBot":
-            self.bot = HydraBot(
+        if self.args.shell:
+            names = names[:1]
+
+        # Notification workers are forked before the bots exist, each with its own DB client.
+        shard = Shard.fork() if not self.args.shell else Shard()
+
+        if not shard.primary:
+            self.db = HyDbClient()
+
+        self.bots = [
+            HydraBot(
                 db=self.db,
-                shell=self.asyncc.shell() if self.args.shell else None
+                shell=self.asyncc.shell() if self.args.shell else None,
+                shard=shard,
+                name=name
             )
+            for name in names
+        ]
+
+        self.bot = self.bots[0]
 
-        if self.bot:
-            self.bot.run()
+        HydraBot.run_all(self.bots)
 
     def shell(self):
         import sys, traceback, code, asyncio
@@ -4,12 +4,13 @@ Bot Support @ <a href="t.me/TheHydraverse">The Hydraverse</a>.
 from __future__ import annotations
 
 import asyncio
+import os
+import signal
 
 from decimal import Decimal
-from typing import Coroutine, Optional, Union, Dict
+from typing import Coroutine, Optional, Union, Dict, Iterator, List
 
 from attrdict import AttrDict
-from datetime import timedelta
 
 from aiogram import F
 import aiogram.exceptions
@@ -26,21 +27,37 @@ from hydra.kc.prices import PriceClient
 from hybot.util.conf import Config
 from hybot.util.gomt import PriceClientGOMT
 from hybot.util.misc import fiat_value_decimal_from_price_simple
+from hybot.util.prices import PriceService, PriceSnapshot
+from .recipients import Recipients
+from .sched import SendScheduler, Lane
+from .shard import Shard
+from .snapshot import Snapshot
+from .startup import Startup
 
 
 @Config.defaults
 class HydraBot(Bot):
     _: HydraBot = None
-    dp: Dispatcher = Dispatcher()
+    BOTS: List[HydraBot] = []
 
+    dp: Dispatcher
+    name: str
     conf: AttrDict
 
     db: HyDbClient
     rpcx: ExplorerRPC
     evm: object  # type: EventManager
+    sched: SendScheduler
+    shard: Shard
+    startup: Startup
+    snapshot: Snapshot
+    recipients: Recipients
+    broadcaster: object  # type: Broadcaster
+    webhook: Optional[object]  # type: WebhookServer
 
     prices: PriceClient  # For compat with the fiat cmd processing.
     price_client_map: Dict[str, PriceClient]
+    price_service: PriceService
 
     CONF = {
         "token": "(bot token from @BotFather)",
@@ -49,63 +66,116 @@ class HydraBot(Bot):
         "kc_key": "(KuCoin API key)",
         "kc_sec": "(KuCoin API secret)",
         "kc_psp": "(KuCoin API passphrase)",
+        "mode": "polling",  # polling | webhook (configured in the WebhookServer section).
     }
 
     # noinspection PyUnusedLocal,PyMethodMayBeStatic
     def bot(*self) -> HydraBot:
         return HydraBot._
 
-    def __new__(cls, db, shell=None, *args, **kwds):
-        if cls._ is None:
-            cls._ = super(HydraBot, cls).__new__(cls, *args, **kwds)
-
-        return cls._
-
     def __hash__(self):
         return hash(self.conf.token)
 
     def __repr__(self):
         return f"{self.__class__.__name__}(id={self.id})"
 
-    def __init__(self, db: HyDbClient, shell: Optional[Coroutine] = None):
+    def __init__(self, db: HyDbClient, shell: Optional[Coroutine] = None, shard: Optional[Shard] = None, name: str = "HydraBot"):
+        """Bot configured by the `name` config section.
+
+        Bots created after the first share its DB client, prices, explorer RPC
+        and event stream, but have their own dispatcher, send scheduler and
+        members (see owns()).
+
+        Nothing is loaded from the network here: the server info, user map
+        and price clients are set up concurrently by `startup` when the
+        dispatcher starts, before it accepts updates.
+        """
+        first = HydraBot._
+
         self.db = db
-        self.conf = Config.get(HydraBot, defaults=True)
+        self.name = name
+        self.conf = Config.get(HydraBot, defaults=True, name=name)
+        self.shard = shard if shard is not None else Shard()
+        self.dp = Dispatcher()
+        self.webhook = None
 
-        # noinspection PyPep8Naming
-        PriceClientKeyed = lambda sym: PriceClient(
-            coin=sym,
-            api_key=self.conf.kc_key,
-            api_secret=self.conf.kc_sec,
-            passphrase=self.conf.kc_psp
-        )
+        if first is None:
+            HydraBot._ = self
 
-        self.prices = pc_hydra = PriceClientKeyed("HYDRA")
-        pc_usdt = PriceClientKeyed("USDT")
+        HydraBot.BOTS.append(self)
 
-        self.price_client_map = {
-            "HYDRA": pc_hydra,
-            "WHYDRA": pc_hydra,
-            "LOC": PriceClientKeyed("LOC"),
-            "USDT": pc_usdt,
-            "DAI": PriceClientKeyed("DAI"),
-            "GOMT": PriceClientGOMT(pc_usdt),
-        }
+        self.prices = None
+        self.price_client_map = {}
+        self.price_service = None
+        self.rpcx = None
 
-        for symbol, pc in self.price_client_map.items():
-            if symbol == "GOMT":
-                continue
+        if first is not None:
+            self.startup = first.startup
+            self.snapshot = first.snapshot
 
-            pc._cache.expiry = timedelta(minutes=1 if symbol == "HYDRA" else 3)
+        else:
+            self.snapshot = Snapshot()
+
+            self.startup = Startup()
+            self.startup.add("server", self.__server_init)
+            self.startup.add("user_map", self.__user_map_refresh, critical=False, after=("server",))
+            self.startup.add("prices", self.__prices_init)
+            self.startup.add("price_cache", self.__price_cache_warm, critical=False, after=("server", "prices"))
+            self.startup.add("currencies", self.__currencies_warm, critical=False, after=("server", "prices"))
+
+            @self.dp.shutdown()
+            async def shared_close():
+                self.startup.close()
+
+                if self.shard.primary:
+                    await self.__snapshot_save()
+
+                if self.price_service is not None:
+                    await self.price_service.close()
+
+        # Registered first so that it runs before every other startup hook.
+        @self.dp.startup()
+        async def startup_ready():
+            await self.startup.ready()
+
+            if first is not None:
+                self.prices = first.prices
+                self.price_client_map = first.price_client_map
+                self.price_service = first.price_service
+                self.rpcx = first.rpcx
+
+            elif self.shard.primary:
+                asyncio.create_task(self.__snapshot_task())
+
+        self.recipients = Recipients(self.data_path(Config.get(Recipients, defaults=True).file))
+
+        @self.dp.shutdown()
+        async def recipients_close():
+            self.recipients.close()
+
+        # Any message or callback from a chat shows it can be sent to again.
+        @self.dp.update.outer_middleware()
+        async def recipients_alive(handler, update: types.Update, data):
+            msg = update.message if update.message is not None else \
+                update.callback_query.message if update.callback_query is not None else None
+
+            if msg is not None:
+                self.recipients.alive(msg.chat.id)
+
+            return await handler(update, data)
+
+        @self.dp.my_chat_member()
+        async def my_chat_member(update: types.ChatMemberUpdated):
+            if update.new_chat_member.status in ("kicked", "left"):
+                self.recipients.dead(update.chat.id, f"bot {update.new_chat_member.status}")
+            else:
+                self.recipients.alive(update.chat.id)
 
         token = self.conf.token
 
         if not token:
             raise ValueError("Invalid or no token found in config")
 
-        HydraBotData.init(self.db)
-
-        self.rpcx = ExplorerRPC(mainnet=HydraBotData.SERVER_INFO.mainnet)
-
         if shell is None:
             self.evm = EventManager(self)
         else:
@@ -121,36 +191,48 @@ class HydraBot(Bot):
             fiat as cmd_fiat, \
             conf as cmd_conf, \
             chain as cmd_chain, \
-            info as cmd_info
+            info as cmd_info, \
+            broadcast as cmd_broadcast
+
+        self.broadcaster = cmd_broadcast.Broadcaster(self, self.data_path(Config.get(cmd_broadcast.Broadcaster, defaults=True).file))
+
+        @self.dp.startup()
+        async def broadcaster_resume():
+            if self.shard.primary:
+                self.broadcaster.resume()
+
+        @self.dp.shutdown()
+        async def broadcaster_close():
+            self.broadcaster.close()
 
         async def chat_message_filter(message: Message) -> bool:
             return message.text is not None and len(str(message.text))
 
         self.dp.message.filter(chat_message_filter)
 
-        @HydraBot.dp.message(F.text.lower().in_({"/hello", "/start", "/hi", "/help"}))
+        @self.dp.message(F.text.lower().in_({"/hello", "/start", "/hi", "/help"}))
         async def hello(msg: types.Message):
-            return await self.command(msg, cmd_hello.hello)
+            return await self.command(msg, cmd_hello.hello, locked=True)
 
         @self.dp.message(F.text.startswith("/tz"))
         async def tz(msg: types.Message):
-            return await self.command(msg, cmd_tz.tz)
+            return await self.command(msg, cmd_tz.tz, locked=True)
 
         @self.dp.message(F.text.startswith("/DELETE"))
         async def delete(msg: types.Message):
-            return await self.command(msg, cmd_delete.delete)
+            return await self.command(msg, cmd_delete.delete, locked=True)
 
         @self.dp.message(F.text.startswith("/fiat"))
         async def fiat(msg: types.Message):
-            return await self.command(msg, cmd_fiat.fiat)
+            return await self.command(msg, cmd_fiat.fiat, locked=True)
 
         @self.dp.message(F.text.startswith("/price"))
         async def fiat(msg: types.Message):
-            return await self.command(msg, cmd_fiat.fiat)
+            return await self.command(msg, cmd_fiat.fiat, locked=True)
 
         @self.dp.message(F.text.startswith("/conf"))
         async def conf(msg: types.Message):
-            return await self.command(msg, cmd_conf.conf)
+            return await self.command(msg, cmd_conf.conf, locked=True)
 
         @self.dp.message(F.text.startswith("/chain"))
         async def chain(msg: types.Message):
@@ -160,10 +242,14 @@ class HydraBot(Bot):
         async def info(msg: types.Message):
             return await self.command(msg, cmd_info.info)
 
+        @self.dp.message(F.text.startswith("/broadcast"))
+        async def broadcast(msg: types.Message):
+            return await self.command(msg, cmd_broadcast.broadcast)
+
         @self.dp.message()
         @self.dp.message(F.text.startswith("/addr").or_(F.text.startswith("/a")))
         async def addr_(msg: types.Message):
-            return await self.command(msg, cmd_addr.addr)
+            return await self.command(msg, cmd_addr.addr, locked=True)
 
         @self.dp.callback_query()
         async def process_callback(callback_query: types.CallbackQuery):
@@ -187,55 +273,210 @@ class HydraBot(Bot):
 
         super().__init__(token, parse_mode="HTML")
 
+        self.sched = SendScheduler(share=self.shard.share)
+        self.session.middleware(self.sched)
+
     @staticmethod
     def main(db: HyDbClient):
         return HydraBot(db).run()
 
+    async def __server_init(self):
+        """Server info and user map, restoring the snapshot (if any) for the server's network.
+        """
+        from . import addr
+
+        warm = await HydraBotData.init(self.db, self.snapshot)
+        self.rpcx = ExplorerRPC(mainnet=HydraBotData.SERVER_INFO.mainnet)
+
+        if warm:
+            addr._ADDR_SHOW_PREV.update({int(k): v for k, v in (self.snapshot.get("addr_show") or {}).items()})
+
+            log.info(
+                f"Snapshot: restored {len(HydraBotData.PKID_CACHE)} users from {round(self.snapshot.age)}s ago; "
+                "refreshing the user map in the background."
+            )
+
+    async def __user_map_refresh(self):
+        if self.snapshot.data is not None:
+            await HydraBotData.user_map_load(self.db)
+
+    async def __snapshot_task(self):
+        while 1:
+            try:
+                await asyncio.sleep(self.snapshot.conf.interval)
+                await self.__snapshot_save()
+            except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
+                return
+            except Exception as exc:
+                log.warning(f"Snapshot: unable to save: {exc}")
+
+    async def __snapshot_save(self):
+        """Write the caches for the next start (primary process only).
+        """
+        from . import addr, fiat
+
+        # Don't replace a good snapshot with the caches of a bot that never finished starting.
+        if self.startup.status().server != "ready":
+            return
+
+        # Copied here: the snapshot is serialized in the executor while the loop keeps updating the caches.
+        await self.snapshot.save(
+            mainnet=HydraBotData.SERVER_INFO.mainnet,
+            users=dict(HydraBotData.PKID_CACHE),
+            addr_show=dict(addr._ADDR_SHOW_PREV),
+            prices=self.price_service.dump() if self.price_service is not None else [],
+            currencies=dict(fiat.CURRENCIES),
+        )
+
+    async def __prices_init(self):
+        loop = asyncio.get_running_loop()
+
+        # noinspection PyPep8Naming
+        PriceClientKeyed = lambda sym: loop.run_in_executor(None, lambda: PriceClient(
+            coin=sym,
+            api_key=self.conf.kc_key,
+            api_secret=self.conf.kc_sec,
+            passphrase=self.conf.kc_psp
+        ))
+
+        pc_hydra, pc_usdt, pc_loc, pc_dai = await asyncio.gather(
+            PriceClientKeyed("HYDRA"), PriceClientKeyed("USDT"), PriceClientKeyed("LOC"), PriceClientKeyed("DAI")
+        )
+
+        self.prices = pc_hydra
+
+        self.price_client_map = {
+            "HYDRA": pc_hydra,
+            "WHYDRA": pc_hydra,
+            "LOC": pc_loc,
+            "USDT": pc_usdt,
+            "DAI": pc_dai,
+            "GOMT": PriceClientGOMT(pc_usdt),
+        }
+
+        # Price lookups go through the async service; the clients above
+        # provide the currency list and formatting.
+        self.price_service = PriceService(self.price_client_map)
+
+    async def __price_cache_warm(self):
+        self.price_service.restore(self.snapshot.get("prices") or [], self.snapshot.age)
+
+        await asyncio.gather(*(
+            self.price_service.get(symbol, "USD") for symbol in self.price_client_map
+        ))
+
+    async def __currencies_warm(self):
+        """Fill the currency details shown by /fiat, a blocking KuCoin call each.
+        """
+        from .fiat import fetch_currency, CURRENCIES
+
+        loop = asyncio.get_running_loop()
+
+        for currency, kcc in (self.snapshot.get("currencies") or {}).items():
+            CURRENCIES.setdefault(currency, kcc)
+
+        missing = [currency for currency in self.prices.currencies if currency not in CURRENCIES]
+
+        kccs = await asyncio.gather(*(
+            loop.run_in_executor(None, fetch_currency, self, currency) for currency in missing
+        ))
+
+        # Stored here on the loop, where /fiat and the snapshot read them.
+        for currency, kcc in zip(missing, kccs):
+            CURRENCIES.setdefault(currency, kcc)
+
+    def data_path(self, file: str, sharded: bool = False) -> str:
+        """`file` under Config.APP_BASE, made distinct per bot (other than "HydraBot") and, when `sharded`, per process.
+        """
+        if self.name != HydraBot.__name__:
+            root, ext = os.path.splitext(file)
+            file = f"{root}.{self.name}{ext}"
+
+        if sharded:
+            return self.shard.path(file)
+
+        return os.path.join(Config.APP_BASE, file)
+
+    def owns(self, tg_user_id: int) -> bool:
+        """Whether this bot notifies and broadcasts to a user.
+
+        Each user belongs to one bot: the one that created their account or
+        that they last sent /start to. Users no other bot has claimed belong to
+        the first bot, which covers every user from before there were several.
+        """
+        if len(HydraBot.BOTS) == 1:
+            return True
+
+        if self is HydraBot._:
+            return not any(tg_user_id in bot.recipients.members for bot in HydraBot.BOTS if bot is not self)
+
+        return tg_user_id in self.recipients.members
+
+    def users(self) -> Iterator[int]:
+        """The tg_user_ids of this bot's users.
+        """
+        return (tg_user_id for tg_user_id in HydraBotData.PKID_CACHE.keys() if tg_user_id > 0 and self.owns(tg_user_id))
+
+    def claim(self, tg_user_id: int, pkid: int):
+        """Make a user this bot's only.
+        """
+        for bot in HydraBot.BOTS:
+            if bot is not self:
+                bot.recipients.leave(tg_user_id)
+
+        self.recipients.join(tg_user_id, pkid)
+
+    @staticmethod
+    def release(tg_user_id: int):
+        for bot in HydraBot.BOTS:
+            bot.recipients.leave(tg_user_id)
+
     async def fiat_value_of(self, symbol: str, currency: str, value: Union[Decimal, int, str], *, with_name=True) -> str:
-        return await HydraBot.fiat_value(self.price_client_map[symbol], currency, value, with_name=with_name)
+        return self.fiat_value_format(currency, await self.fiat_value_dec_of(symbol, currency, value), with_name=with_name)
 
     async def fiat_value_dec_of(self, symbol: str, currency: str, value: Union[Decimal, int, str]) -> Decimal:
-        return await HydraBot.fiat_value_decimal(self.price_client_map[symbol], currency, value)
+        # The resulting types of floor() and round() are actually Decimal.
+        # noinspection PyTypeChecker
+        return fiat_value_decimal_from_price_simple(await self.fiat_price(symbol, currency), value)
 
     async def hydra_fiat_value(self, currency: str, value: Union[Decimal, int, str], *, with_name=True) -> str:
-        return await HydraBot.fiat_value(self.price_client_map["HYDRA"], currency, value, with_name=with_name)
+        return await self.fiat_value_of("HYDRA", currency, value, with_name=with_name)
 
     async def hydra_fiat_value_dec(self, currency: str, value: Union[Decimal, int, str]) -> Decimal:
-        return await HydraBot.fiat_value_decimal(self.price_client_map["HYDRA"], currency, value)
+        return await self.fiat_value_dec_of("HYDRA", currency, value)
 
-    def fiat_value_format(self, currency: str, fiat_value: Decimal, *, with_name=True) -> str:
-        # noinspection StrFormat
-        return self.price_client_map["HYDRA"].format(
-            currency,
-            '{:,}'.format(fiat_value),
-            with_name=with_name
-        )
+    async def fiat_price(self, symbol: str, currency: str) -> Decimal:
+        if currency not in self.prices.currencies:
+            raise ValueError("Invalid currency.")
 
-    @staticmethod
-    async def fiat_value(pc: PriceClient, currency: str, value: Union[Decimal, int, str], *, with_name=True) -> str:
+        return await self.price_service.get(symbol, currency)
+
+    def price_snapshot(self, cached: bool = False) -> PriceSnapshot:
+        """An empty price snapshot; fill it with `await snapshot.extend(pairs)`.
 
-        fiat_value = await HydraBot.fiat_value_decimal(pc, currency, value)
+        A `cached` snapshot only uses prices the service already has and shows "n/a" for the others.
+        """
+        if cached:
+            return PriceSnapshot(self.fiat_price_cached, self.fiat_value_format, fallback="n/a")
 
+        return PriceSnapshot(self.fiat_price, self.fiat_value_format)
+
+    async def fiat_price_cached(self, symbol: str, currency: str) -> Decimal:
+        price = self.price_service.cached(symbol, currency)
+
+        if price is None:
+            raise LookupError(f"No cached price for {symbol}/{currency}.")
+
+        return price
+
+    def fiat_value_format(self, currency: str, fiat_value: Decimal, *, with_name=True) -> str:
         # noinspection StrFormat
-        return pc.format(
+        return self.price_client_map["HYDRA"].format(
             currency,
             '{:,}'.format(fiat_value),
             with_name=with_name
         )
 
-    @staticmethod
-    async def fiat_value_decimal(pc: PriceClient, currency: str, value: Union[Decimal, int, str]) -> Decimal:
-        price = await asyncio.get_event_loop().run_in_executor(
-            executor=None,
-            func=lambda: pc.price(currency, raw=True)
-        )
-
-        # The resulting types of floor() and round() are actually Decimal.
-        # noinspection PyTypeChecker
-        fiat_value: Decimal = fiat_value_decimal_from_price_simple(price, value)
-
-        return fiat_value
-
     async def show_addr(self, msg: Message, user_pk: int, user_addr_pk: int, chat_id: int, refreshing: bool = True):
 
         ua: Optional[schemas.UserAddrFull] = await self.db.asyncc.user_addr_get(user_pk, user_addr_pk)
@@ -295,20 +536,81 @@ class HydraBot(Bot):
 
         return
 
+    async def serve(self, handle_signals: bool = True):
+        """Run until stopped: command polling or webhook in the primary process, event processing in shard workers.
+        """
+        if not self.shard.primary:
+            return await self.shard.serve(self, handle_signals=handle_signals)
+
+        if self.conf.mode == "webhook":
+            from .webhook import WebhookServer
+            self.webhook = WebhookServer(self)
+            return await self.webhook.serve(handle_signals=handle_signals)
+
+        if self.conf.mode != "polling":
+            raise ValueError(f"Invalid HydraBot mode '{self.conf.mode}', expected 'polling' or 'webhook'.")
+
+        return await self.dp.start_polling(self, handle_signals=handle_signals)
+
+    async def stop(self):
+        if not self.shard.primary:
+            return self.shard.stop()
+
+        if self.webhook is not None:
+            return self.webhook.stop()
+
+        try:
+            await self.dp.stop_polling()
+        except RuntimeError:  # Not polling (yet).
+            pass
+
     def run(self):
-        return self.dp.run_polling(self)
+        return asyncio.run(self.serve())
 
-    async def send_message(self, *args, **kwds) -> Message:
-        while 1:
-            try:
-                return await super().send_message(*args, **kwds)
-            except aiogram.exceptions.TelegramRetryAfter as ex:
-                log.warning("Throttled: %s", ex)
-                await asyncio.sleep(ex.retry_after)
+    @staticmethod
+    def run_all(bots: List[HydraBot]):
+        """Serve several bots in one event loop until SIGINT or SIGTERM stops them all.
+        """
+        if len(bots) == 1:
+            return bots[0].run()
+
+        if sum(bot.conf.mode == "webhook" for bot in bots) > 1:
+            raise ValueError("Only one bot per process can run in webhook mode.")
 
-    async def command(self, msg, fn, *args, **kwds):
+        async def serve():
+            loop = asyncio.get_running_loop()
+
+            def stop():
+                for bot in bots:
+                    loop.create_task(bot.stop())
+
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, stop)
+                except NotImplementedError:  # Windows.
+                    pass
+
+            await asyncio.gather(*(bot.serve(handle_signals=False) for bot in bots))
+
+        return asyncio.run(serve())
+
+    async def send_message(self, *args, lane: Optional[Lane] = None, **kwds) -> Message:
+        # Throttling (TelegramRetryAfter) is handled per chat by self.sched.
+        with SendScheduler.lane(lane):
+            return await super().send_message(*args, **kwds)
+
+    async def command(self, msg, fn, *args, locked: bool = False, **kwds):
+        """Run a command handler, reporting errors to the chat.
+
+        A `locked` command (one that changes the user) waits for the sender's
+        previous locked commands to finish; other users aren't held up.
+        """
         # noinspection PyBroadException
         try:
+            if locked:
+                async with HydraBotData.user_lock(msg.from_user.id):
+                    return await fn(self, msg, *args, **kwds)
+
             return await fn(self, msg, *args, **kwds)
         except BaseException as error:
             try:
@@ -7,8 +7,11 @@ from aiogram import types
 from attrdict import AttrDict
 # from emoji import UNICODE_EMOJI_ENGLISH
 
+from hybot.util.prices import PriceSnapshot
+
 from . import HydraBot
 from .data import HydraBotData, schemas
+from .sched import Lane
 
 _ADDR_SHOW_PREV: Dict[int, int] = {}
 
@@ -173,7 +176,11 @@ async def addr(bot: HydraBot, msg: types.Message):
 
 
 async def addr_add(bot: HydraBot, msg: types.Message, u: schemas.User, address: str, label: str = ""):
-    user_addr: schemas.UserAddr = await bot.db.asyncc.user_addr_add(u, address, label)
+    try:
+        user_addr: schemas.UserAddr = await bot.db.asyncc.user_addr_add(u, address, label)
+    finally:
+        HydraBotData.user_changed(u.tg_user_id)
+
     addr_: schemas.Addr = user_addr.addr
 
     tp_str = (
@@ -200,12 +207,15 @@ async def addr_add(bot: HydraBot, msg: types.Message, u: schemas.User, address:
 async def addr_rename(bot: HydraBot, msg: types.Message, u: schemas.User, address: str, name: str):
     for ua in u.user_addrs:
         if str(ua.addr) == address or address == ua.name:
-            update_result: schemas.UserAddrUpdate.Result = await bot.db.asyncc.user_addr_upd(
-                user_addr=ua,
-                addr_update=schemas.UserAddrUpdate(
-                    name=name
+            try:
+                update_result: schemas.UserAddrUpdate.Result = await bot.db.asyncc.user_addr_upd(
+                    user_addr=ua,
+                    addr_update=schemas.UserAddrUpdate(
+                        name=name
+                    )
                 )
-            )
+            finally:
+                HydraBotData.user_changed(u.tg_user_id)
 
             if update_result.updated:
                 ua.name = name
@@ -225,7 +235,11 @@ async def addr_rename(bot: HydraBot, msg: types.Message, u: schemas.User, addres
 async def addr_del(bot: HydraBot, msg: types.Message, u: schemas.User, address: str):
     for ua in u.user_addrs:
         if str(ua.addr) == address or address.lower() == ua.name.lower():
-            delete_result: schemas.DeleteResult = await bot.db.asyncc.user_addr_del(ua)
+            try:
+                delete_result: schemas.DeleteResult = await bot.db.asyncc.user_addr_del(ua)
+            finally:
+                HydraBotData.user_changed(u.tg_user_id)
+
             if delete_result.deleted:
                 u.user_addrs.remove(ua)
                 return await msg.answer(
@@ -240,7 +254,8 @@ async def addr_del(bot: HydraBot, msg: types.Message, u: schemas.User, address:
 async def addr_show(bot: HydraBot, chat_id: int, u: Union[schemas.User, schemas.UserBase],
                     ua: Optional[Union[schemas.UserAddrBase, schemas.UserAddrResult]],
                     addr_: Optional[schemas.Addr] = None,
-                    *, render: bool = False) -> Union[str, bool]:
+                    *, render: bool = False, prices: Optional[PriceSnapshot] = None,
+                    lane: Optional[Lane] = None) -> Union[str, bool]:
     if ua is None:
         if not isinstance(u, schemas.User):
             raise TypeError("Must provide User (not UserBase) when ua is None.")
@@ -294,11 +309,23 @@ async def addr_show(bot: HydraBot, chat_id: int, u: Union[schemas.User, schemas.
     hydra_fiat_value = Decimal(0)
     currency = u.info.get("fiat", "USD")
 
+    if prices is None:
+        prices = bot.price_snapshot()
+
+    await prices.extend(
+        ([("HYDRA", currency)] if balance else []) + [
+            (tb["symbol"], currency)
+            for tb in info.get("qrc20Balances", [])
+            if tb["symbol"] in bot.price_client_map.keys() and int(tb["balance"]) > 0
+            and (not len(ua.token_l) or tb["addressHex"] in ua.token_l)
+        ]
+    )
+
     if balance:
-        hydra_fiat_value = await bot.hydra_fiat_value_dec(currency, balance)
+        hydra_fiat_value = prices.value_dec("HYDRA", currency, balance)
         total_fiat_value += hydra_fiat_value
         fiat_value = bot.fiat_value_format(currency, hydra_fiat_value, with_name=True)
-        fiat_price = await bot.hydra_fiat_value(currency, 1 * 10**8, with_name=False)
+        fiat_price = prices.value("HYDRA", currency, 1 * 10**8, with_name=False)
 
         message.append(
             f"<b>Value:</b> {fiat_value} @ <b>{fiat_price}</b>"
@@ -340,7 +367,7 @@ async def addr_show(bot: HydraBot, chat_id: int, u: Union[schemas.User, schemas.
 
             if tb.symbol in bot.price_client_map.keys():
                 try:
-                    tb.fiat_value = await bot.fiat_value_dec_of(
+                    tb.fiat_value = prices.value_dec(
                         tb.symbol,
                         currency,
                         schemas.Addr.decimal(tb.balance, decimals=tb.decimals)
@@ -363,7 +390,7 @@ async def addr_show(bot: HydraBot, chat_id: int, u: Union[schemas.User, schemas.
                 tb.fiat_value = f" ~ {tb.fiat_value}"
 
                 if tb.symbol in bot.price_client_map.keys():
-                    fiat_price = await bot.fiat_value_of(tb.symbol, currency, schemas.Addr.decimal(1 * 10**tb.decimals, decimals=tb.decimals), with_name=False)
+                    fiat_price = prices.value(tb.symbol, currency, schemas.Addr.decimal(1 * 10**tb.decimals, decimals=tb.decimals), with_name=False)
                     tb.fiat_value += f" @ <b>{fiat_price}</b>"
             else:
                 tb.fiat_value = ""
@@ -523,7 +550,8 @@ async def addr_show(bot: HydraBot, chat_id: int, u: Union[schemas.User, schemas.
             chat_id=chat_id,
             text=message,
             parse_mode="HTML",
-            reply_markup=inline_keyboard
+            reply_markup=inline_keyboard,
+            lane=lane
         )
 
     else:
@@ -0,0 +1,177 @@
+"""Per-block notification processing state.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+from hydb.api.schemas import Block, BlockSSEResult
+
+from hybot.util.prices import PriceSnapshot
+from .fanout import FanOutBatch
+from .mailbox import Mailbox
+from .sched import Lane
+from .shed import Shed
+
+__all__ = "BlockContext", "BlockIndex", "AddrTx"
+
+
+class AddrTx:
+    """What one transaction holds for one address.
+    """
+    __slots__ = "n", "value_in", "value_out", "utxo_in", "utxo_out", "utxo_out_value", "tokens"
+
+    n: int
+    value_in: int
+    value_out: int
+    utxo_in: int
+    utxo_out: int
+    utxo_out_value: int
+    tokens: List[dict]
+
+    def __init__(self, n: int):
+        self.n = n
+        self.value_in = 0
+        self.value_out = 0
+        self.utxo_in = 0
+        self.utxo_out = 0
+        self.utxo_out_value = 0
+        self.tokens = []
+
+
+class BlockIndex:
+    """One pass over a block's transactions, indexed by txid and by address.
+
+    Inputs and outputs are filed by `addressHex` (falling back to `address`)
+    for the value sums, and by `address` for the UTXO counts. Token transfers
+    are filed by sender and recipient, and by the token contract for
+    transfers between two other addresses.
+    """
+    txno: Dict[str, int]
+    txes: Dict[int, dict]
+    coinstake: Optional[int]
+
+    _addrs: Dict[str, Dict[int, AddrTx]]
+
+    def __init__(self, block: Block):
+        self.txno = {txid: n for n, txid in enumerate(block.info.get("transactions", []))}
+        self.txes = {}
+        self._addrs = {}
+
+        for trxn in block.tx:
+            n = self.txno.get(trxn.get("id"), None)
+
+            if n is None:
+                continue
+
+            self.txes[n] = trxn
+
+            for inp in trxn.get("inputs", []):
+                value = int(inp.get("value", 0))
+                key = inp.get("addressHex", inp.get("address"))
+
+                if key is not None:
+                    self.__entry(key, n).value_in += value
+
+                if value and inp.get("address") is not None:
+                    self.__entry(inp["address"], n).utxo_in += 1
+
+            for out in trxn.get("outputs", []):
+                value = int(out.get("value", 0))
+                key = out.get("addressHex", out.get("address"))
+
+                if key is not None:
+                    self.__entry(key, n).value_out += value
+
+                if value and out.get("address") is not None:
+                    entry = self.__entry(out["address"], n)
+                    entry.utxo_out += 1
+                    entry.utxo_out_value += value
+
+            for transfer in trxn.get("qrc20TokenTransfers", []) + trxn.get("qrc721TokenTransfers", []):
+                addr_send = transfer.get("fromHex", transfer.get("from", None))
+                addr_recv = transfer.get("toHex", transfer.get("to", None))
+                addr_smac = transfer.get("addressHex", None)
+
+                keys = {addr_send, addr_recv}
+
+                if addr_smac != addr_send and addr_smac != addr_recv:
+                    keys.add(addr_smac)
+
+                for key in keys - {None}:
+                    self.__entry(key, n).tokens.append(transfer)
+
+        self.coinstake = self.txno.get(block.tx[1].get("id"), None) if len(block.tx) > 1 else None
+
+    def __entry(self, key: str, n: int) -> AddrTx:
+        entries = self._addrs.setdefault(key, {})
+        entry = entries.get(n, None)
+
+        if entry is None:
+            entry = entries[n] = AddrTx(n)
+
+        return entry
+
+    def entries(self, key: str) -> Dict[int, AddrTx]:
+        return self._addrs.get(key, {})
+
+    def entry(self, key: str, n: Optional[int]) -> Optional[AddrTx]:
+        return self._addrs.get(key, {}).get(n, None)
+
+    def numbers(self, keys: Iterable[Optional[str]]) -> List[int]:
+        """Sorted numbers of the transactions that involve any of `keys`.
+        """
+        return sorted({n for key in keys if key is not None for n in self._addrs.get(key, {})})
+
+
+class BlockContext:
+    """State shared by every notification rendered for one BlockSSEResult.
+    """
+    result: BlockSSEResult
+    block: Block
+    fan: FanOutBatch
+    cards: FanOutBatch
+    mail: Mailbox
+    prices: PriceSnapshot
+    index: BlockIndex
+    lane: Optional[Lane]
+    shed: Shed
+
+    _rendered: Dict[Hashable, Any]
+    hits: int
+    filtered: int
+    unreachable: int
+
+    def __init__(self, result: BlockSSEResult, fan: FanOutBatch, prices: PriceSnapshot, lane: Optional[Lane] = None, shed: Shed = Shed.FULL):
+        self.result = result
+        self.block = result.block
+        self.fan = fan
+        self.cards = fan.fan.batch()  # Address cards, sent after the merged notifications.
+        self.mail = Mailbox()
+        self.prices = prices
+        self.index = BlockIndex(self.block)
+        self.lane = lane  # Overrides the lane of every message for this block (e.g. catch-up).
+        self.shed = shed
+        self._rendered = {}
+        self.hits = 0
+        self.filtered = 0  # TX notifications skipped by block.min.
+        self.unreachable = 0  # Notifications skipped for dead chats.
+
+    def render(self, key: Hashable, render: Callable[[], Any]) -> Any:
+        """Return the body rendered for `key` in this block, calling `render()` the first time.
+
+        Keys look like (address, kind, config values, currency): everything the
+        shared part of a message depends on. Bodies are immutable (tuples of
+        lines), with per-recipient headers and times added by the caller.
+        """
+        try:
+            body = self._rendered[key]
+        except KeyError:
+            body = self._rendered[key] = render()
+        else:
+            self.hits += 1
+
+        return body
+
+    @property
+    def rendered(self) -> int:
+        return len(self._rendered)
@@ -0,0 +1,273 @@
+"""Admin announcements to every user.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from aiogram import types
+from attrdict import AttrDict
+
+from hydra import log
+
+from hybot.util.conf import Config
+from . import HydraBot
+from .recipients import Recipients
+from .sched import Lane
+
+__all__ = "Broadcaster", "broadcast"
+
+
+@Config.defaults
+class Broadcaster:
+    """Background jobs sending one message to every user of a bot.
+
+    The bot's users when the job starts are stored with it. They are read
+    back in tg_user_id order, a page at a time, and sent on Lane.BROADCAST
+    so its bucket keeps the job well below live traffic. The job's cursor
+    and counts are saved after each page, so a restart resumes reading after
+    the last completed page instead of starting over.
+    """
+    conf: AttrDict
+    bot: HydraBot
+    path: str
+    db: sqlite3.Connection
+
+    CONF = {
+        "file": "broadcast.db",  # Relative to Config.APP_BASE.
+        "page": 20,
+    }
+
+    RUNNING = 0
+    DONE = 1
+    CANCELLED = 2
+
+    STATE = {
+        RUNNING: "running",
+        DONE: "done",
+        CANCELLED: "cancelled",
+    }
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS job (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            state INTEGER NOT NULL DEFAULT 0,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            delivered INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created REAL NOT NULL,
+            finished REAL
+        );
+        CREATE TABLE IF NOT EXISTS recipient (
+            job INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            PRIMARY KEY (job, chat_id)
+        ) WITHOUT ROWID;
+    """
+
+    _tasks: Dict[int, asyncio.Task]
+
+    def __init__(self, bot: HydraBot, path: Optional[str] = None):
+        self.conf = Config.get(Broadcaster, defaults=True)
+        self.bot = bot
+        self.path = path or os.path.join(Config.APP_BASE, self.conf.file)
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self.db = sqlite3.connect(self.path, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(Broadcaster.SCHEMA)
+
+        self._tasks = {}
+
+    def close(self):
+        for task in self._tasks.values():
+            task.cancel()
+
+        self.db.close()
+
+    @staticmethod
+    def row(row: sqlite3.Row) -> AttrDict:
+        return AttrDict({key: row[key] for key in row.keys()})
+
+    def job(self, job_id: int) -> Optional[AttrDict]:
+        row = self.db.execute("SELECT * FROM job WHERE id = ?", (job_id,)).fetchone()
+        return Broadcaster.row(row) if row is not None else None
+
+    def jobs(self, limit: int = 5) -> List[AttrDict]:
+        return [Broadcaster.row(row) for row in self.db.execute("SELECT * FROM job ORDER BY id DESC LIMIT ?", (limit,))]
+
+    def start(self, text: str) -> AttrDict:
+        self.db.execute("BEGIN")
+
+        try:
+            job_id = self.db.execute("INSERT INTO job (text, created) VALUES (?, ?)", (text, time.time())).lastrowid
+
+            total = self.db.executemany(
+                "INSERT OR IGNORE INTO recipient (job, chat_id) VALUES (?, ?)", ((job_id, chat_id) for chat_id in self.bot.users())
+            ).rowcount
+
+            self.db.execute("UPDATE job SET total = ? WHERE id = ?", (total, job_id))
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+        self.db.execute("COMMIT")
+
+        self.__spawn(job_id)
+        return self.job(job_id)
+
+    def __page(self, job_id: int, cursor: int) -> List[int]:
+        return [
+            row["chat_id"]
+            for row in self.db.execute(
+                "SELECT chat_id FROM recipient WHERE job = ? AND chat_id > ? ORDER BY chat_id LIMIT ?",
+                (job_id, cursor, self.conf.page)
+            )
+        ]
+
+    def resume(self):
+        """Restart the jobs a previous run left running.
+        """
+        for row in self.db.execute("SELECT id FROM job WHERE state = ?", (Broadcaster.RUNNING,)).fetchall():
+            log.info(f"Broadcast #{row['id']}: resuming.")
+            self.__spawn(row["id"])
+
+    def cancel(self, job_id: int) -> bool:
+        cur = self.db.execute(
+            "UPDATE job SET state = ?, finished = ? WHERE id = ? AND state = ?",
+            (Broadcaster.CANCELLED, time.time(), job_id, Broadcaster.RUNNING)
+        )
+
+        task = self._tasks.pop(job_id, None)
+
+        if task is not None:
+            task.cancel()
+
+        self.db.execute("DELETE FROM recipient WHERE job = ?", (job_id,))
+
+        return bool(cur.rowcount)
+
+    def __spawn(self, job_id: int):
+        self._tasks[job_id] = asyncio.get_event_loop().create_task(self.__run(job_id))
+
+    async def __run(self, job_id: int):
+        job = self.job(job_id)
+        cursor = job.cursor
+
+        try:
+            while 1:
+                page = self.__page(job_id, cursor)
+
+                if not page:
+                    break
+
+                cursor = page[-1]
+                results = await asyncio.gather(*(self.__send(chat_id, job.text) for chat_id in page))
+
+                self.db.execute(
+                    "UPDATE job SET cursor = ?, delivered = delivered + ?, failed = failed + ?, blocked = blocked + ? "
+                    "WHERE id = ? AND state = ?",
+                    (
+                        page[-1], results.count("delivered"), results.count("failed"), results.count("blocked"),
+                        job_id, Broadcaster.RUNNING
+                    )
+                )
+
+        except asyncio.CancelledError:
+            log.info(f"Broadcast #{job_id}: stopped.")
+            return
+
+        finally:
+            self._tasks.pop(job_id, None)
+
+        self.db.execute(
+            "UPDATE job SET state = ?, finished = ? WHERE id = ? AND state = ?",
+            (Broadcaster.DONE, time.time(), job_id, Broadcaster.RUNNING)
+        )
+
+        self.db.execute("DELETE FROM recipient WHERE job = ?", (job_id,))
+
+        job = self.job(job_id)
+
+        log.info(f"Broadcast #{job_id}: {Broadcaster.report(job)}")
+
+        try:
+            await self.bot.send_message(chat_id=self.bot.conf.admin, text=f"Broadcast #{job_id} finished: {Broadcaster.report(job)}")
+        except Exception as exc:
+            log.warning(f"Broadcast #{job_id}: unable to report to admin: {exc}")
+
+    async def __send(self, chat_id: int, text: str) -> str:
+        """Send to one user, returning "delivered", "failed" or "blocked".
+        """
+        recipients = self.bot.recipients
+
+        if not recipients.reachable(chat_id):
+            return "blocked"
+
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, lane=Lane.BROADCAST)
+
+        except Exception as exc:
+            if Recipients.is_dead_error(exc):
+                recipients.dead(chat_id, str(exc))
+                return "blocked"
+
+            log.debug(f"Broadcast to {chat_id} failed: {exc}")
+            return "failed"
+
+        recipients.alive(chat_id)
+        return "delivered"
+
+    @staticmethod
+    def report(job: AttrDict) -> str:
+        done = job.delivered + job.failed + job.blocked
+
+        return (
+            f"{Broadcaster.STATE[job.state]}, {done} of {job.total} users: "
+            f"{job.delivered} delivered, {job.failed} failed, {job.blocked} blocked."
+        )
+
+
+async def broadcast(bot: HydraBot, msg: types.Message):
+    if msg.chat.id != msg.from_user.id or msg.from_user.id != bot.conf.admin:
+        return
+
+    parts = msg.html_text.split(None, 1)
+    args = parts[1].strip() if len(parts) > 1 else ""
+
+    if not args:
+        jobs = bot.broadcaster.jobs()
+
+        return await msg.answer(
+            "<b>Broadcast.</b>\n\n"
+            "<pre>"
+            "Send:   /broadcast [message]\n"
+            "Cancel: /broadcast cancel [id]"
+            "</pre>\n\n" +
+            ("\n".join(f"#{job.id}: {Broadcaster.report(job)}" for job in jobs) if jobs else "No broadcasts yet.")
+        )
+
+    cmd = args.split()
+
+    if cmd[0].lower() == "cancel" and len(cmd) == 2 and cmd[1].lstrip("#").isnumeric():
+        job_id = int(cmd[1].lstrip("#"))
+
+        if not bot.broadcaster.cancel(job_id):
+            return await msg.answer(f"Broadcast #{job_id} isn't running.")
+
+        return await msg.answer(f"Broadcast #{job_id} cancelled: {Broadcaster.report(bot.broadcaster.job(job_id))}")
+
+    job = bot.broadcaster.start(args)
+
+    return await msg.answer(
+        f"Broadcast #{job.id} started for {job.total} users.\n"
+        f"Cancel with <b>/broadcast cancel {job.id}</b>"
+    )
@@ -1,5 +1,9 @@
 from __future__ import annotations
-from typing import Optional, Union, Tuple, Dict, Callable, Any
+import re
+from collections import OrderedDict
+from copy import deepcopy
+from decimal import Decimal
+from typing import Optional, Union, Tuple, Dict, Callable, Any, Iterable
 
 from aiogram import types
 from attrdict import AttrDict
@@ -10,10 +14,47 @@ from .addr import human_type
 
 CONF_STD = "show", "hide", "full"
 
+MIN_RE = re.compile(r"^(\d+(?:\.\d+)?)([a-z]{3,5})?$")
+
+
+def min_parse(value: str, currencies: Optional[Iterable[str]] = None) -> Optional[str]:
+    """Normalize a `block.min` value: an amount in HYDRA ("0.5") or a fiat currency ("5usd" -> "5USD").
+
+    With `currencies`, a fiat currency not among them is invalid.
+    """
+    match = MIN_RE.match(value.strip().lower())
+
+    if match is None:
+        return None
+
+    amount, currency = match.groups()
+
+    if currency is None or currency == "hydra":
+        return amount
+
+    if currencies is not None and currency.upper() not in currencies:
+        return None
+
+    return f"{amount}{currency.upper()}"
+
+
+def min_value(value: str) -> Tuple[Decimal, Optional[str]]:
+    """(amount, fiat currency or None for HYDRA) for a normalized `block.min` value.
+    """
+    match = MIN_RE.match(str(value).lower())
+
+    if match is None:
+        return Decimal(0), None
+
+    amount, currency = match.groups()
+
+    return Decimal(amount), currency.upper() if currency is not None else None
+
+
 CONF_SECTIONS = AttrDict(
     block=dict(
         notify=dict(
-            conf=("here", "priv", "both", "hide"),
+            conf=("here", "priv", "both", "digest", "hide"),
             default="priv",
             label="Notifications for new blocks",
             show=lambda v: v if not isinstance(v, int) else "(notifying in group only with 'here')" if v < 0 else "(notifying in dm and group with 'both')",
@@ -25,6 +66,13 @@ CONF_SECTIONS = AttrDict(
         stake=dict(conf=CONF_STD, default="hide", label="Show staking info on new blocks"),
         mature=dict(conf=CONF_STD, default="hide", label="Notify on block mature"),
         total=dict(conf=CONF_STD, default="hide", label="Show total mined on new block"),
+        min=dict(
+            conf=("[amount]", "[amount][fiat]"),
+            default="0",
+            label="Minimum TX value to notify, in HYDRA or fiat (e.g. 0.5 or 5usd)",
+            show=lambda v: "no minimum" if not min_value(v)[0] else f"{min_value(v)[0]} {min_value(v)[1] or 'HYDRA'}",
+            parse=lambda bot, v: min_parse(v, bot.prices.currencies)
+        ),
     )
 )
 
@@ -113,12 +161,15 @@ async def conf(bot: HydraBot, msg: types.Message):
     if len(cmds) != 3 or \
             cmds[0] not in CONF_SECTIONS or \
             cmds[1] not in CONF_SECTIONS[cmds[0]] or \
-            cmds[2] not in (CONF_SECTIONS[cmds[0]][cmds[1]]["conf"] + ("-",)):
+            Config.parse(bot, cmds[0], cmds[1], cmds[2]) is None:
+        if len(cmds) == 3 and cmds[:2] == ["block", "min"] and MIN_RE.match(cmds[2]):
+            return await msg.answer("Unknown currency, see <b>/fiat list</b>.")
+
         return await msg.answer("Invalid command or config value.")
 
     section = cmds[0]
     name = cmds[1]
-    value = cmds[2]
+    value = Config.parse(bot, section, name, cmds[2])
 
     if name == "notify" and value in ("here", "both"):
         if msg.chat.id == msg.from_user.id:
@@ -171,6 +222,23 @@ class Config(schemas.BaseModel):
 
         return getattr(getattr(CONF_SECTIONS, section), name)
 
+    @staticmethod
+    def parse(bot: HydraBot, section: str, name: str, value: str) -> Optional[str]:
+        """The value to store for `value` as typed in /conf, or None if it isn't valid.
+
+        Settings with a `parse(bot, value)` function accept free-form values, the rest one of their `conf` choices.
+        """
+        if value == "-":
+            return value
+
+        conf_info = Config.info(section, name)
+        parse = conf_info.get("parse", None)
+
+        if parse is not None:
+            return parse(bot, value)
+
+        return value if value in conf_info.conf else None
+
     @staticmethod
     def get(u: schemas.UserBase, ua: Optional[schemas.UserAddrBase], section: str, name: str) -> Config:
         uic = CONF(u.info)
@@ -178,6 +246,25 @@ class Config(schemas.BaseModel):
 
         conf_info = Config.info(section, name)
 
+        value, is_ua = Config.resolve(uic, uaic, section, name)
+
+        return Config(
+            user=u,
+            user_addr=ua,
+            section=section,
+            name=name,
+            label=conf_info.label,
+            conf=conf_info.conf,
+            default=conf_info.default,
+            value=value,
+            is_ua=is_ua,
+            show=conf_info.get("show", str)
+        )
+
+    @staticmethod
+    def resolve(uic: Dict, uaic: Optional[Dict], section: str, name: str) -> Tuple[Optional[Any], bool]:
+        """Look up a value in the address then user conf dicts, returning (value, is_ua).
+        """
         is_ua = False
         db_conf = uic
 
@@ -194,18 +281,7 @@ class Config(schemas.BaseModel):
             else:
                 value = None
 
-        return Config(
-            user=u,
-            user_addr=ua,
-            section=section,
-            name=name,
-            label=conf_info.label,
-            conf=conf_info.conf,
-            default=conf_info.default,
-            value=value,
-            is_ua=is_ua,
-            show=conf_info.get("show", str)
-        )
+        return value, is_ua
 
     async def set(self, bot: HydraBot, value: Optional[Any]) -> Optional[schemas.UpdateResult]:
         if value != "-" and value is not None:
@@ -233,20 +309,25 @@ class Config(schemas.BaseModel):
             config.setdefault(self.section, {})[self.name] = self.value
 
         if self.value is not None or deleted:
+            ConfSnapshot.invalidate(self.user, self.user_addr)
 
             if is_ua:
-                return await bot.db.asyncc.user_addr_upd(
-                    user_addr=self.user_addr,
-                    addr_update=schemas.UserAddrUpdate(
-                        info=self.user_addr.info,
-                        over=False
+                try:
+                    return await bot.db.asyncc.user_addr_upd(
+                        user_addr=self.user_addr,
+                        addr_update=schemas.UserAddrUpdate(
+                            info=self.user_addr.info,
+                            over=False
+                        )
                     )
-                )
+                finally:
+                    HydraBotData.user_changed(self.user.tg_user_id)
 
             else:
-                return await bot.db.asyncc.user_info_put(
-                    user=self.user,
-                    info=self.user.info,
+                return await HydraBotData.user_info_put(
+                    bot,
+                    self.user,
+                    self.user.info,
                     over=False,
                 )
 
@@ -270,6 +351,9 @@ class Config(schemas.BaseModel):
                 deleted = True
                 del config[self.section]
 
+        if deleted:
+            ConfSnapshot.invalidate(self.user, self.user_addr if self.is_ua else None)
+
         # Allow empty config, otherwise dict.update() doesn't work.
         #
         # if not len(config):
@@ -277,3 +361,105 @@ class Config(schemas.BaseModel):
         #     del info["conf"]
 
         return deleted
+
+
+class ConfSection:
+    """Read-only values for one CONF_SECTIONS section, one slot per setting.
+    """
+    __slots__ = ()
+
+    def __init__(self, values: Dict[str, Any]):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{n}={getattr(self, n)!r}' for n in self.__slots__)})"
+
+
+class ConfSnapshot:
+    """All CONF_SECTIONS values resolved once for a (user, user_addr).
+
+    Values are already defaulted, e.g. `ConfSnapshot.of(u, ua).block.notify`.
+    Snapshots are cached and rebuilt when `Config.set()`/`Config.delete()`
+    invalidate them or when the user or address `info["conf"]` differs from
+    the one they were built from (e.g. after a DB update). Either bumps
+    GENERATION, as do the bot's user writes; the InterestIndex rebuilds its
+    entries when it changes.
+    """
+    __slots__ = ("source",) + tuple(CONF_SECTIONS.keys())
+
+    SECTIONS = {
+        section: type(f"Conf{section.capitalize()}", (ConfSection,), {"__slots__": tuple(CONF_SECTIONS[section].keys())})
+        for section in CONF_SECTIONS.keys()
+    }
+
+    CACHE: OrderedDict[Tuple[int, Optional[int]], ConfSnapshot] = OrderedDict()
+    CACHE_MAX = 8192
+    GENERATION = 0
+
+    def __init__(self, source: Tuple[Dict, Optional[Dict]]):
+        object.__setattr__(self, "source", source)
+
+        uic, uaic = source
+
+        for section, names in CONF_SECTIONS.items():
+            values = {}
+
+            for name, conf_info in names.items():
+                value, _ = Config.resolve(uic, uaic, section, name)
+                values[name] = value if value is not None else conf_info["default"]
+
+            object.__setattr__(self, section, ConfSnapshot.SECTIONS[section](values))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("ConfSnapshot is read-only")
+
+    def __delattr__(self, key):
+        raise AttributeError("ConfSnapshot is read-only")
+
+    @staticmethod
+    def key(u: schemas.UserBase, ua: Optional[schemas.UserAddrBase]) -> Tuple[int, Optional[int]]:
+        return u.uniq.pkid, ua.pkid if ua is not None else None
+
+    @staticmethod
+    def of(u: schemas.UserBase, ua: Optional[schemas.UserAddrBase]) -> ConfSnapshot:
+        key = ConfSnapshot.key(u, ua)
+        source = u.info.get("conf", {}), ua.info.get("conf", {}) if ua is not None else None
+
+        snap = ConfSnapshot.CACHE.get(key, None)
+
+        if snap is not None:
+            if snap.source == source:
+                ConfSnapshot.CACHE.move_to_end(key)
+                return snap
+
+            ConfSnapshot.GENERATION += 1
+
+        snap = ConfSnapshot.CACHE[key] = ConfSnapshot(deepcopy(source))
+        ConfSnapshot.CACHE.move_to_end(key)
+
+        while len(ConfSnapshot.CACHE) > ConfSnapshot.CACHE_MAX:
+            ConfSnapshot.CACHE.popitem(last=False)
+
+        return snap
+
+    @staticmethod
+    def invalidate(u: schemas.UserBase, ua: Optional[schemas.UserAddrBase] = None):
+        """Drop the snapshot for (u, ua), or every snapshot of `u` when `ua` is None.
+        """
+        ConfSnapshot.GENERATION += 1
+
+        if ua is not None:
+            ConfSnapshot.CACHE.pop(ConfSnapshot.key(u, ua), None)
+            return
+
+        pkid = u.uniq.pkid
+
+        for key in [k for k in ConfSnapshot.CACHE.keys() if k[0] == pkid]:
+            del ConfSnapshot.CACHE[key]
@@ -1,49 +1,172 @@
+import asyncio
+import functools
 from typing import Optional
 
 from aiogram.types import Message
 
+from hydra import log
 from hydra.rpc import BaseRPC
 from hydb.api.client import HyDbClient, schemas
 
+from hybot.util.flight import SingleFlight, KeyedLocks
 from . import HydraBot
+from .snapshot import Snapshot
+from .users import UserCache
 
 
 class HydraBotData:
-    __CREATING__ = []
+    # Loads and creations in flight, keyed by ("get" | "add", tg_user_id).
+    FLIGHTS = SingleFlight()
+
+    # Held by a user's mutating commands so they run one at a time.
+    LOCKS = KeyedLocks()
 
     SERVER_INFO: schemas.ServerInfo
 
     PKID_CACHE = {}
 
+    USERS: UserCache
+
     @staticmethod
-    def init(db: HyDbClient):
-        HydraBotData.SERVER_INFO = db.server_info()
-        HydraBotData.PKID_CACHE = db.user_map().map
+    async def init(db: HyDbClient, snapshot: Optional[Snapshot] = None) -> bool:
+        """Load the server info and the user map concurrently.
+
+        With a `snapshot`, it is read alongside the server info and its user
+        map is used if it was taken on the server's network; the caller then
+        replaces it with user_map_load(). Returns True in that case. Without a
+        usable snapshot file the user map is fetched right away, still
+        concurrently with the server info.
+        """
+        HydraBotData.USERS = UserCache()
+
+        async def user_map_unless_snapshot():
+            if snapshot is not None:
+                await snapshot.load()
+
+                if snapshot.data is not None:
+                    return None
+
+            return await db.asyncc.user_map()
+
+        HydraBotData.SERVER_INFO, user_map = await asyncio.gather(
+            db.asyncc.server_info(),
+            user_map_unless_snapshot(),
+        )
+
+        if user_map is not None:
+            HydraBotData.PKID_CACHE = user_map.map
+            return False
+
+        users = snapshot.get("users") if snapshot.valid(HydraBotData.SERVER_INFO.mainnet) else None
+
+        if users is None:
+            # Taken on the other network; only known once the server info is in.
+            await HydraBotData.user_map_load(db)
+            return False
+
+        HydraBotData.PKID_CACHE = {int(tg_user_id): pkid for tg_user_id, pkid in users.items()}
+        return True
 
     @staticmethod
-    async def _user_load_cached(bot: HydraBot, tg_user_id: int, create: bool = False) -> Optional[schemas.User]:
+    async def user_map_load(db: HyDbClient):
+        HydraBotData.PKID_CACHE = (await db.asyncc.user_map()).map
+
+    @staticmethod
+    async def _user_load_cached(bot: HydraBot, tg_user_id: int) -> Optional[schemas.User]:
         if tg_user_id in HydraBotData.PKID_CACHE:
-            return await bot.db.asyncc.user_get(user_pk=HydraBotData.PKID_CACHE[tg_user_id])
+            u: Optional[schemas.User] = HydraBotData.USERS.get(tg_user_id)
+
+            if u is None:
+                u = await HydraBotData.FLIGHTS.do(("get", tg_user_id), functools.partial(HydraBotData.__user_get, bot, tg_user_id))
 
-        if create:
-            u: schemas.User = await bot.db.asyncc.user_add(tg_user_id)
-            HydraBotData.PKID_CACHE[tg_user_id] = u.uniq.pkid
             return u
 
         return None
 
+    @staticmethod
+    async def __user_get(bot: HydraBot, tg_user_id: int) -> Optional[schemas.User]:
+        generation = HydraBotData.USERS.generation
+        pkid = HydraBotData.PKID_CACHE[tg_user_id]
+        u: Optional[schemas.User] = await bot.db.asyncc.user_get(user_pk=pkid)
+
+        if u is not None and u.tg_user_id != tg_user_id:
+            # A stale snapshot entry whose pkid now belongs to someone else (e.g. the DB was reset).
+            log.warning(f"User map: pkid {pkid} isn't user {tg_user_id}, dropping it.")
+            u = None
+
+        if u is not None:
+            HydraBotData.USERS.put(u, generation)
+
+        elif HydraBotData.PKID_CACHE.get(tg_user_id, None) == pkid:
+            # Deleted elsewhere (or a stale snapshot entry); the user can sign up again.
+            del HydraBotData.PKID_CACHE[tg_user_id]
+
+        return u
+
+    @staticmethod
+    async def __user_add(bot: HydraBot, msg: Message) -> schemas.User:
+        tg_user_id = msg.from_user.id
+
+        # Users can't be told apart from new ones until the server's user map replaced the snapshot's.
+        await bot.startup.wait("user_map")
+
+        # Created by a call that finished while this one was being scheduled.
+        if tg_user_id in HydraBotData.PKID_CACHE:
+            return await HydraBotData._user_load_cached(bot, tg_user_id)
+
+        await msg.answer(
+            f"Welcome, <b>{msg.from_user.full_name}!</b>\n\n"
+            "One moment while I set things up..."
+        )
+
+        u: schemas.User = await bot.db.asyncc.user_add(tg_user_id)
+        HydraBotData.PKID_CACHE[tg_user_id] = u.uniq.pkid
+        HydraBotData.USERS.put(u)
+        bot.claim(tg_user_id, u.uniq.pkid)
+        return u
+
+    @staticmethod
+    def user_lock(tg_user_id: int):
+        """Context manager serializing a user's mutating commands (`async with HydraBotData.user_lock(...)`).
+        """
+        return HydraBotData.LOCKS.hold(tg_user_id)
+
+    @staticmethod
+    def user_changed(tg_user_id: int):
+        """Drop a user's cached object after writing to it; the next load fetches it again.
+
+        Also bumps ConfSnapshot.GENERATION, so that what was derived from the
+        user's conf (e.g. the InterestIndex) is rebuilt.
+        """
+        from .conf import ConfSnapshot
+
+        HydraBotData.USERS.invalidate(tg_user_id)
+        ConfSnapshot.GENERATION += 1
+
+    @staticmethod
+    async def user_info_put(bot: HydraBot, u: schemas.User, info: dict, **kwds) -> schemas.UpdateResult:
+        try:
+            return await bot.db.asyncc.user_info_put(u, info, **kwds)
+        finally:
+            HydraBotData.user_changed(u.tg_user_id)
+
     @staticmethod
     async def user_del(bot: HydraBot, u: schemas.User):
         if u.tg_user_id in HydraBotData.PKID_CACHE:
             del HydraBotData.PKID_CACHE[u.tg_user_id]
 
+        HydraBotData.user_changed(u.tg_user_id)
+        HydraBot.release(u.tg_user_id)
+
         await bot.db.asyncc.user_del(u)
 
     @staticmethod
     async def user_load(bot: HydraBot, msg: Message, create: bool = True, requires_start: bool = True, dm_only: bool = True) -> Optional[schemas.User]:
-        if msg.from_user.id in HydraBotData.__CREATING__:
-            raise RuntimeError("Currently creating user account!")
+        """Load the sender's user, creating it if `create`.
 
+        Messages arriving while the account is being created wait for it and
+        get the same user instead of failing.
+        """
         if msg.chat.id < 0 and dm_only:
             await msg.reply(f"Hi {msg.from_user.first_name}, that function is only available in a private chat.")
             return
@@ -57,20 +180,9 @@ class HydraBotData:
 
         if u is None:
             if create:
-                if msg.from_user.id in HydraBotData.__CREATING__:
-                    raise RuntimeError("Currently creating user account!")
-
-                HydraBotData.__CREATING__.append(msg.from_user.id)
-
-                try:
-                    await msg.answer(
-                        f"Welcome, <b>{msg.from_user.full_name}!</b>\n\n"
-                        "One moment while I set things up..."
-                    )
-
-                    return await HydraBotData._user_load_cached(bot, msg.from_user.id, create=True)
-                finally:
-                    HydraBotData.__CREATING__.remove(msg.from_user.id)
+                return await HydraBotData.FLIGHTS.do(
+                    ("add", msg.from_user.id), functools.partial(HydraBotData.__user_add, bot, msg)
+                )
             else:
                 return None
 
@@ -0,0 +1,165 @@
+"""Windowed digests for users with `block.notify` set to digest.
+"""
+from __future__ import annotations
+
+import json
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from attrdict import AttrDict
+
+from hydra import log
+from hydb.api.schemas import BlockSSEResult, UserAddrResult, UserBase
+
+from hybot.util.conf import Config
+from .outbox import Outbox, OutboxKey
+from .summary import AddrTally, Summary
+
+__all__ = "Digest",
+
+
+@Config.defaults
+class Digest:
+    """Per-user running tallies, released once a user's window has passed.
+
+    Events are folded into one Summary per user as they arrive, so the
+    buffer grows with the number of users and addresses, not events.
+    With an `outbox`, the tallies changed by an event are written to it by
+    `save()` before the event is marked processed, and restored at the next
+    start; a digest is dropped from it by `done()` once stored as a message.
+    """
+    conf: AttrDict
+    outbox: Optional[Outbox]
+
+    CONF = {
+        "window": 3600,  # Seconds from a user's first buffered event to their digest.
+        "check": 60,     # Seconds between checks for due digests.
+    }
+
+    _users: Dict[int, Summary]
+    _started: Dict[int, float]
+    _keys: Dict[int, OutboxKey]
+    _dirty: Set[int]
+    _popped: Dict[int, float]
+
+    def __init__(self, outbox: Optional[Outbox] = None):
+        self.conf = Config.get(Digest, defaults=True)
+        self.outbox = outbox
+        self._users = {}
+        self._started = {}
+        self._keys = {}
+        self._dirty = set()
+        self._popped = {}
+
+        if outbox is not None:
+            self.__restore()
+
+    def __len__(self):
+        return len(self._users)
+
+    def __restore(self):
+        for entry in self.outbox.digests():
+            try:
+                data = json.loads(entry.data)
+                summary = Summary()
+
+                for tally in data["tallies"]:
+                    summary.add(AddrTally.load(tally))
+
+            except (ValueError, KeyError, TypeError) as exc:
+                log.warning(f"Digest: dropping unreadable digest for user {entry.user}: {exc}")
+                self.outbox.digest_del(entry.user, entry.started)
+                continue
+
+            if not summary.users:
+                self.outbox.digest_del(entry.user, entry.started)
+                continue
+
+            summary.height(data["first"])
+            summary.height(data["last"])
+
+            self._users[entry.user] = summary
+            self._started[entry.user] = entry.started
+            self._keys[entry.user] = tuple(entry.key)
+
+        if self._users:
+            log.info(f"Digest: restored {len(self._users)} digest{'s' if len(self._users) != 1 else ''} in progress.")
+
+    def tally(self, result: BlockSSEResult, ua: UserAddrResult) -> AddrTally:
+        """The running tally of `ua` in its user's current window.
+        """
+        tg_user_id = ua.user.tg_user_id
+        summary = self._users.get(tg_user_id, None)
+
+        if summary is None:
+            summary = self._users[tg_user_id] = Summary()
+            self._started[tg_user_id] = time.time()
+
+        summary.height(result.block.height)
+        self._keys[tg_user_id] = Outbox.key(result)
+        self._dirty.add(tg_user_id)
+
+        return summary.tally(ua)
+
+    def save(self):
+        """Write the tallies changed since the last call to the outbox.
+        """
+        dirty, self._dirty = self._dirty, set()
+
+        if self.outbox is None:
+            return
+
+        for tg_user_id in dirty:
+            summary = self._users.get(tg_user_id, None)
+
+            if summary is None:
+                continue
+
+            self.outbox.digest_put(
+                tg_user_id,
+                self._keys[tg_user_id],
+                self._started[tg_user_id],
+                json.dumps(dict(
+                    first=summary.first,
+                    last=summary.last,
+                    tallies=[tally.dump() for tally in summary.tallies.get(tg_user_id, {}).values()],
+                ), separators=(",", ":"))
+            )
+
+    def due(self, flush: bool = False) -> List[Tuple[OutboxKey, UserBase, int, int, List[AddrTally]]]:
+        """Pop the digests whose window has passed (or all of them with `flush`).
+
+        Each is (outbox key of the last event, user, first height, last height, tallies).
+        """
+        now = time.time()
+        due = []
+
+        for tg_user_id, started in list(self._started.items()):
+            if not flush and now - started < self.conf.window:
+                continue
+
+            summary = self._users.pop(tg_user_id)
+            key = self._keys.pop(tg_user_id)
+            del self._started[tg_user_id]
+
+            self._dirty.discard(tg_user_id)
+            self._popped[tg_user_id] = started
+
+            u = summary.users[tg_user_id]
+            tallies = summary.pop(tg_user_id)
+
+            if tallies:
+                due.append((key, u, summary.first, summary.last, tallies))
+
+        return due
+
+    def done(self):
+        """Drop the digests popped by `due()` from the outbox, once they are stored as messages.
+        """
+        popped, self._popped = self._popped, {}
+
+        if self.outbox is None:
+            return
+
+        for tg_user_id, started in popped.items():
+            self.outbox.digest_del(tg_user_id, started)
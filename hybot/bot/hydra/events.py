@@ -1,5 +1,7 @@
 import asyncio
-from typing import Generator, Optional, List, Dict, Union
+import functools
+import time
+from typing import Generator, Optional, List, Dict, Tuple, Union
 from datetime import datetime, timedelta
 from decimal import Decimal
 
@@ -13,25 +15,94 @@ from hydb.api.schemas import *
 
 from hybot.bot.hydra import HydraBot
 from hybot.bot.hydra.addr import addr_show, addr_link, addr_link_str
-from hybot.bot.hydra.conf import Config
+from hybot.bot.hydra.block import BlockContext, BlockIndex
+from hybot.bot.hydra.conf import ConfSnapshot, min_value
+from hybot.bot.hydra.data import HydraBotData
+from hybot.bot.hydra.digest import Digest
+from hybot.bot.hydra.fanout import FanOut
+from hybot.bot.hydra.ingest import EventQueue
+from hybot.bot.hydra.interest import InterestIndex
+from hybot.bot.hydra.mailbox import Mailbox
+from hybot.bot.hydra.outbox import Outbox, OutboxKey
+from hybot.bot.hydra.recipients import Recipients
+from hybot.bot.hydra.sched import Lane
+from hybot.bot.hydra.shed import LoadShedder, Shed
+from hybot.bot.hydra.summary import AddrTally, Summary
+from hybot.util.conf import Config as AppConfig
 from hybot.util.misc import ordinal
 
 
+@AppConfig.defaults
 class EventManager:
     bot: HydraBot
-    
+    conf: AttrDict
+    fanout: FanOut
+    queue: EventQueue
+    outbox: Outbox
+    digest: Digest
+    interest: InterestIndex
+    shed: LoadShedder
+
+    _catchup: List[BlockSSEResult]
+    _connected: float
+    _shed_events: List[BlockSSEResult]
+    _shed_summary: Optional[Summary]
+
+    # One per bot; the first reads the SSE stream (or the shard pipe) for all of them.
+    ALL: List["EventManager"] = []
+
+    CONF = {
+        "concurrency": 16,
+        "catchup_window": 10,    # Seconds after the stream (re)connects in which events count as a late backlog.
+        "catchup_summary": 10,   # More late events than this are sent as one summary per user.
+        "stats": 900,            # Seconds between stats log lines, 0 to disable.
+    }
+
     def __init__(self, bot: HydraBot):
         self.bot = bot
-        
+        self.conf = AppConfig.get(EventManager, defaults=True)
+        self.fanout = FanOut(self.conf.concurrency)
+        self.queue = EventQueue()
+        self.outbox = Outbox(bot.data_path(AppConfig.get(Outbox, defaults=True).file, sharded=True))
+        self.digest = Digest(self.outbox)
+        self.interest = InterestIndex()
+        self.shed = LoadShedder()
+        self._catchup = []
+        self._connected = 0.
+        self._shed_events = []
+        self._shed_summary = None
+
+        EventManager.ALL.append(self)
+
         @bot.dp.startup()
         async def startup():
-            asyncio.create_task(self._sse_block_task())
-        
+            if self is EventManager.ALL[0]:
+                if self.bot.shard.primary:
+                    asyncio.create_task(self._sse_block_task())
+                else:
+                    asyncio.create_task(self._shard_ingest_task())
+
+            if self.bot.shard.count > 1:
+                asyncio.create_task(self._shard_reload_task())
+
+            asyncio.create_task(self._sse_block_proc_task())
+            asyncio.create_task(self._digest_task())
+
+            if self.conf.stats:
+                asyncio.create_task(self._stats_task())
+
+        @bot.dp.shutdown()
+        async def shutdown():
+            await self.__shed_flush()
+            await self.__digest_send(flush=True)
+            self.outbox.close()
+
     async def _sse_block_task(self):
         while 1:
             try:
-                log.info("SSE block task: Running event processing loop.")
-                await self.bot.db.sse_block_async(self.__sse_block_event, asyncio.get_event_loop())
+                log.info("SSE block task: Running event ingestion loop.")
+                self._connected = time.monotonic()
+                await self.bot.db.sse_block_async(self.__ingest, asyncio.get_event_loop())
             except requests.exceptions.ConnectionError as exc:
                 log.debug("SSE block event connection error", exc_info=exc)
             except requests.exceptions.ChunkedEncodingError as exc:
@@ -46,27 +117,519 @@ class EventManager:
 
             await asyncio.sleep(1)
 
-    async def __sse_block_event(self, block_sse_result: BlockSSEResult):
-        users_notified = 0
-        users_notified_tx = 0
+    async def __ingest(self, block_sse_result: BlockSSEResult):
+        backlog = time.monotonic() - self._connected < self.conf.catchup_window
+
+        await self.bot.shard.publish(block_sse_result, backlog)
+        await EventManager.dispatch(block_sse_result, backlog)
+
+    @staticmethod
+    async def dispatch(block_sse_result: BlockSSEResult, backlog: bool = False):
+        """Queue an event for every bot; `backlog` if it arrived right after the stream (re)connected.
+        """
+        HydraBotData.USERS.update(block_sse_result)
+
+        for evm in EventManager.ALL:
+            await evm.queue.put(block_sse_result, backlog)
+
+    async def _shard_ingest_task(self):
+        """Queue the events passed on by the primary process (sharded workers only).
+        """
+        while 1:
+            try:
+                received = await self.bot.shard.receive()
+            except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
+                log.info("Shard ingest task cancelled.")
+                return
+
+            if received is None:
+                log.info(f"{self.bot.shard}: primary process has gone away, stopping.")
+                self.bot.shard.stop()
+                return
 
-        log.debug(f"Processing Event #{block_sse_result.id} Block #{block_sse_result.block.height}")
+            await EventManager.dispatch(*received)
+
+    async def _shard_reload_task(self):
+        """Pick up chats marked reachable or unreachable, and conf changed, by the other processes.
+        """
+        while 1:
+            try:
+                await asyncio.sleep(self.bot.shard.conf.reload)
+                self.bot.recipients.reload()
+                self.interest.clear()
+            except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
+                return
+
+    async def _stats_task(self):
+        """Log this bot's send, queue and cache counters every `stats` seconds.
+        """
+        while 1:
+            try:
+                await asyncio.sleep(self.conf.stats)
+                log.info(f"{self.bot.name} stats: {'; '.join(self.stats())}")
+            except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
+                return
+            except BaseException as exc:
+                log.warning("Stats task error", exc_info=exc)
+
+    def stats(self) -> List[str]:
+        """One summary per counter source, for the stats log line.
+        """
+        sched = self.bot.sched.stats()
+        groups = self.bot.sched.group_stats().values()
+
+        return [
+            "send " + ", ".join(
+                f"{lane} {st['sent']} sent {st['depth']} queued {st['wait_avg']}/{st['wait_max']}s wait"
+                + (f" {st['retried']} retried" if st['retried'] else "")
+                for lane, st in sched.items()
+            ),
+            f"groups {len(groups)}, {sum(st['throttled'] for st in groups)} throttled",
+            "queue " + ", ".join(f"{name} {value}" for name, value in self.queue.stats().items()),
+            "shed {level}, raised {raised}, lowered {lowered}, events {events}, shed {shed}".format(**self.shed.stats()),
+            "chats {dead} unreachable, {marked} marked, {recovered} recovered".format(**self.bot.recipients.stats()),
+            "users {size} cached, {hits} hits, {misses} misses, {invalidated} invalidated".format(**HydraBotData.USERS.stats()),
+        ]
+
+    def __owned(self, block_sse_result: BlockSSEResult) -> BlockSSEResult:
+        """The event with only the subscribers whose notifications this bot and process send.
+
+        Subscribers are sharded by the chat their notifications go to, so that
+        a group's notifications are merged in one process. Events are shared by
+        all bots, so a filtered copy is returned rather than changing it.
+        """
+        shard = self.bot.shard
+
+        if shard.count == 1 and len(HydraBot.BOTS) == 1:
+            return block_sse_result
+
+        def owns(ua: UserAddrResult) -> bool:
+            if not self.bot.owns(ua.user.tg_user_id):
+                return False
+
+            return shard.owns(EventManager.notify_chats(ua.user, ConfSnapshot.of(ua.user, ua).block.notify)[0])
+
+        hist = []
 
         for addr_hist in block_sse_result.hist:
-            if addr_hist.mined:
+            addr_hist_user = [ahu for ahu in addr_hist.addr_hist_user if owns(ahu.user_addr)]
+
+            if len(addr_hist_user) == len(addr_hist.addr_hist_user):
+                hist.append(addr_hist)
+            elif addr_hist_user:
+                hist.append(addr_hist.copy(update=dict(addr_hist_user=addr_hist_user)))
+
+        return block_sse_result.copy(update=dict(hist=hist))
+
+    async def _sse_block_proc_task(self):
+        """Process queued SSE block events in order, independently of the stream reader.
+        """
+        await self.__outbox_resume()
+
+        while 1:
+            try:
+                block_sse_result, dwell, backlog = await self.queue.get()
+            except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
+                log.info("SSE block processing task cancelled.")
+                return
+
+            try:
+                block_sse_result = self.__owned(block_sse_result)
+
+                shed = self.shed.update(len(self.queue), dwell)
+
+                if self.__is_catchup(block_sse_result, backlog):
+                    self._catchup.append(block_sse_result)
+
+                    # Keep collecting while more events are already queued.
+                    if len(self.queue):
+                        continue
+
+                    await self.__catchup()
+                    continue
+
+                if self._catchup:
+                    await self.__catchup()
+
+                self.__check_gap(block_sse_result)
+
+                if shed >= Shed.DIGEST:
+                    self.__shed_fold(block_sse_result)
+
+                    if not len(self.queue):
+                        await self.__shed_flush()
+
+                    continue
+
+                if self._shed_events:
+                    await self.__shed_flush()
+
+                await self.__sse_block_event(block_sse_result, shed=shed)
+            except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
+                log.info("SSE block processing task cancelled.")
+                return
+            except BaseException as exc:
+                log.warning(f"SSE block event #{block_sse_result.id} processing error", exc_info=exc)
+
+    async def __outbox_resume(self):
+        """Deliver the messages a previous run stored but did not send, in order per user.
+        """
+        pending = self.outbox.pending()
+
+        if not pending:
+            return
+
+        log.info(f"Outbox: resuming delivery of {len(pending)} message{'s' if len(pending) != 1 else ''}.")
+
+        batch = self.fanout.batch()
+
+        for entry in pending:
+            batch.add(entry.user, FanOut.STAGE_BLOCK, functools.partial(self.deliver, entry))
+
+        sent = await batch.run()
+
+        self.outbox.flush()
+
+        log.info(f"Outbox: resumed {sent.get(FanOut.STAGE_BLOCK, 0)} message{'s' if sent.get(FanOut.STAGE_BLOCK, 0) != 1 else ''}.")
+
+    def __is_catchup(self, block_sse_result: BlockSSEResult, backlog: bool) -> bool:
+        """True for events of the backlog the server sends right after the stream (re)connects.
+
+        Live events are never caught up, however old their block looks; a
+        slow queue is handled by load shedding instead. Mature events always
+        carry an old block, so they only count while late blocks are being
+        collected.
+        """
+        if block_sse_result.event != SSEBlockEvent.create:
+            return backlog and len(self._catchup) > 0
+
+        return backlog
+
+    def __check_gap(self, block_sse_result: BlockSSEResult):
+        """Log blocks skipped since the persisted cursor; the SSE stream can't replay them.
+        """
+        if block_sse_result.event != SSEBlockEvent.create:
+            return
+
+        cursor = self.outbox.cursor(str(SSEBlockEvent.create))
+
+        if cursor is not None and block_sse_result.block.height > cursor.height + 1:
+            log.warning(
+                f"Missed blocks #{cursor.height + 1} to #{block_sse_result.block.height - 1}: "
+                f"their notifications are not sent."
+            )
+
+    async def __catchup(self):
+        """Process the collected late events on the catch-up lane, or summarize them if there are many.
+        """
+        events = [result for result in self._catchup if not self.outbox.seen(result)]
+        self._catchup = []
+
+        if not events:
+            return
+
+        if len(events) <= self.conf.catchup_summary:
+            log.info(f"Catching up on {len(events)} late event{'s' if len(events) != 1 else ''}.")
+
+            for result in events:
+                await self.__sse_block_event(result, lane=Lane.CATCHUP, shed=self.shed.level)
+
+            return
+
+        summary = Summary()
+
+        with self.outbox.transaction():
+            for result in events:
+                self.outbox.begin(result)
+                self.__summarize(summary, result)
+
+        log.info(
+            f"Catching up on {len(events)} late events for blocks #{summary.first} to #{summary.last}: "
+            f"summarizing for {len(summary)} user{'s' if len(summary) != 1 else ''}."
+        )
+
+        sent = await self.__summary_send(events, summary, "catchup", "<b>Catching up on late blocks</b>", Lane.CATCHUP)
+
+        log.info(f"Catch-up: sent {sent} summaries.")
+
+    def __shed_fold(self, block_sse_result: BlockSSEResult):
+        """Add an event to the running summary used while shedding to digests.
+        """
+        if self.outbox.seen(block_sse_result):
+            return
+
+        if self._shed_summary is None:
+            self._shed_summary = Summary()
+
+        self.outbox.begin(block_sse_result)
+        self.__summarize(self._shed_summary, block_sse_result)
+        self._shed_events.append(block_sse_result)
+        self.shed.count("digest")
+
+    async def __shed_flush(self):
+        events, summary = self._shed_events, self._shed_summary
+        self._shed_events, self._shed_summary = [], None
+
+        if not events:
+            return
+
+        sent = await self.__summary_send(events, summary, "busy", "<b>Summary while the bot catches up</b>", Lane.BULK)
+
+        log.info(
+            f"Load shedding: sent {sent} summar{'ies' if sent != 1 else 'y'} for {len(events)} event{'s' if len(events) != 1 else ''} "
+            f"in blocks #{summary.first} to #{summary.last}."
+        )
+
+    async def __summary_send(self, events: List[BlockSSEResult], summary: Summary, kind: str, title: str, lane: Lane) -> int:
+        """Send each user's tallies in `summary` for `events`, then mark the events processed.
+        """
+        last = max(events, key=lambda result_: result_.id)
+        batch = self.fanout.batch()
+
+        for tg_user_id, u in list(summary.users.items()):
+            tallies = summary.pop(tg_user_id)
+
+            if tallies:
+                batch.add(
+                    tg_user_id,
+                    FanOut.STAGE_BLOCK,
+                    functools.partial(
+                        self.__summary_notify, Outbox.key(last), u, kind,
+                        f"{title} (blocks {self.block_link_height(summary.first)} to {self.block_link_height(summary.last)}):",
+                        tallies, lane
+                    )
+                )
+
+        sent = await batch.run()
+
+        with self.outbox.transaction():
+            for result in events:
+                self.outbox.finish(result)
+
+        return sent.get(FanOut.STAGE_BLOCK, 0)
+
+    def __summarize(self, summary: Summary, result: BlockSSEResult):
+        create = result.event == SSEBlockEvent.create
+        index = BlockIndex(result.block)
+
+        summary.height(result.block.height)
+
+        for addr_hist in result.hist:
+            block_txes = self.__sse_block_event_proc_tx(index, addr_hist) if create and self.interest.wants(addr_hist, "tx") else None
+            reward = Decimal(0)
+
+            if create and addr_hist.mined and index.coinstake is not None:
+                txv = next(EventManager.yield_block_tx_inout_values(index, addr_hist, miner=True))
+                reward = Addr.decimal(txv.total_recv)
+
+            for addr_hist_user in addr_hist.addr_hist_user:
+                ua: UserAddrResult = addr_hist_user.user_addr
+                conf_block = ConfSnapshot.of(ua.user, ua).block
+                tally = summary.tally(ua)
+
+                if addr_hist.mined:
+                    if create and conf_block.notify != "hide":
+                        tally.add_mined(result.block.height, reward)
+
+                    elif not create and conf_block.mature != "hide":
+                        tally.add_matured()
+
+                if block_txes is not None and conf_block.tx != "hide" and not self.tx_below_min(ua, block_txes):
+                    tally.add_txes(block_txes)
+
+    async def _digest_task(self):
+        while 1:
+            try:
+                await asyncio.sleep(self.digest.conf.check)
+                await self.__digest_send()
+            except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
+                log.info("Digest task cancelled.")
+                return
+            except BaseException as exc:
+                log.warning("Digest task error", exc_info=exc)
+
+    async def __digest_send(self, flush: bool = False):
+        due = self.digest.due(flush=flush)
+
+        if not due:
+            self.digest.done()
+            return
+
+        batch = self.fanout.batch()
+
+        for key, u, first, last, tallies in due:
+            batch.add(
+                u.tg_user_id,
+                FanOut.STAGE_BLOCK,
+                functools.partial(
+                    self.__summary_notify, key, u, "digest",
+                    f"<b>Digest</b> for blocks {self.block_link_height(first)} to {self.block_link_height(last)}:",
+                    tallies, Lane.BULK
+                )
+            )
+
+        sent = await batch.run()
+
+        with self.outbox.transaction():
+            self.outbox.flush()
+            self.digest.done()
+
+        log.info(f"Digest: sent {sent.get(FanOut.STAGE_BLOCK, 0)} of {len(due)} digest{'s' if len(due) != 1 else ''}.")
+
+    async def __summary_notify(self, key: OutboxKey, u: UserBase, kind: str, title: str, tallies: List[AddrTally], lane: Lane) -> int:
+        """Send a user's tallies to the chats each address notifies (`block.notify`), skipping unreachable ones.
+        """
+        chats: Dict[int, List[AddrTally]] = {}
+
+        for tally in tallies:
+            conf_notify = ConfSnapshot.of(tally.ua.user, tally.ua).block.notify
+
+            for chat_id in EventManager.notify_chats(u, conf_notify):
+                chats.setdefault(chat_id, []).append(tally)
+
+        entries = []
+
+        with self.outbox.transaction():
+            for chat_id, chat_tallies in chats.items():
+                if not self.bot.recipients.reachable(chat_id):
+                    continue
+
+                message = [
+                    title,
+                ]
+
+                if Mailbox.is_group(chat_id):
+                    message.append(f'<a href="tg://user?id={u.tg_user_id}">{u.uniq.name}</a>')
+
+                for tally in chat_tallies:
+                    message += [
+                        "",
+                        f"<b>{addr_link(self.bot, tally.ua.addr, tally.ua.name)}</b>",
+                    ]
+
+                    message += Summary.lines(tally)
+
+                entry = self.outbox.put(key, u.tg_user_id, kind, chat_id, "\n".join(message), lane=lane)
+
+                if entry is not None:
+                    entries.append(entry)
+
+        sent = 0
+
+        for entry in entries:
+            sent += await self.deliver(entry)
+
+        return sent
+
+    async def __sse_block_event(self, block_sse_result: BlockSSEResult, lane: Optional[Lane] = None, shed: Shed = Shed.FULL):
+        block: Block = block_sse_result.block
+        create = block_sse_result.event == SSEBlockEvent.create
+
+        if self.outbox.seen(block_sse_result):
+            log.info(f"Skipping replayed Event #{block_sse_result.id} Block #{block.height}")
+            return
+
+        self.outbox.begin(block_sse_result)
+
+        ctx = BlockContext(block_sse_result, self.fanout.batch(), self.bot.price_snapshot(cached=shed >= Shed.FIAT), lane=lane, shed=shed)
+
+        if shed >= Shed.FIAT:
+            self.shed.count("fiat")
+
+        price_pairs = set()
+
+        log.debug(f"Processing Event #{block_sse_result.id} Block #{block.height} ({len(self.queue)} queued)")
+
+        # Rendering is grouped per user (mined, then TX) while different users run
+        # concurrently; the results are merged per chat and sent afterwards.
+        #
+        for addr_hist in block_sse_result.hist:
+            # Skip addresses whose subscribers all hide this kind of event before doing any work for them.
+            kinds = self.interest.kinds(addr_hist)
+
+            if addr_hist.mined and ("mined" if create else "mature") in kinds:
                 for addr_hist_user in addr_hist.addr_hist_user:
-                    users_notified += await self.__sse_block_event_user_proc(block_sse_result, addr_hist, addr_hist_user)
+                    if not self.__reachable(addr_hist_user.user_addr):
+                        ctx.unreachable += 1
+                        continue
+
+                    if create:
+                        price_pairs.add(("HYDRA", addr_hist_user.user_addr.user.info.get("fiat", "USD")))
+
+                    ctx.fan.add(
+                        addr_hist_user.user_addr.user.tg_user_id,
+                        FanOut.STAGE_BLOCK,
+                        functools.partial(self.__sse_block_event_user_proc, ctx, addr_hist, addr_hist_user)
+                    )
+
+            if create and "tx" in kinds:
+                block_txes = self.__sse_block_event_proc_tx(ctx.index, addr_hist)
+
+                if block_txes is not None:
+                    symbols = {"HYDRA"} | {
+                        token_tx.symbol
+                        for token_in_txes_all in block_txes.token_xfrs.values()
+                        for token_in_txes in token_in_txes_all.values()
+                        for token_tx in token_in_txes
+                        if token_tx.symbol in self.bot.price_client_map.keys()
+                    }
+
+                    for user_hist in addr_hist.addr_hist_user:
+                        if self.tx_below_min(user_hist.user_addr, block_txes):
+                            ctx.filtered += 1
+                            continue
+
+                        if not self.__reachable(user_hist.user_addr):
+                            ctx.unreachable += 1
+                            continue
+
+                        currency = user_hist.user_addr.user.info.get("fiat", "USD")
+                        price_pairs.update((symbol, currency) for symbol in symbols)
+
+                        ctx.fan.add(
+                            user_hist.user_addr.user.tg_user_id,
+                            FanOut.STAGE_TX,
+                            functools.partial(self.__sse_block_event_proc_tx_user, ctx, user_hist.user_addr, addr_hist, block_txes)
+                        )
+
+        # Resolve each (symbol, currency) once for the whole block.
+        await ctx.prices.extend(price_pairs)
+
+        posted = await ctx.fan.run()
 
-            if block_sse_result.event == SSEBlockEvent.create:
-                users_notified_tx += await self.__sse_block_event_proc_tx(block_sse_result.block, addr_hist)
+        # Everything for this block is rendered: send one merged message per chat, then the cards.
+        messages = await self.__deliver_mail(ctx)
+        cards = (await ctx.cards.run()).get(FanOut.STAGE_CARD, 0)
 
-        if users_notified or users_notified_tx:
+        posted = posted.get(FanOut.STAGE_BLOCK, 0) + posted.get(FanOut.STAGE_TX, 0)
+
+        # Counts are of deliveries: posted notifications can be merged, deduplicated or fail to send.
+        if posted:
             log.info(
-                f"Block #{block_sse_result.block.height} {block_sse_result.event}: Sent {users_notified} block event{'s' if users_notified != 1 else ''} "
-                f"and {users_notified_tx} TX event{'s' if users_notified_tx != 1 else ''}."
+                f"Block #{block_sse_result.block.height} {block_sse_result.event}: Delivered {messages} message{'s' if messages != 1 else ''} "
+                f"for {posted} notification{'s' if posted != 1 else ''} to {len(ctx.mail)} chat{'s' if len(ctx.mail) != 1 else ''}, "
+                f"and {cards} address card{'s' if cards != 1 else ''}."
             )
 
-    async def __sse_block_event_user_proc(self, block_sse_result: BlockSSEResult, addr_hist: AddrHistResult, addr_hist_user: UserAddrHistResult):
+        if ctx.unreachable:
+            log.debug(f"Block #{block_sse_result.block.height}: Skipped {ctx.unreachable} notification{'s' if ctx.unreachable != 1 else ''} for unreachable chats.")
+
+        if ctx.filtered:
+            log.debug(f"Block #{block_sse_result.block.height}: Skipped {ctx.filtered} TX notification{'s' if ctx.filtered != 1 else ''} below block.min.")
+
+        if ctx.mail.deduped:
+            log.debug(f"Block #{block_sse_result.block.height}: Merged {ctx.mail.deduped} duplicate group notification{'s' if ctx.mail.deduped != 1 else ''}.")
+
+        if ctx.hits:
+            log.debug(f"Block #{block_sse_result.block.height}: Rendered {ctx.rendered} bodies, reused {ctx.hits}.")
+
+        # The digest tallies this event added are committed with it.
+        with self.outbox.transaction():
+            self.digest.save()
+            self.outbox.finish(block_sse_result)
+
+    async def __sse_block_event_user_proc(self, ctx: BlockContext, addr_hist: AddrHistResult, addr_hist_user: UserAddrHistResult):
+        block_sse_result: BlockSSEResult = ctx.result
         block: Block = block_sse_result.block
         addr: AddrBase = addr_hist.addr
 
@@ -74,11 +637,11 @@ class EventManager:
 
         if block_sse_result.event == SSEBlockEvent.create:
             if addr_hist.mined:
-                return await self.__sse_block_event_user_mined(block_sse_result.block, addr_hist, addr_hist_user)
+                return await self.__sse_block_event_user_mined(ctx, addr_hist, addr_hist_user)
 
         elif block_sse_result.event == SSEBlockEvent.mature:
             if addr_hist.mined:
-                return await self.__sse_block_event_user_mined_matured(block_sse_result.block, addr_hist, addr_hist_user)
+                return await self.__sse_block_event_user_mined_matured(ctx, addr_hist, addr_hist_user)
 
         if not sent:
             log.warning(f"Unprocessed BlockSSEResult for user {addr_hist_user.user_addr.user.tg_user_id} addr {str(addr)} block #{block.height}")
@@ -108,27 +671,18 @@ class EventManager:
         return staking_tot
 
     @staticmethod
-    def yield_block_tx_inout_values(block: Block, addr_hist: AddrHistResult, miner: bool = False) -> Generator[AttrDict, None, None]:
+    def yield_block_tx_inout_values(index: BlockIndex, addr_hist: AddrHistResult, miner: bool = False) -> Generator[AttrDict, None, None]:
         addr: AddrBase = addr_hist.addr
         addr_str = str(addr)
-        a = lambda a_: a_.get("addressHex", a_.get("address"))
+        entries = index.entries(addr_str)
 
-        for trxn in (addr.filter_tx(block) if not miner else [block.tx[1]]):
-            txid = trxn.get("id")
-            txno = block.info["transactions"].index(txid)
+        for txno in (index.numbers((addr_str, addr.addr_hy)) if not miner else [index.coinstake]):
+            trxn = index.txes[txno]
+            entry = entries.get(txno, None)
             fees = int(trxn.get("fees", 0))
 
-            value_in = sum(
-                int(inp.get("value", 0))
-                for inp in trxn.get("inputs", [])
-                if a(inp) == addr_str
-            )
-
-            value_out = sum(
-                int(out.get("value", 0))
-                for out in trxn.get("outputs", [])
-                if a(out) == addr_str
-            )
+            value_in = entry.value_in if entry is not None else 0
+            value_out = entry.value_out if entry is not None else 0
 
             # NOTE: contractSpends are duplicated in separate block TX.
 
@@ -167,115 +721,46 @@ class EventManager:
             if miner:
                 return
 
-    async def __sse_block_event_user_mined(self, block: Block, addr_hist: AddrHistResult, addr_hist_user: UserAddrHistResult) -> int:
+    async def __sse_block_event_user_mined(self, ctx: BlockContext, addr_hist: AddrHistResult, addr_hist_user: UserAddrHistResult) -> int:
+        block: Block = ctx.block
         user_addr: UserAddrResult = addr_hist_user.user_addr
         user: UserBase = user_addr.user
 
-        conf_block_notify = Config.get(user, user_addr, "block", "notify").value_or_default
+        conf_block = ConfSnapshot.of(user, user_addr).block
+        conf_block_notify = conf_block.notify
         conf_block_notify_both = False
 
         if conf_block_notify == "hide":
             return 0
 
+        if conf_block_notify == "digest":
+            txv = next(EventManager.yield_block_tx_inout_values(ctx.index, addr_hist, miner=True))
+            self.digest.tally(ctx.result, user_addr).add_mined(block.height, Addr.decimal(txv.total_recv))
+            return 0
+
         if isinstance(conf_block_notify, int) and conf_block_notify > 0:
             conf_block_notify = -conf_block_notify
             conf_block_notify_both = True
 
-        conf_block_stake = Config.get(user, user_addr, "block", "stake").value_or_default
-        conf_block_bal = Config.get(user, user_addr, "block", "bal").value_or_default
-        conf_block_utxo = Config.get(user, user_addr, "block", "utxo").value_or_default
-        conf_block_total = Config.get(user, user_addr, "block", "total").value_or_default
-
-        balance_str = None
-
-        if conf_block_bal == "show":
-            balance = int(addr_hist.info_new.get("balance", 0))
-
-            if balance:
-                # currency = user.info.get("fiat", "USD")
-                # fiat_value = self.bot.hydra_fiat_value(currency, balance, with_name=False)
-
-                balance_str = (
-                    f"<b>Balance:</b> {'{:,}'.format(round(Addr.decimal(balance), 2))} HYDRA"
-                )
-
-        staking_tot = EventManager.staking_fmt(conf_block_stake, addr_hist)
-
-        block_tx = block.tx[1]
-
-        utxo_str = None
-
-        if conf_block_utxo != "hide":
-            utxo_inp_cnt = 0
-            utxo_out_cnt = 0
-            utxo_out_tot = 0
-
-            for inp in filter(lambda inp_: inp_.get("address") == addr_hist.addr.addr_hy, block_tx["inputs"]):
-                value = int(inp.get("value", 0))
-
-                if value:
-                    utxo_inp_cnt += 1
-
-            for out in filter(lambda out_: out_.get("address") == addr_hist.addr.addr_hy, block_tx["outputs"]):
-                value = int(out.get("value", 0))
-
-                if value:
-                    utxo_out_cnt += 1
-                    utxo_out_tot += value
-
-            utxo_out_tot = round(Addr.decimal(utxo_out_tot), 2)
-
-            if conf_block_utxo == "full":
-                utxo_str = "\n<b>"
-                utxo_str += "Merged" if utxo_inp_cnt > utxo_out_cnt else "Updated" if utxo_inp_cnt == utxo_out_cnt else "Split"
-                utxo_str += f"</b> {num2words(utxo_inp_cnt)} UTXO{'s' if utxo_inp_cnt != 1 else ''}"
-
-                if utxo_inp_cnt != utxo_out_cnt:
-                    utxo_str += f" into {num2words(utxo_out_cnt)}"
-
-                utxo_str += f" with a total output of about {utxo_out_tot} HYDRA."
-            else:  # == "show"
-                utxo_str = f"<b>UTXOs:</b> +{utxo_out_tot} ({utxo_inp_cnt} ➔ {utxo_out_cnt})"
-
-        # Determine how much of the total reward belongs to this address:
-        #
-        txv = list(txv for txv in EventManager.yield_block_tx_inout_values(block, addr_hist, miner=True))[0]
-        reward = txv.total_recv
+        conf_block_stake = conf_block.stake
+        conf_block_bal = conf_block.bal
+        conf_block_utxo = conf_block.utxo
+        conf_block_total = conf_block.total
 
         currency = user.info.get("fiat", "USD")
-        value = await self.bot.hydra_fiat_value(currency, reward)
-        reward = round(Addr.decimal(reward), 2)
-        price = await self.bot.hydra_fiat_value(currency, 1 * 10**8, with_name=False)
+
+        # Everything below the header is the same for all watchers of this address with the same settings.
+        body = ctx.render(
+            (str(addr_hist.addr), "mined", (conf_block_bal, conf_block_stake, conf_block_utxo, conf_block_notify_both), currency),
+            lambda: self.__render_mined(ctx, addr_hist, currency, conf_block_bal, conf_block_stake, conf_block_utxo, conf_block_notify_both)
+        )
 
         message = [
             f'<b><a href="{self.bot.rpcx.human_link("address", str(addr_hist.addr))}">{user_addr.name}</a> '
             + f'mined block <a href="{self.bot.rpcx.human_link("block", block.height)}">#{block.height}</a>!</b>\n',
         ]
 
-        if balance_str is not None:
-            message.append(balance_str)
-
-        message += [
-            f'<b>Reward:</b> <a href="{self.bot.rpcx.human_link("tx", block_tx["id"])}">+{reward}</a> HYDRA',
-            f"<b>Value:</b> {value} @ <b>{price}</b>",
-        ]
-
-        if txv.fees and conf_block_notify_both:  # Adding conf_block_notify_both to ensure this is not normally shown.
-            fee_str = "Refunds" if txv.fees < 0 else "Fees"  # Will always be < 0. But just in case.
-            refunds = Addr.decimal(abs(txv.fees))
-            refunds_value = await self.bot.hydra_fiat_value(currency, refunds, with_name=False)
-
-            message.append(
-                f"<b>{fee_str}:</b> {round(refunds, 2)} HYDRA ~ {refunds_value}"
-            )
-
-        if staking_tot is not None:
-            message += [
-                f"<b>Staking:</b> {staking_tot}",
-            ]
-
-        if utxo_str:
-            message.append(utxo_str)
+        message += body
 
         blocks_mined = addr_hist.info_new.get("blocksMined", 0)
 
@@ -344,66 +829,168 @@ class EventManager:
             ]]
         )
 
-        sent = await try_send_notify(
-            self.bot.send_message(
-                chat_id=chat_id,
-                text=message,
-                parse_mode="HTML",
-                reply_markup=None if chat_id != user.tg_user_id or conf_block_bal == "full" else info_reply_markup
-            ),
+        sent = self.notify(
+            ctx, user, f"mined:{user_addr.pkid}", chat_id, message,
+            reply_markup=None if chat_id != user.tg_user_id or conf_block_bal == "full" else info_reply_markup,
+            lane=Lane.BLOCK, addr=str(addr_hist.addr)
         )
 
         if conf_block_notify_both:
-            sent += await try_send_notify(
-                self.bot.send_message(
-                    chat_id=user.tg_user_id,
-                    text=message,
-                    parse_mode="HTML",
-                    reply_markup=None if conf_block_bal == "full" else info_reply_markup
-                ),
+            sent += self.notify(
+                ctx, user, f"mined:{user_addr.pkid}", user.tg_user_id, message,
+                reply_markup=None if conf_block_bal == "full" else info_reply_markup,
+                lane=Lane.BLOCK, addr=str(addr_hist.addr)
             )
 
         if conf_block_bal == "full":
-            await self.addr_show(user, user_addr, addr_hist, conf_block_notify, conf_block_notify_both)
+            self.addr_show(ctx, user, user_addr, addr_hist, conf_block_notify, conf_block_notify_both)
 
         return sent
 
-    async def __sse_block_event_user_mined_matured(self, block: Block, addr_hist: AddrHistResult, addr_hist_user: UserAddrHistResult) -> int:
+    def __render_mined(self, ctx: BlockContext, addr_hist: AddrHistResult, currency: str, conf_block_bal: str,
+                       conf_block_stake: str, conf_block_utxo: str, conf_block_notify_both: bool) -> Tuple[str, ...]:
+        block: Block = ctx.block
+
+        balance_str = None
+
+        if conf_block_bal == "show":
+            balance = int(addr_hist.info_new.get("balance", 0))
+
+            if balance:
+                # currency = user.info.get("fiat", "USD")
+                # fiat_value = self.bot.hydra_fiat_value(currency, balance, with_name=False)
+
+                balance_str = (
+                    f"<b>Balance:</b> {'{:,}'.format(round(Addr.decimal(balance), 2))} HYDRA"
+                )
+
+        staking_tot = EventManager.staking_fmt(conf_block_stake, addr_hist)
+
+        block_tx = block.tx[1]
+
+        utxo_str = None
+
+        if conf_block_utxo != "hide":
+            utxo = ctx.index.entry(addr_hist.addr.addr_hy, ctx.index.coinstake)
+
+            utxo_inp_cnt = utxo.utxo_in if utxo is not None else 0
+            utxo_out_cnt = utxo.utxo_out if utxo is not None else 0
+            utxo_out_tot = round(Addr.decimal(utxo.utxo_out_value if utxo is not None else 0), 2)
+
+            if conf_block_utxo == "full":
+                utxo_str = "\n<b>"
+                utxo_str += "Merged" if utxo_inp_cnt > utxo_out_cnt else "Updated" if utxo_inp_cnt == utxo_out_cnt else "Split"
+                utxo_str += f"</b> {num2words(utxo_inp_cnt)} UTXO{'s' if utxo_inp_cnt != 1 else ''}"
+
+                if utxo_inp_cnt != utxo_out_cnt:
+                    utxo_str += f" into {num2words(utxo_out_cnt)}"
+
+                utxo_str += f" with a total output of about {utxo_out_tot} HYDRA."
+            else:  # == "show"
+                utxo_str = f"<b>UTXOs:</b> +{utxo_out_tot} ({utxo_inp_cnt} ➔ {utxo_out_cnt})"
+
+        # Determine how much of the total reward belongs to this address:
+        #
+        txv = list(txv for txv in EventManager.yield_block_tx_inout_values(ctx.index, addr_hist, miner=True))[0]
+        reward = txv.total_recv
+
+        value = ctx.prices.value("HYDRA", currency, reward)
+        reward = round(Addr.decimal(reward), 2)
+        price = ctx.prices.value("HYDRA", currency, 1 * 10**8, with_name=False)
+
+        message = []
+
+        if balance_str is not None:
+            message.append(balance_str)
+
+        message += [
+            f'<b>Reward:</b> <a href="{self.bot.rpcx.human_link("tx", block_tx["id"])}">+{reward}</a> HYDRA',
+            f"<b>Value:</b> {value} @ <b>{price}</b>",
+        ]
+
+        if txv.fees and conf_block_notify_both:  # Adding conf_block_notify_both to ensure this is not normally shown.
+            fee_str = "Refunds" if txv.fees < 0 else "Fees"  # Will always be < 0. But just in case.
+            refunds = Addr.decimal(abs(txv.fees))
+            refunds_value = ctx.prices.value("HYDRA", currency, refunds, with_name=False)
+
+            message.append(
+                f"<b>{fee_str}:</b> {round(refunds, 2)} HYDRA ~ {refunds_value}"
+            )
+
+        if staking_tot is not None:
+            message += [
+                f"<b>Staking:</b> {staking_tot}",
+            ]
+
+        if utxo_str:
+            message.append(utxo_str)
+
+        return tuple(message)
+
+    async def __sse_block_event_user_mined_matured(self, ctx: BlockContext, addr_hist: AddrHistResult, addr_hist_user: UserAddrHistResult) -> int:
+        block: Block = ctx.block
         user_addr: UserAddrResult = addr_hist_user.user_addr
         user: UserBase = user_addr.user
 
-        conf_block_mature = Config.get(user, user_addr, "block", "mature").value_or_default
-        conf_block_stake = Config.get(user, user_addr, "block", "stake").value_or_default
-        conf_block_notify = Config.get(user, user_addr, "block", "notify").value_or_default
+        conf_block = ConfSnapshot.of(user, user_addr).block
+        conf_block_mature = conf_block.mature
+        conf_block_stake = conf_block.stake
+        conf_block_notify = conf_block.notify
 
         if conf_block_mature == "hide":
             return 0
 
+        if conf_block_notify == "digest":
+            self.digest.tally(ctx.result, user_addr).add_matured()
+            return 0
+
         conf_block_notify_both = False
 
         if isinstance(conf_block_notify, int) and conf_block_notify > 0:
             conf_block_notify = -conf_block_notify
             conf_block_notify_both = True
 
-        staking_tot = EventManager.staking_fmt(conf_block_stake, addr_hist)
+        message = [
+            f'<b><a href="{self.bot.rpcx.human_link("address", str(addr_hist.addr))}">{user_addr.name}</a> '
+            + f'block <a href="{self.bot.rpcx.human_link("block", block.height)}">#{block.height}</a> has matured!</b>\n',
+        ]
 
-        utxo_out_tot = 0
+        message += ctx.render(
+            (str(addr_hist.addr), "mature", (conf_block_stake,), None),
+            lambda: self.__render_mature(ctx, addr_hist, conf_block_stake)
+        )
 
-        block_tx = block.tx[1]
+        message = "\n".join(message)
 
-        for out in filter(lambda out_: out_.get("address") == addr_hist.addr.addr_hy, block_tx["outputs"]):
-            value = int(out.get("value", 0))
+        sent = self.notify(
+            ctx, user, f"mature:{user_addr.pkid}", conf_block_notify if isinstance(conf_block_notify, int) else user.tg_user_id, message,
+            lane=Lane.BULK, addr=str(addr_hist.addr)
+        )
+
+        if conf_block_notify_both:
+            sent += self.notify(
+                ctx, user, f"mature:{user_addr.pkid}", user.tg_user_id, message,
+                lane=Lane.BULK, addr=str(addr_hist.addr)
+            )
 
-            if value:
-                utxo_out_tot += value
+        if conf_block_mature == "full":
+            self.addr_show(ctx, user, user_addr, addr_hist, conf_block_notify, conf_block_notify_both)
+
+        return sent
 
-        utxo_out_tot = round(Addr.decimal(utxo_out_tot), 2)
+    def __render_mature(self, ctx: BlockContext, addr_hist: AddrHistResult, conf_block_stake: str) -> Tuple[str, ...]:
+        block: Block = ctx.block
+
+        staking_tot = EventManager.staking_fmt(conf_block_stake, addr_hist)
+
+        block_tx = block.tx[1]
+
+        utxo = ctx.index.entry(addr_hist.addr.addr_hy, ctx.index.coinstake)
+        utxo_out_tot = round(Addr.decimal(utxo.utxo_out_value if utxo is not None else 0), 2)
 
         reward = round(Addr.decimal(block.info["reward"]), 2)
 
         message = [
-            f'<b><a href="{self.bot.rpcx.human_link("address", str(addr_hist.addr))}">{user_addr.name}</a> '
-            + f'block <a href="{self.bot.rpcx.human_link("block", block.height)}">#{block.height}</a> has matured!</b>\n',
             f'<b>Reward:</b> <a href="{self.bot.rpcx.human_link("tx", block_tx["id"])}">+{reward}</a> HYDRA',
             f"UTXOs: +{utxo_out_tot}",
         ]
@@ -413,42 +1000,24 @@ class EventManager:
                 f"Staking: {staking_tot}",
             ]
 
-        message = "\n".join(message)
+        return tuple(message)
 
-        sent = await try_send_notify(
-            self.bot.send_message(
-                chat_id=conf_block_notify if isinstance(conf_block_notify, int) else user.tg_user_id,
-                text=message,
-                parse_mode="HTML"
-            ),
-        )
-
-        if conf_block_notify_both:
-            sent += await try_send_notify(
-                self.bot.send_message(
-                    chat_id=user.tg_user_id,
-                    text=message,
-                    parse_mode="HTML"
-                ),
-            )
-
-        if conf_block_mature == "full":
-            await self.addr_show(user, user_addr, addr_hist, conf_block_notify, conf_block_notify_both)
-
-        return sent
-
-    async def __sse_block_event_proc_tx(self, block: Block, addr_hist: AddrHistResult) -> int:
+    @staticmethod
+    def __sse_block_event_proc_tx(index: BlockIndex, addr_hist: AddrHistResult) -> Optional[AttrDict]:
+        """Collect the TX values and token transfers for an address, shared by all of its users.
+        """
         addr: AddrBase = addr_hist.addr
         addr_str = str(addr)
+        entries = index.entries(addr_str)
 
         addr_txes: Dict[int, AttrDict] = {}
         tokn_xfrs: Dict[str, Dict[str, List[AttrDict]]] = {}
-        sent = 0
 
-        for txv in EventManager.yield_block_tx_inout_values(block, addr_hist):
+        for txv in EventManager.yield_block_tx_inout_values(index, addr_hist):
             txid = txv.get("id")
 
-            token_transfers = txv.get("qrc20TokenTransfers", []) + txv.get("qrc721TokenTransfers", [])
+            entry = entries.get(txv.n, None)
+            token_transfers = entry.tokens if entry is not None else []  # Only the transfers involving addr.
 
             if txv.n == 1 and addr_hist.mined:
                 # token_transfers is assumed to be empty.
@@ -476,10 +1045,7 @@ class EventManager:
                     addr_recv=addr_recv
                 )
 
-                if (addr_str == addr_smac and addr_send != addr_smac and addr_recv != addr_smac) or \
-                        addr_str == addr_send or addr_str == addr_recv:
-
-                    tokn_xfrs.setdefault(addr_smac, {}).setdefault(txid, []).append(token_tx)
+                tokn_xfrs.setdefault(addr_smac, {}).setdefault(txid, []).append(token_tx)
 
             addr_txes[txv.n] = txv
 
@@ -490,51 +1056,137 @@ class EventManager:
             )
             total_fees = Addr.decimal(sum(utx.fees for utx in addr_txes.values()))
 
-            block_txes = AttrDict(
+            return AttrDict(
                 txes=addr_txes,
                 token_xfrs=tokn_xfrs,
                 total_recv=total_recv,
                 total_fees=total_fees
             )
 
-            for user_hist in addr_hist.addr_hist_user:
-                sent += await self.__sse_block_event_proc_tx_user(user_hist.user_addr, addr_hist, block, block_txes)
+        return None
 
-        return sent
+    def __reachable(self, ua: UserAddrResult) -> bool:
+        """True unless every chat `ua`'s notifications go to is marked dead (digests go to the user's DM).
+        """
+        conf_notify = ConfSnapshot.of(ua.user, ua).block.notify
+        return self.bot.recipients.any_reachable(EventManager.notify_chats(ua.user, conf_notify))
+
+    @staticmethod
+    def notify_chats(u: UserBase, conf_notify: Union[int, str]) -> List[int]:
+        """The chats a `block.notify` value sends to: a group ("here"), a group and the DM ("both"), or the DM.
+        """
+        if isinstance(conf_notify, int):
+            return [-conf_notify, u.tg_user_id] if conf_notify > 0 else [conf_notify]
+
+        return [u.tg_user_id]
+
+    def tx_below_min(self, ua: UserAddrResult, block_txes: AttrDict) -> bool:
+        """True if the net TX value for `ua` is below its `block.min`, judged from the precomputed totals alone.
+
+        A fiat minimum uses the last known HYDRA price and lets the TX through when there isn't one.
+        Token transfers aren't valued in HYDRA, so they always get through.
+        """
+        amount, currency = min_value(ConfSnapshot.of(ua.user, ua).block.min)
+
+        if not amount:
+            return False
 
-    async def __sse_block_event_proc_tx_user(self, ua: UserAddrResult, addr_hist: AddrHistResult, block: Block, block_txes: AttrDict) -> int:
+        if block_txes.token_xfrs:
+            return False
+
+        value = abs(block_txes.total_recv)
+
+        if currency is not None:
+            price = self.bot.price_service.cached("HYDRA", currency)
+
+            if price is None:
+                return False
+
+            value *= price
+
+        return value < amount
+
+    async def __sse_block_event_proc_tx_user(self, ctx: BlockContext, ua: UserAddrResult, addr_hist: AddrHistResult, block_txes: AttrDict) -> int:
+        block: Block = ctx.block
         u: UserBase = ua.user
         a: AddrBase = addr_hist.addr
         addr_str = str(a)
 
-        conf_block_tx = Config.get(u, ua, "block", "tx").value_or_default
+        conf_block = ConfSnapshot.of(u, ua).block
+        conf_block_tx = conf_block.tx
 
         if conf_block_tx == "hide":
             return 0
 
-        conf_block_notify = Config.get(u, ua, "block", "notify").value_or_default
+        conf_block_notify = conf_block.notify
         conf_block_notify_both = False
 
+        if conf_block_notify == "digest":
+            self.digest.tally(ctx.result, ua).add_txes(block_txes)
+            return 0
+
         if isinstance(conf_block_notify, int) and conf_block_notify > 0:
             conf_block_notify = -conf_block_notify
             conf_block_notify_both = True
 
+        currency = u.info.get("fiat", "USD")
+
+        # The transaction details are the same for all watchers of this address with the same settings.
+        txes_len, body = ctx.render(
+            (addr_str, "tx", (conf_block_tx,), currency),
+            lambda: self.__render_tx(ctx, addr_hist, block_txes, currency, conf_block_tx)
+        )
+
+        message = [
+            f"{addr_link(self.bot, a, ua.name)} has {num2words(txes_len) if txes_len > 1 else 'a'} new transaction{'s' if txes_len > 1 else ''}"
+            + f" in block {self.block_link(block, f'#{block.height}')}!",
+            "",
+        ]
+
+        message += body
+
+        if message[-1] != "":
+            message.append("")
+
+        tz_time = u.user_time(datetime.utcfromtimestamp(block.info.get("timestamp", datetime.utcnow().timestamp())))
+
+        message.append(
+            f"<pre>{tz_time.ctime()} {tz_time.tzname()}</pre>"
+        )
+
+        message = "\n".join(message)
+
+        sent = self.notify(
+            ctx, u, f"tx:{ua.pkid}", conf_block_notify if isinstance(conf_block_notify, int) else u.tg_user_id, message,
+            lane=Lane.BULK, addr=addr_str
+        )
+
+        if conf_block_notify_both:
+            sent += self.notify(
+                ctx, u, f"tx:{ua.pkid}", u.tg_user_id, message,
+                lane=Lane.BULK, addr=addr_str
+            )
+
+        if conf_block_tx == "full":
+            self.addr_show(ctx, u, ua, addr_hist, conf_block_notify, conf_block_notify_both)
+
+        return sent
+
+    def __render_tx(self, ctx: BlockContext, addr_hist: AddrHistResult, block_txes: AttrDict, currency: str, conf_block_tx: str) -> Tuple[int, Tuple[str, ...]]:
+        a: AddrBase = addr_hist.addr
+        addr_str = str(a)
+
         txes: Dict[int, AttrDict] = block_txes.txes
         token_xfrs: Dict[str, Dict[str, List[AttrDict]]] = block_txes.token_xfrs
 
-        if 1 in txes:
-            if len(txes) > 1 and conf_block_tx != "full":
-                del txes[1]
+        if 1 in txes and len(txes) > 1 and conf_block_tx != "full":
+            txes = {tnxo: tx for tnxo, tx in txes.items() if tnxo != 1}
 
         txes_show = {tx.id: tx for tnxo, tx in txes.items() if tx.total_recv}
 
         txes_len = len(txes_show)
 
-        message = [
-            f"{addr_link(self.bot, a, ua.name)} has {num2words(txes_len) if txes_len > 1 else 'a'} new transaction{'s' if txes_len > 1 else ''}"
-            + f" in block {self.block_link(block, f'#{block.height}')}!",
-            "",
-        ]
+        message = []
 
         total_recv: Decimal = block_txes.total_recv
         total_fees: Decimal = block_txes.total_fees
@@ -542,8 +1194,7 @@ class EventManager:
         if total_fees == -total_recv:
             total_recv += total_fees
 
-        currency = u.info.get("fiat", "USD")
-        total_recv_value = await self.bot.hydra_fiat_value(currency, abs(total_recv), with_name=False)
+        total_recv_value = ctx.prices.value("HYDRA", currency, abs(total_recv), with_name=False)
 
         if total_recv != 0:
             send_recv = "Receive" if total_recv > 0 else "Send"
@@ -562,7 +1213,7 @@ class EventManager:
             if len(txes) == 1 and not total_recv:
                 fee_msg = self.tx_link(tuple(txes.values())[0].id, fee_msg)
 
-            fee_total_value = await self.bot.hydra_fiat_value(currency, abs(total_fees), with_name=False)
+            fee_total_value = ctx.prices.value("HYDRA", currency, abs(total_fees), with_name=False)
 
             message.append(
                 f"<b>{fee_msg}:</b> {abs(total_fees)} HYDRA ~ {fee_total_value}"
@@ -594,7 +1245,7 @@ class EventManager:
                         # TODO: Maybe also get URI data from addr_hist.info_new.qrc721Balances[].uris[]
 
                     if token_in_tx.symbol in self.bot.price_client_map.keys() and token_in_tx.value_or_id:
-                        token_fiat_value = await self.bot.fiat_value_of(
+                        token_fiat_value = ctx.prices.value(
                             token_in_tx.symbol,
                             currency,
                             token_in_tx.value_or_id,
@@ -606,74 +1257,163 @@ class EventManager:
                     if first_token:
                         first_token = False
 
-                        if message[-1] != "":
+                        if message and message[-1] != "":
                             message.append("")
 
                     message.append(value_str)
 
-        if message[-1] != "":
-            message.append("")
+        return txes_len, tuple(message)
 
-        tz_time = u.user_time(datetime.utcfromtimestamp(block.info.get("timestamp", datetime.utcnow().timestamp())))
+    def addr_show(self, ctx: BlockContext, u: UserBase, ua: UserAddrResult, ah: AddrHistResult, conf_notify: Union[int, str], conf_notify_both: bool):
+        """Queue an address card after the user's other messages for this block, once per address.
+        """
+        if ctx.shed >= Shed.CARDS:
+            self.shed.count("cards")
+            return
 
-        message.append(
-            f"<pre>{tz_time.ctime()} {tz_time.tzname()}</pre>"
+        ctx.cards.add(
+            u.tg_user_id,
+            FanOut.STAGE_CARD,
+            functools.partial(self.__addr_show, ctx, u, ua, ah, conf_notify, conf_notify_both),
+            uniq=(u.tg_user_id, ua.pkid)
         )
 
-        message = "\n".join(message)
-
-        sent = await try_send_notify(
-            self.bot.send_message(
-                chat_id=conf_block_notify if isinstance(conf_block_notify, int) else u.tg_user_id,
-                text=message,
-                parse_mode="HTML"
-            ),
+    async def __addr_show(self, ctx: BlockContext, u: UserBase, ua: UserAddrResult, ah: AddrHistResult, conf_notify: Union[int, str], conf_notify_both: bool) -> int:
+        addr = Addr(
+            info=ah.info_new,
+            **AttrDict(ah.addr.dict())
         )
 
-        if conf_block_notify_both:
-            sent += await try_send_notify(
-                self.bot.send_message(
-                    chat_id=u.tg_user_id,
-                    text=message,
-                    parse_mode="HTML"
-                ),
+        chat_ids = [conf_notify if isinstance(conf_notify, int) else u.tg_user_id]
+
+        if conf_notify_both:
+            chat_ids.append(u.tg_user_id)
+
+        sent = 0
+
+        for chat_id in chat_ids:
+            if not self.bot.recipients.reachable(chat_id):
+                continue
+
+            # One card per address in a group, however many members watch it.
+            if not ctx.mail.claim(chat_id, str(ah.addr), "card"):
+                continue
+
+            # Cards are rendered at send time, so the outbox only records their delivery.
+            entry = self.outbox.put(Outbox.key(ctx.result), u.tg_user_id, f"card:{ua.pkid}", chat_id, None)
+
+            if entry is None:
+                continue
+
+            card_sent = await try_send_notify(
+                addr_show(self.bot, chat_id, u, ua, addr, prices=ctx.prices, lane=ctx.lane if ctx.lane is not None else Lane.BULK),
+                chat_id, self.bot.recipients
             )
 
-        if conf_block_tx == "full":
-            await self.addr_show(u, ua, addr_hist, conf_block_notify, conf_block_notify_both)
+            self.outbox.done(entry.id, bool(card_sent))
+            sent += card_sent
 
         return sent
 
-    async def addr_show(self, u: UserBase, ua: UserAddrResult, ah: AddrHistResult, conf_notify: Union[int, str], conf_notify_both: bool):
-        addr = Addr(
-            info=ah.info_new,
-            **AttrDict(ah.addr.dict())
+    def notify(self, ctx: BlockContext, u: UserBase, kind: str, chat_id: int, text: str,
+               reply_markup: Optional[aiogram.types.InlineKeyboardMarkup] = None, lane: Lane = Lane.BULK,
+               *, addr: Optional[str] = None) -> int:
+        """Post a block notification for `chat_id`, to be merged with the chat's others for this block.
+
+        Returns 1 if it was posted, not sent; deliveries are counted by `deliver()`.
+        """
+        if not self.bot.recipients.reachable(chat_id):
+            return 0
+
+        ctx.mail.post(
+            chat_id, u.tg_user_id, kind, text, reply_markup, ctx.lane if ctx.lane is not None else lane,
+            addr=addr, mention=f'<a href="tg://user?id={u.tg_user_id}">{u.uniq.name}</a>'
         )
 
-        await try_send_notify(
-            addr_show(self.bot, conf_notify if isinstance(conf_notify, int) else u.tg_user_id, u, ua, addr),
+        return 1
+
+    async def __deliver_mail(self, ctx: BlockContext) -> int:
+        """Store each chat's merged messages in the outbox and send them, unless this event already stored them.
+
+        Returns the number of messages delivered.
+        """
+        batch = self.fanout.batch()
+        key = Outbox.key(ctx.result)
+
+        # Every message of the block is stored in one commit before any is sent.
+        with self.outbox.transaction():
+            for chat_id, messages in ctx.mail.messages():
+                if Mailbox.is_group(chat_id):
+                    budget = self.bot.sched.budget(chat_id)
+
+                    if len(messages) > budget:
+                        log.info(
+                            f"Block #{ctx.block.height}: {len(messages)} message{'s' if len(messages) != 1 else ''} "
+                            f"for group {chat_id} exceed its send budget ({budget}), the rest will be paced."
+                        )
+
+                for n, message in enumerate(messages):
+                    entry = self.outbox.put(key, chat_id, f"block:{n}", chat_id, message.text, message.markup, message.lane)
+
+                    if entry is not None:
+                        batch.add(chat_id, FanOut.STAGE_BLOCK, functools.partial(self.deliver, entry))
+
+        sent = await batch.run()
+
+        return sent.get(FanOut.STAGE_BLOCK, 0)
+
+    async def deliver(self, entry: AttrDict) -> int:
+        sent = await try_send_notify(
+            self.bot.send_message(
+                chat_id=entry.chat_id,
+                text=entry.text,
+                parse_mode="HTML",
+                reply_markup=entry.markup,
+                lane=Lane(entry.lane)
+            ),
+            entry.chat_id, self.bot.recipients
         )
 
-        if conf_notify_both:
-            await try_send_notify(
-                addr_show(self.bot, u.tg_user_id, u, ua, addr),
-            )
+        self.outbox.done(entry.id, bool(sent))
+
+        return sent
 
     def block_link(self, block: Block, text: str) -> str:
         return f'<a href="{self.bot.rpcx.human_link("block", block.height)}">{text}</a>'
 
+    def block_link_height(self, height: int) -> str:
+        return f'<a href="{self.bot.rpcx.human_link("block", height)}">#{height}</a>'
+
     def tx_link(self, txid: str, text: str) -> str:
         return f'<a href="{self.bot.rpcx.human_link("tx", txid)}">{text}</a>'
 
 
-async def try_send_notify(coro) -> int:
+async def try_send_notify(coro, chat_id: Optional[int] = None, recipients: Optional[Recipients] = None) -> int:
+    """Await a send, returning 1 if it was delivered or 0 if it failed.
+
+    With `recipients`, a send to `chat_id` that fails because the chat is gone
+    marks it dead, and one that succeeds marks it alive.
+    """
     try:
         await coro
+
+        if recipients is not None:
+            recipients.alive(chat_id)
+
         return 1
 
     except aiogram.exceptions.TelegramForbiddenError as exc:
         log.warning(f"Unable to send notification: {exc}")
 
+        if recipients is not None:
+            recipients.dead(chat_id, str(exc))
+
+    except aiogram.exceptions.TelegramBadRequest as exc:
+        log.error(f"Unable to send notification: <API Error> {exc}")
+
+        if recipients is not None and Recipients.is_dead_error(exc):
+            recipients.dead(chat_id, str(exc))
+
     except aiogram.exceptions.TelegramAPIError as exc:
         log.error(f"Unable to send notification: <API Error> {exc}")
 
@@ -0,0 +1,90 @@
+"""Bounded concurrent fan-out of notification work.
+
+Jobs are grouped by key (normally the recipient's tg_user_id) and run one at a
+time within a group, ordered by stage and then by submission. Distinct groups
+run concurrently, at most `limit` at once.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from hydra import log
+
+__all__ = "FanOut", "FanOutBatch"
+
+Job = Callable[[], Awaitable[int]]
+
+
+class FanOut:
+    STAGE_BLOCK = 0
+    STAGE_TX = 1
+    STAGE_CARD = 2
+
+    limit: int
+
+    _sem: asyncio.Semaphore
+
+    def __init__(self, limit: int):
+        self.limit = max(1, int(limit))
+        self._sem = asyncio.Semaphore(self.limit)
+
+    def batch(self) -> FanOutBatch:
+        return FanOutBatch(self)
+
+
+class FanOutBatch:
+    fan: FanOut
+
+    _groups: Dict[Hashable, List[Tuple[int, int, Job]]]
+    _uniq: Set[Hashable]
+    _sent: Dict[int, int]
+    _seq: int
+
+    def __init__(self, fan: FanOut):
+        self.fan = fan
+        self._groups = {}
+        self._uniq = set()
+        self._sent = {}
+        self._seq = 0
+
+    def add(self, key: Hashable, stage: int, job: Job, *, uniq: Optional[Hashable] = None) -> bool:
+        """Queue a job for the group `key`.
+
+        Jobs may be added to a group while it is running, as long as their
+        stage is not earlier than the one currently running.
+        Jobs with a `uniq` key already seen in this batch are dropped.
+        """
+        if uniq is not None:
+            if uniq in self._uniq:
+                return False
+
+            self._uniq.add(uniq)
+
+        self._seq += 1
+        heapq.heappush(self._groups.setdefault(key, []), (stage, self._seq, job))
+        return True
+
+    async def run(self) -> Dict[int, int]:
+        """Run all groups and return the number of messages sent per stage.
+        """
+        await asyncio.gather(*(
+            self.__run_group(key, jobs)
+            for key, jobs in tuple(self._groups.items())
+        ))
+
+        return self._sent
+
+    async def __run_group(self, key: Hashable, jobs: List[Tuple[int, int, Job]]):
+        async with self.fan._sem:
+            while jobs:
+                stage, _, job = heapq.heappop(jobs)
+
+                try:
+                    sent = await job()
+                    self._sent[stage] = self._sent.get(stage, 0) + sent
+                except asyncio.CancelledError:
+                    raise
+                except BaseException as exc:
+                    log.warning(f"Fan-out job for {key} failed: {exc}", exc_info=exc)
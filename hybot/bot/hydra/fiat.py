@@ -1,4 +1,4 @@
-from functools import lru_cache
+from typing import Dict
 
 import kucoin.exceptions
 from aiogram import types
@@ -7,6 +7,9 @@ from attrdict import AttrDict
 from . import HydraBot
 from .data import HydraBotData, schemas
 
+# Currency -> KuCoin currency details; kept across restarts by the snapshot.
+CURRENCIES: Dict[str, dict] = {}
+
 
 async def fiat(bot: HydraBot, msg: types.Message):
     u: schemas.User = await HydraBotData.user_load(bot, msg, create=False, requires_start=False, dm_only=False)
@@ -71,7 +74,8 @@ async def fiat(bot: HydraBot, msg: types.Message):
     if fiat_new not in bot.prices.currencies:
         return await msg.answer("Currency not found.")
 
-    await bot.db.asyncc.user_info_put(
+    await HydraBotData.user_info_put(
+        bot,
         u,
         {
             "fiat": fiat_new,
@@ -90,13 +94,22 @@ async def fiat(bot: HydraBot, msg: types.Message):
     )
 
 
-@lru_cache(maxsize=None)
 def get_currency(bot: HydraBot, currency: str) -> AttrDict:
+    kcc = CURRENCIES.get(currency, None)
+
+    if kcc is None:
+        kcc = CURRENCIES[currency] = fetch_currency(bot, currency)
+
+    return AttrDict(kcc)
+
+
+def fetch_currency(bot: HydraBot, currency: str) -> dict:
+    """KuCoin currency details, a blocking call; not cached, so it can run in the executor.
+    """
     try:
-        kcc = AttrDict(bot.prices.kuku.get_currency(currency))
-        return kcc
+        return dict(bot.prices.kuku.get_currency(currency))
     except kucoin.exceptions.KucoinAPIException:
-        return AttrDict(
+        return dict(
             currency=currency,
             name=currency,
             fullName=None
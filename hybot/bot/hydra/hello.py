@@ -16,6 +16,9 @@ async def hello(bot: HydraBot, msg: types.Message):
     if u is None:
         return
 
+    # Notifications and broadcasts come from the bot a user last started.
+    bot.claim(u.tg_user_id, u.uniq.pkid)
+
     response_intro = (
         "<pre>Welcome to the Hydraverse.</pre>\n\n"
         "I'm the $HYDRA staking and transaction notification bot, and "
@@ -71,7 +74,8 @@ async def hello(bot: HydraBot, msg: types.Message):
 
     if u.info.get("tz", ...) is ...:
 
-        await bot.db.asyncc.user_info_put(
+        await HydraBotData.user_info_put(
+            bot,
             u,
             {
                 "lang": msg.from_user.language_code,
@@ -0,0 +1,144 @@
+"""Bounded queue between the SSE block stream and event processing.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from attrdict import AttrDict
+
+from hydra import log
+from hydb.api.schemas import BlockSSEResult, SSEBlockEvent
+
+from hybot.util.conf import Config
+
+__all__ = "EventQueue",
+
+
+@Config.defaults
+class EventQueue:
+    """SSE block events waiting to be processed, each flagged if it arrived as part of a backlog.
+
+    When the queue is full, `overflow` decides what `put()` does:
+
+    - block: wait for room (the SSE reader stalls).
+    - coalesce: replace a queued event for the same block and event type,
+      otherwise wait for room.
+    - drop_mature: drop the oldest queued mature event, otherwise wait for room.
+    """
+    conf: AttrDict
+
+    CONF = {
+        "size": 256,
+        "overflow": "drop_mature",  # block | coalesce | drop_mature
+        "dwell_warn": 60,           # Seconds an event may wait before a warning is logged.
+    }
+
+    OVERFLOW = "block", "coalesce", "drop_mature"
+
+    _items: Deque[Tuple[BlockSSEResult, float, bool]]
+    _cond: Optional[asyncio.Condition]
+    _stats: AttrDict
+
+    def __init__(self):
+        self.conf = Config.get(EventQueue, defaults=True)
+
+        if self.conf.overflow not in EventQueue.OVERFLOW:
+            raise ValueError(f"Invalid EventQueue overflow '{self.conf.overflow}', expected one of {EventQueue.OVERFLOW}.")
+
+        self._items = deque()
+        self._cond = None
+        self._stats = AttrDict(
+            queued=0, depth_max=0, processed=0, dropped=0, coalesced=0, blocked=0, dwell_tot=0., dwell_max=0.
+        )
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self) -> AttrDict:
+        """Queue depth, overflow counts and dwell time (seconds) per event.
+        """
+        st = self._stats
+
+        return AttrDict(
+            depth=len(self._items),
+            depth_max=st.depth_max,
+            queued=st.queued,
+            processed=st.processed,
+            dropped=st.dropped,
+            coalesced=st.coalesced,
+            blocked=st.blocked,
+            dwell_avg=round(st.dwell_tot / st.processed, 3) if st.processed else 0.,
+            dwell_max=round(st.dwell_max, 3),
+        )
+
+    def __condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+
+        return self._cond
+
+    async def put(self, result: BlockSSEResult, backlog: bool = False):
+        cond = self.__condition()
+
+        async with cond:
+            if len(self._items) >= self.conf.size:
+                if self.conf.overflow == "coalesce" and self.__coalesce(result):
+                    return
+
+                if self.conf.overflow == "drop_mature":
+                    self.__drop_mature()
+
+                if len(self._items) >= self.conf.size:
+                    self._stats.blocked += 1
+                    log.warning(f"SSE event queue full ({len(self._items)}), ingestion waiting.")
+                    await cond.wait_for(lambda: len(self._items) < self.conf.size)
+
+            self._items.append((result, time.monotonic(), backlog))
+            self._stats.queued += 1
+            self._stats.depth_max = max(self._stats.depth_max, len(self._items))
+            cond.notify_all()
+
+    async def get(self) -> Tuple[BlockSSEResult, float, bool]:
+        """Wait for the next event, returning it with the seconds it spent queued and its backlog flag.
+        """
+        cond = self.__condition()
+
+        async with cond:
+            await cond.wait_for(lambda: len(self._items) > 0)
+
+            result, stamp, backlog = self._items.popleft()
+            cond.notify_all()
+
+        dwell = time.monotonic() - stamp
+
+        st = self._stats
+        st.processed += 1
+        st.dwell_tot += dwell
+        st.dwell_max = max(st.dwell_max, dwell)
+
+        if dwell > self.conf.dwell_warn:
+            log.warning(f"SSE event #{result.id} block #{result.block.height} {result.event} waited {round(dwell, 1)}s, {len(self._items)} queued.")
+
+        return result, dwell, backlog
+
+    def __coalesce(self, result: BlockSSEResult) -> bool:
+        for i, (queued, stamp, backlog) in enumerate(self._items):
+            if queued.event == result.event and queued.block.height == result.block.height:
+                self._items[i] = result, stamp, backlog
+                self._stats.coalesced += 1
+                return True
+
+        return False
+
+    def __drop_mature(self) -> bool:
+        for i, (queued, _, _) in enumerate(self._items):
+            if queued.event == SSEBlockEvent.mature:
+                del self._items[i]
+                self._stats.dropped += 1
+                log.warning(f"SSE event queue full: dropped mature event for block #{queued.block.height}.")
+                return True
+
+        return False
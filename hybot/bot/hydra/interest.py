@@ -0,0 +1,98 @@
+"""Which block event kinds an address has any subscriber for.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import FrozenSet, Tuple
+
+from attrdict import AttrDict
+
+from hydb.api.schemas import AddrHistResult
+
+from hybot.util.conf import Config
+from .conf import ConfSnapshot
+
+__all__ = "InterestIndex",
+
+
+@Config.defaults
+class InterestIndex:
+    """Address -> event kinds ("mined", "mature", "tx") with a non-hidden subscriber.
+
+    Entries are built from the subscribers' ConfSnapshots and reused while
+    the address has the same subscribers and ConfSnapshot.GENERATION is
+    unchanged. The bot's conf and user writes bump it; shard workers, whose
+    users change in the primary process, `clear()` the index when they
+    reload shared state. An address nobody wants an event for is then
+    skipped without resolving any conf.
+    """
+    conf: AttrDict
+
+    CONF = {
+        "size": 65536,
+    }
+
+    KINDS = "mined", "mature", "tx"
+
+    _addrs: OrderedDict[str, Tuple[FrozenSet[Tuple[int, int]], int, FrozenSet[str]]]
+
+    def __init__(self):
+        self.conf = Config.get(InterestIndex, defaults=True)
+        self._addrs = OrderedDict()
+
+    def __len__(self):
+        return len(self._addrs)
+
+    def clear(self):
+        self._addrs.clear()
+
+    @staticmethod
+    def subscribers(addr_hist: AddrHistResult) -> FrozenSet[Tuple[int, int]]:
+        return frozenset(
+            (ahu.user_addr.user.uniq.pkid, ahu.user_addr.pkid)
+            for ahu in addr_hist.addr_hist_user
+        )
+
+    def kinds(self, addr_hist: AddrHistResult) -> FrozenSet[str]:
+        addr = str(addr_hist.addr)
+        subscribers = InterestIndex.subscribers(addr_hist)
+
+        entry = self._addrs.get(addr, None)
+
+        if entry is not None and entry[0] == subscribers and entry[1] == ConfSnapshot.GENERATION:
+            self._addrs.move_to_end(addr)
+            return entry[2]
+
+        kinds = InterestIndex.build(addr_hist)
+
+        self._addrs[addr] = subscribers, ConfSnapshot.GENERATION, kinds
+        self._addrs.move_to_end(addr)
+
+        while len(self._addrs) > self.conf.size:
+            self._addrs.popitem(last=False)
+
+        return kinds
+
+    def wants(self, addr_hist: AddrHistResult, kind: str) -> bool:
+        return kind in self.kinds(addr_hist)
+
+    @staticmethod
+    def build(addr_hist: AddrHistResult) -> FrozenSet[str]:
+        kinds = set()
+
+        for ahu in addr_hist.addr_hist_user:
+            conf_block = ConfSnapshot.of(ahu.user_addr.user, ahu.user_addr).block
+
+            if conf_block.notify != "hide":
+                kinds.add("mined")
+
+            if conf_block.mature != "hide":
+                kinds.add("mature")
+
+            if conf_block.tx != "hide":
+                kinds.add("tx")
+
+            if len(kinds) == len(InterestIndex.KINDS):
+                break
+
+        return frozenset(kinds)
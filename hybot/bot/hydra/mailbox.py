@@ -0,0 +1,199 @@
+"""Per-chat merging of the notifications for one block.
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from aiogram import types
+from attrdict import AttrDict
+
+from .sched import Lane
+
+__all__ = "Mailbox",
+
+
+class MailPart:
+    __slots__ = "user", "kind", "text", "markup", "lane", "addr", "mentions"
+
+    user: int
+    kind: str
+    text: str
+    markup: Optional[types.InlineKeyboardMarkup]
+    lane: Lane
+    addr: Optional[str]
+    mentions: List[str]
+
+    def __init__(self, user: int, kind: str, text: str, markup: Optional[types.InlineKeyboardMarkup], lane: Lane,
+                 addr: Optional[str] = None, mentions: Optional[List[str]] = None):
+        self.user = user
+        self.kind = kind
+        self.text = text
+        self.markup = markup
+        self.lane = lane
+        self.addr = addr
+        self.mentions = mentions if mentions is not None else []
+
+    @property
+    def event(self) -> str:
+        return self.kind.split(":", 1)[0]
+
+    @property
+    def order(self) -> Tuple[int, int, str]:
+        return self.user, Mailbox.ORDER.get(self.event, len(Mailbox.ORDER)), self.kind
+
+
+class Mailbox:
+    """Notification bodies posted for each chat while a block is processed.
+
+    `messages()` joins the bodies for a chat into as few messages as fit in
+    Telegram's limit, in a stable order (user, then mined/mature/TX, then
+    address) so that a replayed block produces the same messages.
+
+    In group chats, bodies for the same (address, event) from several members
+    are posted once, mentioning every member who watches that address.
+    """
+    LIMIT = 4096
+    SEP = "\n\n"
+
+    ORDER = {
+        "mined": 0,
+        "mature": 1,
+        "tx": 2,
+    }
+
+    _chats: Dict[int, List[MailPart]]
+    _claimed: Set[Tuple[int, str, str]]
+
+    deduped: int
+
+    def __init__(self):
+        self._chats = {}
+        self._claimed = set()
+        self.deduped = 0
+
+    def __len__(self):
+        return len(self._chats)
+
+    @staticmethod
+    def is_group(chat_id: int) -> bool:
+        return chat_id < 0
+
+    def post(self, chat_id: int, user: int, kind: str, text: str,
+             markup: Optional[types.InlineKeyboardMarkup] = None, lane: Lane = Lane.BULK,
+             *, addr: Optional[str] = None, mention: Optional[str] = None):
+        self._chats.setdefault(chat_id, []).append(
+            MailPart(user, kind, text, markup, lane, addr, [mention] if mention is not None else None)
+        )
+
+    def claim(self, chat_id: int, addr: str, event: str) -> bool:
+        """Claim (chat, address, event) for a message sent outside the mailbox (e.g. a card).
+
+        Always True for private chats; in a group only the first claim succeeds.
+        """
+        if not Mailbox.is_group(chat_id):
+            return True
+
+        key = chat_id, addr, event
+
+        if key in self._claimed:
+            self.deduped += 1
+            return False
+
+        self._claimed.add(key)
+        return True
+
+    def messages(self) -> Iterator[Tuple[int, List[AttrDict]]]:
+        """(chat_id, [AttrDict(text, markup, lane), ...]) for every chat with mail.
+        """
+        for chat_id, parts in self._chats.items():
+            parts = sorted(parts, key=lambda part: part.order)
+
+            if Mailbox.is_group(chat_id):
+                parts = self.dedupe(parts)
+
+            yield chat_id, Mailbox.merge(parts)
+
+    def dedupe(self, parts: List[MailPart]) -> List[MailPart]:
+        """Keep the first body per (address, event), mentioning everyone it was posted for.
+        """
+        kept: Dict[Tuple[str, str], MailPart] = {}
+        result = []
+
+        for part in parts:
+            if part.addr is None:
+                result.append(part)
+                continue
+
+            key = part.addr, part.event
+            first = kept.get(key, None)
+
+            if first is None:
+                kept[key] = part
+                result.append(part)
+                continue
+
+            self.deduped += 1
+
+            for mention in part.mentions:
+                if mention not in first.mentions:
+                    first.mentions.append(mention)
+
+        for part in kept.values():
+            if len(part.mentions) > 1:
+                part.text += f"\n👥 {', '.join(part.mentions)}"
+
+            part.markup = None
+
+        return result
+
+    @staticmethod
+    def merge(parts: List[MailPart]) -> List[AttrDict]:
+        messages: List[List[MailPart]] = [[]]
+        length = 0
+
+        for part in parts:
+            for text in Mailbox.split(part.text):
+                if messages[-1] and length + len(Mailbox.SEP) + len(text) > Mailbox.LIMIT:
+                    messages.append([])
+                    length = 0
+
+                length += (len(Mailbox.SEP) if messages[-1] else 0) + len(text)
+                messages[-1].append(MailPart(part.user, part.kind, text, part.markup, part.lane))
+
+        return [
+            AttrDict(
+                text=Mailbox.SEP.join(part.text for part in message),
+                markup=Mailbox.markup(message),
+                lane=min(part.lane for part in message),
+            )
+            for message in messages
+            if message
+        ]
+
+    @staticmethod
+    def markup(message: List[MailPart]) -> Optional[types.InlineKeyboardMarkup]:
+        """A button belongs to one notification, so it's only kept when a single part has one.
+        """
+        markups = [part.markup for part in message if part.markup is not None]
+        return markups[0] if len(markups) == 1 else None
+
+    @staticmethod
+    def split(text: str) -> List[str]:
+        """Split a body longer than LIMIT at line breaks (or hard, for a single long line).
+        """
+        if len(text) <= Mailbox.LIMIT:
+            return [text]
+
+        chunks = [""]
+
+        for line in text.split("\n"):
+            while len(line) > Mailbox.LIMIT:
+                chunks.append(line[:Mailbox.LIMIT])
+                line = line[Mailbox.LIMIT:]
+
+            if chunks[-1] and len(chunks[-1]) + 1 + len(line) > Mailbox.LIMIT:
+                chunks.append(line)
+            else:
+                chunks[-1] = f"{chunks[-1]}\n{line}" if chunks[-1] else line
+
+        return [chunk for chunk in chunks if chunk]
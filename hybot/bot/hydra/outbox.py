@@ -0,0 +1,298 @@
+"""Durable outbox for block notifications.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+from aiogram import types
+from attrdict import AttrDict
+
+from hydra import log
+from hydb.api.schemas import BlockSSEResult
+
+from hybot.util.conf import Config
+
+__all__ = "Outbox", "OutboxKey"
+
+OutboxKey = Tuple[int, int]  # (event id, block height)
+
+
+@Config.defaults
+class Outbox:
+    """SQLite record of block notifications and their delivery.
+
+    Messages are keyed by (event id, block height, user, kind, chat): `put()`
+    stores a message as pending unless its key already exists, `done()`
+    marks it delivered, and `pending()` returns what a restart still has to
+    send. Processed SSE events are recorded as well, so that a replayed event
+    can be skipped without rendering anything, along with a cursor of the
+    last event id and block height processed and the digests still being
+    collected.
+    """
+    conf: AttrDict
+    path: str
+    db: sqlite3.Connection
+
+    CONF = {
+        "file": "outbox.db",   # Relative to Config.APP_BASE.
+        "keep_hours": 72,      # Delivered entries are pruned after this long.
+    }
+
+    PENDING = 0
+    SENT = 1
+    FAILED = 2
+
+    PRUNE_SEC = 3600
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS event (
+            event INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            done INTEGER NOT NULL DEFAULT 0,
+            created REAL NOT NULL,
+            PRIMARY KEY (event, height)
+        );
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            user INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            text TEXT,
+            markup TEXT,
+            lane INTEGER NOT NULL DEFAULT 0,
+            state INTEGER NOT NULL DEFAULT 0,
+            created REAL NOT NULL,
+            UNIQUE (event, height, user, kind, chat_id)
+        );
+        CREATE TABLE IF NOT EXISTS cursor (
+            name TEXT PRIMARY KEY,
+            event INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            stamp REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS digest (
+            user INTEGER PRIMARY KEY,
+            event INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            started REAL NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS outbox_state ON outbox (state, id);
+        CREATE INDEX IF NOT EXISTS outbox_created ON outbox (created);
+    """
+
+    _pruned: float
+    _depth: int
+    _marks: List[Tuple[int, int]]
+
+    def __init__(self, path: Optional[str] = None):
+        self.conf = Config.get(Outbox, defaults=True)
+        self.path = path or os.path.join(Config.APP_BASE, self.conf.file)
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self.db = sqlite3.connect(self.path, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(Outbox.SCHEMA)
+
+        self._pruned = 0.
+        self._depth = 0
+        self._marks = []
+        self.prune()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    @contextmanager
+    def transaction(self):
+        """Group the writes made inside into one commit; nests, committing when the outermost ends.
+
+        Only for synchronous code: a transaction held across an await would take in other tasks' writes.
+        """
+        if self._depth == 0:
+            self.db.execute("BEGIN")
+
+        self._depth += 1
+
+        try:
+            yield
+        except BaseException:
+            self._depth -= 1
+
+            if self._depth == 0:
+                self.db.execute("ROLLBACK")
+
+            raise
+
+        self._depth -= 1
+
+        if self._depth == 0:
+            self.db.execute("COMMIT")
+
+    def seen(self, result: BlockSSEResult) -> bool:
+        """True if this SSE event was already processed to the end.
+        """
+        row = self.db.execute(
+            "SELECT done FROM event WHERE event = ? AND height = ?", (result.id, result.block.height)
+        ).fetchone()
+
+        return row is not None and bool(row["done"])
+
+    def begin(self, result: BlockSSEResult):
+        self.db.execute(
+            "INSERT OR IGNORE INTO event (event, height, created) VALUES (?, ?, ?)",
+            (result.id, result.block.height, time.time())
+        )
+
+    def finish(self, result: BlockSSEResult):
+        """Mark an event processed, along with the deliveries marked by `done()` so far, in one commit.
+        """
+        with self.transaction():
+            self.flush()
+
+            self.db.execute(
+                "UPDATE event SET done = 1 WHERE event = ? AND height = ?", (result.id, result.block.height)
+            )
+
+            self.db.execute(
+                "INSERT INTO cursor (name, event, height, stamp) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET "
+                "event = MAX(event, excluded.event), height = MAX(height, excluded.height), stamp = excluded.stamp",
+                (str(result.event), result.id, result.block.height, time.time())
+            )
+
+        if time.monotonic() - self._pruned > Outbox.PRUNE_SEC:
+            self.prune()
+
+    def cursor(self, event: Optional[str] = None) -> Optional[AttrDict]:
+        """The last (event id, block height) processed, for one SSE event type or across all of them.
+        """
+        if event is not None:
+            row = self.db.execute("SELECT event, height, stamp FROM cursor WHERE name = ?", (event,)).fetchone()
+        else:
+            row = self.db.execute("SELECT MAX(event) AS event, MAX(height) AS height, MAX(stamp) AS stamp FROM cursor").fetchone()
+
+        if row is None or row["event"] is None:
+            return None
+
+        return AttrDict(event=row["event"], height=row["height"], stamp=row["stamp"])
+
+    @staticmethod
+    def key(result: BlockSSEResult) -> OutboxKey:
+        return result.id, result.block.height
+
+    def put(self, key: OutboxKey, user: int, kind: str, chat_id: int,
+            text: Optional[str], markup: Optional[types.InlineKeyboardMarkup] = None, lane: int = 0) -> Optional[AttrDict]:
+        """Store a pending message, or return None if (key, user, kind, chat_id) was already stored.
+
+        A None `text` only records the delivery (e.g. for address cards rendered at send time).
+        """
+        cur = self.db.execute(
+            "INSERT OR IGNORE INTO outbox (event, height, user, kind, chat_id, text, markup, lane, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (*key, user, kind, chat_id, text, Outbox.markup_dump(markup), int(lane), time.time())
+        )
+
+        if not cur.rowcount:
+            return None
+
+        return AttrDict(id=cur.lastrowid, user=user, kind=kind, chat_id=chat_id, text=text, markup=markup, lane=int(lane))
+
+    def done(self, entry_id: int, sent: bool):
+        """Mark an entry delivered or failed; written by the next `flush()` or `finish()`.
+
+        Until then a restart sends it again, so a crash can repeat a block's messages but never lose them.
+        """
+        self._marks.append((Outbox.SENT if sent else Outbox.FAILED, entry_id))
+
+    def flush(self):
+        marks, self._marks = self._marks, []
+
+        if marks:
+            with self.transaction():
+                self.db.executemany("UPDATE outbox SET state = ? WHERE id = ?", marks)
+
+    def pending(self) -> List[AttrDict]:
+        """Undelivered messages in the order they were stored.
+
+        Pending entries without text can't be sent again and are marked failed.
+        """
+        self.flush()
+
+        dropped = self.db.execute(
+            "UPDATE outbox SET state = ? WHERE state = ? AND text IS NULL", (Outbox.FAILED, Outbox.PENDING)
+        ).rowcount
+
+        if dropped:
+            log.info(f"Outbox: dropped {dropped} pending address card{'s' if dropped != 1 else ''}.")
+
+        return [
+            AttrDict(
+                id=row["id"],
+                user=row["user"],
+                kind=row["kind"],
+                chat_id=row["chat_id"],
+                text=row["text"],
+                markup=Outbox.markup_load(row["markup"]),
+                lane=row["lane"],
+            )
+            for row in self.db.execute(
+                "SELECT id, user, kind, chat_id, text, markup, lane FROM outbox WHERE state = ? ORDER BY id", (Outbox.PENDING,)
+            )
+        ]
+
+    def digest_put(self, user: int, key: OutboxKey, started: float, data: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO digest (user, event, height, started, data) VALUES (?, ?, ?, ?, ?)",
+            (user, *key, started, data)
+        )
+
+    def digest_del(self, user: int, started: float):
+        """Drop a user's digest once it is stored as a message, unless a new window has started since.
+        """
+        self.db.execute("DELETE FROM digest WHERE user = ? AND started = ?", (user, started))
+
+    def digests(self) -> List[AttrDict]:
+        return [
+            AttrDict(user=row["user"], key=(row["event"], row["height"]), started=row["started"], data=row["data"])
+            for row in self.db.execute("SELECT user, event, height, started, data FROM digest")
+        ]
+
+    def prune(self):
+        self._pruned = time.monotonic()
+        before = time.time() - self.conf.keep_hours * 3600
+
+        self.db.execute("DELETE FROM outbox WHERE created < ? AND state != ?", (before, Outbox.PENDING))
+        self.db.execute("DELETE FROM event WHERE created < ? AND done = 1", (before,))
+
+    @staticmethod
+    def markup_dump(markup: Optional[types.InlineKeyboardMarkup]) -> Optional[str]:
+        if markup is None:
+            return None
+
+        return json.dumps([
+            [dict(text=button.text, callback_data=button.callback_data) for button in row]
+            for row in markup.inline_keyboard
+        ])
+
+    @staticmethod
+    def markup_load(markup: Optional[str]) -> Optional[types.InlineKeyboardMarkup]:
+        if markup is None:
+            return None
+
+        return types.InlineKeyboardMarkup(
+            inline_keyboard=[
+                [types.InlineKeyboardButton(**button) for button in row]
+                for row in json.loads(markup)
+            ]
+        )
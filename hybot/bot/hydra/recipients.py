@@ -0,0 +1,170 @@
+"""Registry of a bot's users and of the chats it can no longer send to.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import aiogram.exceptions
+from attrdict import AttrDict
+
+from hydra import log
+
+from hybot.util.conf import Config
+
+__all__ = "Recipients",
+
+
+@Config.defaults
+class Recipients:
+    """A bot's members and the chats marked unreachable after Telegram refused a send to them.
+
+    Members are the users a bot notifies and broadcasts to (tg_user_id ->
+    user pkid). With several bots on one database each user is a member of
+    one bot; see HydraBot.claim().
+
+    A chat is marked dead when the user blocked the bot or deleted their
+    account, when the bot was removed from a group, or when the chat no longer
+    exists. Notifications for dead chats are skipped before anything is
+    rendered. Once `probe_hours` have passed (doubling with each failure up to
+    `probe_max_hours`), the next notification is let through as a probe. A
+    delivered probe, or any message or callback from the chat, marks it alive.
+    """
+    conf: AttrDict
+    path: str
+    db: sqlite3.Connection
+
+    CONF = {
+        "file": "recipients.db",  # Relative to Config.APP_BASE.
+        "probe_hours": 24,
+        "probe_max_hours": 168,
+    }
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS member (
+            chat_id INTEGER PRIMARY KEY,
+            pkid INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS dead (
+            chat_id INTEGER PRIMARY KEY,
+            reason TEXT NOT NULL,
+            since REAL NOT NULL,
+            fails INTEGER NOT NULL,
+            probe REAL NOT NULL
+        );
+    """
+
+    NOT_FOUND = "chat not found", "user not found", "bot was kicked", "group chat was deactivated"
+
+    members: Dict[int, int]
+    _dead: Dict[int, Tuple[int, float]]  # chat_id -> (fails, probe time)
+    _stats: AttrDict
+
+    def __init__(self, path: Optional[str] = None):
+        self.conf = Config.get(Recipients, defaults=True)
+        self.path = path or os.path.join(Config.APP_BASE, self.conf.file)
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self.db = sqlite3.connect(self.path, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(Recipients.SCHEMA)
+
+        self.reload()
+
+        self._stats = AttrDict(marked=0, recovered=0)
+
+        if self._dead:
+            log.info(f"Recipients: {len(self._dead)} unreachable chat{'s' if len(self._dead) != 1 else ''}.")
+
+    def __len__(self):
+        return len(self._dead)
+
+    def reload(self):
+        """Reload members and dead chats from the database, e.g. to see changes made by another process.
+        """
+        self.members = {
+            row["chat_id"]: row["pkid"]
+            for row in self.db.execute("SELECT chat_id, pkid FROM member")
+        }
+
+        self._dead = {
+            row["chat_id"]: (row["fails"], row["probe"])
+            for row in self.db.execute("SELECT chat_id, fails, probe FROM dead")
+        }
+
+    def close(self):
+        self.db.close()
+
+    def stats(self) -> AttrDict:
+        return AttrDict(dead=len(self._dead), **self._stats)
+
+    def join(self, tg_user_id: int, pkid: int):
+        if self.members.get(tg_user_id, None) == pkid:
+            return
+
+        self.members[tg_user_id] = pkid
+        self.db.execute("INSERT OR REPLACE INTO member (chat_id, pkid) VALUES (?, ?)", (tg_user_id, pkid))
+
+    def join_all(self, members: Dict[int, int]):
+        self.members.update(members)
+        self.db.executemany("INSERT OR REPLACE INTO member (chat_id, pkid) VALUES (?, ?)", list(members.items()))
+
+    def leave(self, tg_user_id: int):
+        if self.members.pop(tg_user_id, None) is not None:
+            self.db.execute("DELETE FROM member WHERE chat_id = ?", (tg_user_id,))
+
+    @staticmethod
+    def is_dead_error(exc: BaseException) -> bool:
+        """True for send errors that mean the chat can't receive messages from the bot anymore.
+        """
+        if isinstance(exc, aiogram.exceptions.TelegramForbiddenError):
+            return True
+
+        if isinstance(exc, aiogram.exceptions.TelegramBadRequest):
+            message = str(exc).lower()
+            return any(text in message for text in Recipients.NOT_FOUND)
+
+        return False
+
+    def reachable(self, chat_id: int) -> bool:
+        """False for a dead chat until its next probe is due.
+        """
+        entry = self._dead.get(chat_id, None)
+
+        if entry is None:
+            return True
+
+        return time.time() >= entry[1]
+
+    def any_reachable(self, chat_ids: Iterable[int]) -> bool:
+        return any(self.reachable(chat_id) for chat_id in chat_ids)
+
+    def dead(self, chat_id: int, reason: str):
+        fails = self._dead.get(chat_id, (0, 0.))[0] + 1
+        hours = min(self.conf.probe_hours * 2 ** (fails - 1), self.conf.probe_max_hours)
+        now = time.time()
+        probe = now + hours * 3600
+
+        self._dead[chat_id] = fails, probe
+        self._stats.marked += 1
+
+        self.db.execute(
+            "INSERT INTO dead (chat_id, reason, since, fails, probe) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (chat_id) DO UPDATE SET reason = excluded.reason, fails = excluded.fails, probe = excluded.probe",
+            (chat_id, reason, now, fails, probe)
+        )
+
+        log.info(f"Recipients: chat {chat_id} unreachable ({reason}), next probe in {hours}h.")
+
+    def alive(self, chat_id: int):
+        if self._dead.pop(chat_id, None) is None:
+            return
+
+        self._stats.recovered += 1
+        self.db.execute("DELETE FROM dead WHERE chat_id = ?", (chat_id,))
+
+        log.info(f"Recipients: chat {chat_id} is reachable again.")
@@ -0,0 +1,362 @@
+"""Outbound Telegram send scheduler.
+
+All message sends and edits pass through `SendScheduler` as a session request
+middleware. Requests are queued in priority lanes and released under token
+buckets for the global bot limit and for each private or group chat, so a
+throttled chat only delays its own messages. Background lanes such as
+catch-up also have a bucket of their own. Each chat has at most one request
+in flight, which keeps its messages in order across retries.
+
+Group chats share a small budget (`group_rate` per minute), so sends and
+throttles are also counted per group and `budget()` reports what a group
+can take right now.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Deque, Dict, Optional, Set, Tuple, Union
+
+import aiogram.exceptions
+from aiogram import Bot, methods
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from attrdict import AttrDict
+
+from hydra import log
+
+from hybot.util.conf import Config
+from hybot.util.rate import TokenBucket
+
+__all__ = "Lane", "SendScheduler"
+
+
+class Lane(IntEnum):
+    CMD = 0    # Interactive command replies and callbacks.
+    BLOCK = 1  # Mined block notifications.
+    BULK = 2   # Mature, TX and address card notifications.
+    CATCHUP = 3  # Notifications for blocks that arrived late.
+    BROADCAST = 4  # Admin announcements to every user.
+
+
+LANE: ContextVar[Lane] = ContextVar("hybot_send_lane", default=Lane.CMD)
+
+
+class _Pending:
+    fut: asyncio.Future
+    key: Union[int, str, None]
+    lane: Lane
+    make_request: NextRequestMiddlewareType
+    bot: Bot
+    method: methods.TelegramMethod
+    queued: float
+
+    def __init__(self, fut, key, lane, make_request, bot, method):
+        self.fut = fut
+        self.key = key
+        self.lane = lane
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.queued = time.monotonic()
+
+
+@Config.defaults
+class SendScheduler(BaseRequestMiddleware):
+    conf: AttrDict
+
+    CONF = {
+        "global_rate": 30,    # msg/sec for the whole bot.
+        "global_burst": 30,
+        "private_rate": 1,    # msg/sec per private chat.
+        "private_burst": 3,
+        "group_rate": 20,     # msg/min per group chat.
+        "group_burst": 5,
+        "catchup_rate": 5,    # msg/sec for Lane.CATCHUP, so catch-up can't crowd out live delivery.
+        "catchup_burst": 5,
+        "broadcast_rate": 2,  # msg/sec for Lane.BROADCAST, well below the global rate.
+        "broadcast_burst": 2,
+    }
+
+    SCHEDULED = (
+        methods.SendMessage,
+        methods.EditMessageText,
+        methods.EditMessageReplyMarkup,
+        methods.CopyMessage,
+        methods.ForwardMessage,
+    )
+
+    PRUNE_SEC = 60
+
+    _global: TokenBucket
+    _chats: Dict[Union[int, str], TokenBucket]
+    _lane_buckets: Dict[Lane, TokenBucket]
+    _busy: Set[Union[int, str]]
+    _lanes: Dict[Lane, OrderedDict[Any, Deque[_Pending]]]
+    _stats: Dict[Lane, AttrDict]
+    _groups: Dict[Union[int, str], AttrDict]
+    _loop: Optional[asyncio.AbstractEventLoop]
+    _task: Optional[asyncio.Task]
+    _wake: Optional[asyncio.Event]
+    _pruned: float
+
+    def __init__(self, share: float = 1.):
+        """`share` is this process's part of the bot's global rate when several processes send for it.
+        """
+        self.conf = Config.get(SendScheduler, defaults=True)
+
+        self._global = TokenBucket(self.conf.global_rate * share, self.conf.global_burst * share)
+        self._chats = {}
+        self._lane_buckets = {
+            Lane.CATCHUP: TokenBucket(self.conf.catchup_rate, self.conf.catchup_burst),
+            Lane.BROADCAST: TokenBucket(self.conf.broadcast_rate, self.conf.broadcast_burst),
+        }
+        self._busy = set()
+        self._lanes = {ln: OrderedDict() for ln in Lane}
+        self._stats = {ln: AttrDict(queued=0, sent=0, retried=0, wait_tot=0., wait_max=0.) for ln in Lane}
+        self._groups = {}
+        self._loop = None
+        self._task = None
+        self._wake = None
+        self._pruned = time.monotonic()
+
+    @staticmethod
+    @contextmanager
+    def lane(lane: Optional[Lane]):
+        """Send with `lane` priority for the duration of the context (None keeps the current lane).
+        """
+        if lane is None:
+            yield
+            return
+
+        token = LANE.set(lane)
+
+        try:
+            yield
+        finally:
+            LANE.reset(token)
+
+    def stats(self) -> AttrDict:
+        """Queue depth and wait time (seconds) per lane.
+        """
+        return AttrDict({
+            ln.name.lower(): dict(
+                depth=st.queued,
+                sent=st.sent,
+                retried=st.retried,
+                wait_avg=round(st.wait_tot / st.sent, 3) if st.sent else 0.,
+                wait_max=round(st.wait_max, 3),
+            )
+            for ln, st in self._stats.items()
+        })
+
+    def budget(self, chat_id: Union[int, str]) -> int:
+        """Messages `chat_id` can be sent now without waiting on its own bucket, less any already queued.
+        """
+        bucket = self.__bucket(chat_id)
+        queued = sum(len(chats.get(chat_id, ())) for chats in self._lanes.values())
+
+        return max(0, int(bucket.available()) - queued)
+
+    def group_stats(self) -> AttrDict:
+        """Sent and throttled counts per group chat.
+        """
+        return AttrDict({str(key): dict(st) for key, st in self._groups.items()})
+
+    def __group(self, key: Union[int, str, None]) -> Optional[AttrDict]:
+        if key is None or isinstance(key, int) and key > 0:
+            return None
+
+        st = self._groups.get(key, None)
+
+        if st is None:
+            st = self._groups[key] = AttrDict(sent=0, throttled=0)
+
+        return st
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: methods.TelegramMethod):
+        if not isinstance(method, SendScheduler.SCHEDULED):
+            return await make_request(bot, method)
+
+        self.__start()
+
+        item = _Pending(
+            fut=self._loop.create_future(),
+            key=getattr(method, "chat_id", None),
+            lane=LANE.get(),
+            make_request=make_request,
+            bot=bot,
+            method=method,
+        )
+
+        self.__push(item)
+        return await item.fut
+
+    def __start(self):
+        loop = asyncio.get_running_loop()
+
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._wake = asyncio.Event()
+            self._task = loop.create_task(self.__dispatch())
+
+    def __push(self, item: _Pending, front: bool = False):
+        queue = self._lanes[item.lane].setdefault(item.key, deque())
+
+        if front:
+            queue.appendleft(item)
+        else:
+            queue.append(item)
+
+        self._stats[item.lane].queued += 1
+        self._wake.set()
+
+    def __bucket(self, key: Union[int, str, None]) -> Optional[TokenBucket]:
+        if key is None:
+            return None
+
+        bucket = self._chats.get(key, None)
+
+        if bucket is None:
+            if isinstance(key, int) and key > 0:
+                bucket = TokenBucket(self.conf.private_rate, self.conf.private_burst)
+            else:
+                bucket = TokenBucket(self.conf.group_rate / 60, self.conf.group_burst)
+
+            self._chats[key] = bucket
+
+        return bucket
+
+    def __next(self, now: float) -> Tuple[Optional[_Pending], Optional[float]]:
+        """Pick the next sendable request, or return how long to wait for one.
+        """
+        wait = self._global.delay(now)
+
+        if wait > 0:
+            return None, wait
+
+        wait = None
+
+        for ln in Lane:
+            chats = self._lanes[ln]
+
+            if not chats:
+                continue
+
+            lane_bucket = self._lane_buckets.get(ln, None)
+
+            if lane_bucket is not None:
+                delay = lane_bucket.delay(now)
+
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+
+            for key, queue in chats.items():
+                if key in self._busy:
+                    continue
+
+                bucket = self.__bucket(key)
+                delay = bucket.delay(now) if bucket is not None else 0.
+
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+
+                item = queue.popleft()
+
+                if not queue:
+                    del chats[key]
+                else:
+                    chats.move_to_end(key)  # Round-robin between chats in a lane.
+
+                if bucket is not None:
+                    bucket.take(now)
+                    self._busy.add(key)
+
+                if lane_bucket is not None:
+                    lane_bucket.take(now)
+
+                self._global.take(now)
+
+                return item, None
+
+        return None, wait
+
+    async def __dispatch(self):
+        while 1:
+            now = time.monotonic()
+            item, wait = self.__next(now)
+
+            if item is None:
+                self._wake.clear()
+
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+                continue
+
+            st = self._stats[item.lane]
+            st.queued -= 1
+
+            if item.fut.done():  # Caller went away.
+                self._busy.discard(item.key)
+                continue
+
+            asyncio.create_task(self.__send(item, now - item.queued))
+
+            if now - self._pruned > SendScheduler.PRUNE_SEC:
+                self._pruned = now
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle(now)}
+
+    async def __send(self, item: _Pending, waited: float):
+        try:
+            await self.__request(item, waited)
+        finally:
+            self._busy.discard(item.key)
+            self._wake.set()
+
+    async def __request(self, item: _Pending, waited: float):
+        st = self._stats[item.lane]
+
+        try:
+            result = await item.make_request(item.bot, item.method)
+
+        except aiogram.exceptions.TelegramRetryAfter as exc:
+            log.warning(f"Throttled on chat {item.key} ({item.lane.name}): {exc}")
+            st.retried += 1
+
+            group = self.__group(item.key)
+
+            if group is not None:
+                group.throttled += 1
+
+            bucket = self.__bucket(item.key)
+
+            (bucket if bucket is not None else self._global).hold(exc.retry_after)
+
+            self.__push(item, front=True)
+            return
+
+        except BaseException as exc:
+            if not item.fut.done():
+                item.fut.set_exception(exc)
+
+            return
+
+        st.sent += 1
+        st.wait_tot += waited
+        st.wait_max = max(st.wait_max, waited)
+
+        group = self.__group(item.key)
+
+        if group is not None:
+            group.sent += 1
+
+        if not item.fut.done():
+            item.fut.set_result(result)
@@ -0,0 +1,180 @@
+"""Notification work split across forked worker processes.
+"""
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import zlib
+from multiprocessing.connection import Connection
+from typing import List, Optional, Tuple
+
+from attrdict import AttrDict
+
+from hydra import log
+from hydb.api.schemas import BlockSSEResult
+
+from hybot.util.conf import Config
+
+__all__ = "Shard",
+
+
+@Config.defaults
+class Shard:
+    """This process's share of block notification work.
+
+    With `workers` above 1, `fork()` starts that many processes in total.
+    Each owns a hash range of notification targets and renders and sends only
+    their notifications. The first process (the primary) also handles
+    commands and reads the SSE stream. It passes every event to the others
+    over a pipe, in order. A worker whose pipe is full stalls the primary's
+    reader rather than losing events. When the primary exits, the workers see
+    their pipe close and shut down too.
+
+    Sends are spread over all processes, so each one's scheduler gets
+    1/count of the global rate.
+    """
+    conf: AttrDict
+    index: int
+    count: int
+
+    CONF = {
+        "workers": 1,        # Processes, including the one handling commands.
+        "reload": 60,        # Seconds between reloads of shared state (e.g. unreachable chats) in workers.
+    }
+
+    _conns: List[Connection]      # Primary: one pipe to each worker.
+    _conn: Optional[Connection]   # Worker: the pipe from the primary.
+    _stop: Optional[asyncio.Event]
+
+    def __init__(self, index: int = 0, count: int = 1, conns: Optional[List[Connection]] = None, conn: Optional[Connection] = None):
+        self.conf = Config.get(Shard, defaults=True)
+        self.index = index
+        self.count = count
+        self._conns = conns or []
+        self._conn = conn
+        self._stop = None
+
+    def __repr__(self):
+        return f"Shard({self.index}/{self.count})"
+
+    @property
+    def primary(self) -> bool:
+        return self.index == 0
+
+    @property
+    def share(self) -> float:
+        return 1. / self.count
+
+    @staticmethod
+    def fork() -> Shard:
+        """Fork the configured number of workers; returns the Shard of the calling process (primary or worker).
+        """
+        count = max(1, int(Config.get(Shard, defaults=True).workers))
+
+        if count == 1:
+            return Shard()
+
+        conns = []
+
+        for index in range(1, count):
+            recv, send = multiprocessing.Pipe(duplex=False)
+            pid = os.fork()
+
+            if pid == 0:
+                send.close()
+
+                for conn in conns:
+                    conn.close()
+
+                return Shard(index, count, conn=recv)
+
+            recv.close()
+            conns.append(send)
+
+            log.info(f"Shard {index}/{count}: started worker pid {pid}.")
+
+        return Shard(0, count, conns=conns)
+
+    @staticmethod
+    def of(key: int, count: int) -> int:
+        return zlib.crc32(key.to_bytes(8, "big", signed=True)) % count
+
+    def owns(self, key: int) -> bool:
+        return self.count == 1 or Shard.of(key, self.count) == self.index
+
+    def path(self, file: str) -> str:
+        """`file` under Config.APP_BASE, made distinct per process when sharded.
+        """
+        if self.count > 1:
+            root, ext = os.path.splitext(file)
+            file = f"{root}.{self.index}{ext}"
+
+        return os.path.join(Config.APP_BASE, file)
+
+    async def publish(self, result: BlockSSEResult, backlog: bool = False):
+        """Send an event and its backlog flag to every worker (primary only).
+        """
+        loop = asyncio.get_running_loop()
+
+        for conn in list(self._conns):
+            try:
+                await loop.run_in_executor(None, conn.send, (result, backlog))
+            except (BrokenPipeError, EOFError, OSError) as exc:
+                log.critical(f"{self}: lost a worker, its users won't be notified until restart: {exc}")
+                self._conns.remove(conn)
+
+    async def receive(self) -> Optional[Tuple[BlockSSEResult, bool]]:
+        """The next event and its backlog flag from the primary (workers only), or None once it has gone away.
+        """
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, self._conn.recv)
+        except (EOFError, OSError):
+            return None
+
+    def close(self):
+        for conn in self._conns:
+            conn.close()
+
+        if self._conn is not None:
+            self._conn.close()
+
+    async def serve(self, bot, handle_signals: bool = True):
+        """Run a worker's bot: startup hooks (event processing) until signalled or the primary exits.
+
+        Bots served together in one worker stop together.
+        """
+        dp = bot.dp
+        loop = asyncio.get_running_loop()
+
+        if self._stop is None:
+            self._stop = asyncio.Event()
+
+        stop = self._stop
+
+        if handle_signals:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, stop.set)
+                except NotImplementedError:
+                    pass
+
+        workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+        await dp.emit_startup(bot=bot, **workflow_data)
+
+        log.info(f"{self}: worker running.")
+
+        try:
+            await stop.wait()
+        finally:
+            await dp.emit_shutdown(bot=bot, **workflow_data)
+            await bot.session.close()
+            self.close()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+    def run(self, bot):
+        return asyncio.run(self.serve(bot))
@@ -0,0 +1,103 @@
+"""Load shedding for block notifications while event processing falls behind.
+"""
+from __future__ import annotations
+
+from enum import IntEnum
+from typing import Dict
+
+from attrdict import AttrDict
+
+from hydra import log
+
+from hybot.util.conf import Config
+
+__all__ = "Shed", "LoadShedder"
+
+
+class Shed(IntEnum):
+    FULL = 0    # Everything is sent.
+    CARDS = 1   # Follow-up address cards are dropped.
+    FIAT = 2    # Fiat values only come from cached prices, nothing is fetched.
+    DIGEST = 3  # Events are folded into one summary per user instead of individual notifications.
+
+
+@Config.defaults
+class LoadShedder:
+    """Shedding level from the lag of event processing.
+
+    Lag is the time the latest event spent queued, with the queue depth as an
+    early signal. Each level has a lag and a depth threshold; the level goes
+    up as soon as either is reached and down one step at a time once both are
+    below `recover` times the thresholds of the current level.
+    """
+    conf: AttrDict
+
+    CONF = {
+        "lag": [30, 60, 180],     # Seconds queued to shed cards, fiat, then switch to digests.
+        "depth": [16, 48, 128],   # Queued events for the same levels.
+        "recover": 0.5,
+    }
+
+    level: Shed
+
+    _stats: AttrDict
+    _events: Dict[str, int]
+    _shed: Dict[str, int]
+
+    def __init__(self):
+        self.conf = Config.get(LoadShedder, defaults=True)
+        self.level = Shed.FULL
+        self._stats = AttrDict(raised=0, lowered=0)
+        self._events = {lvl.name.lower(): 0 for lvl in Shed}
+        self._shed = {}
+
+    def stats(self) -> AttrDict:
+        """Current level, level changes, events processed at each level and what was shed.
+        """
+        return AttrDict(
+            level=self.level.name.lower(),
+            raised=self._stats.raised,
+            lowered=self._stats.lowered,
+            events=dict(self._events),
+            shed=dict(self._shed),
+        )
+
+    def count(self, what: str, n: int = 1):
+        """Count something shed: "cards" dropped, blocks rendered without fetching "fiat", events folded into a "digest".
+        """
+        self._shed[what] = self._shed.get(what, 0) + n
+
+    def __target(self, depth: int, lag: float, scale: float = 1.) -> Shed:
+        level = Shed.FULL
+
+        for lvl, (lag_max, depth_max) in enumerate(zip(self.conf.lag, self.conf.depth), start=1):
+            if lag >= lag_max * scale or depth >= depth_max * scale:
+                level = Shed(lvl)
+
+        return level
+
+    def update(self, depth: int, lag: float) -> Shed:
+        """The level for the next event, given the queue depth and the seconds it waited.
+        """
+        level = self.__target(depth, lag)
+
+        if level > self.level:
+            self._stats.raised += 1
+            log.warning(
+                f"Load shedding: {self.level.name} -> {level.name} "
+                f"({depth} queued, {round(lag, 1)}s lag)."
+            )
+            self.level = level
+
+        elif level < self.level and self.__target(depth, lag, self.conf.recover) < self.level:
+            self._stats.lowered += 1
+            level = Shed(self.level - 1)
+            log.info(
+                f"Load shedding: {self.level.name} -> {level.name} "
+                f"({depth} queued, {round(lag, 1)}s lag)."
+            )
+            self.level = level
+
+        self._events[self.level.name.lower()] += 1
+
+        return self.level
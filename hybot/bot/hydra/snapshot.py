@@ -0,0 +1,111 @@
+"""Warm-restart snapshot of the bot's in-memory caches.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+import zlib
+from typing import Any, Optional
+
+from attrdict import AttrDict
+
+from hydra import log
+
+from hybot.util.conf import Config
+
+__all__ = "Snapshot",
+
+
+@Config.defaults
+class Snapshot:
+    """Caches written to disk periodically and on shutdown, then restored at the next startup.
+
+    The file holds zlib-compressed JSON: a format `VERSION`, the time it was
+    written, the network it belongs to and one section per cache. It is read
+    once, in the executor, while startup is already fetching the server
+    info. It is only used if the version and network match and it is younger
+    than `max_age`. Anything restored from it is refreshed from the server in
+    the background.
+    """
+    conf: AttrDict
+    path: str
+    data: Optional[dict]
+
+    CONF = {
+        "file": "snapshot.z",  # Relative to Config.APP_BASE.
+        "interval": 300,       # Seconds between writes.
+        "max_age": 86400,      # Seconds after which a snapshot is ignored.
+    }
+
+    VERSION = 1
+
+    _loaded: bool
+
+    def __init__(self, path: Optional[str] = None):
+        self.conf = Config.get(Snapshot, defaults=True)
+        self.path = path or os.path.join(Config.APP_BASE, self.conf.file)
+        self.data = None
+        self._loaded = False
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.data["stamp"] if self.data is not None else 0.
+
+    async def load(self):
+        """Read the snapshot once; `data` stays None if there is no usable one.
+        """
+        if self._loaded:
+            return
+
+        self._loaded = True
+
+        try:
+            self.data = await asyncio.get_running_loop().run_in_executor(None, self.__read)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, zlib.error) as exc:
+            log.warning(f"Snapshot: unreadable, starting cold: {exc}")
+            return
+
+        if self.data.get("version", None) != Snapshot.VERSION:
+            log.info(f"Snapshot: version {self.data.get('version', None)} isn't {Snapshot.VERSION}, starting cold.")
+            self.data = None
+
+        elif self.age >= self.conf.max_age:
+            log.info(f"Snapshot: {round(self.age / 3600, 1)}h old, starting cold.")
+            self.data = None
+
+    def __read(self) -> dict:
+        with open(self.path, "rb") as f:
+            return json.loads(zlib.decompress(f.read()))
+
+    def valid(self, mainnet: bool) -> bool:
+        """True if a snapshot was loaded for the network the server is on; otherwise it is dropped.
+        """
+        if self.data is not None and self.data["mainnet"] != mainnet:
+            log.warning(f"Snapshot: taken on {'mainnet' if self.data['mainnet'] else 'testnet'}, starting cold.")
+            self.data = None
+
+        return self.data is not None
+
+    def get(self, section: str) -> Optional[Any]:
+        if self.data is None:
+            return None
+
+        return self.data["sections"].get(section, None)
+
+    async def save(self, mainnet: bool, **sections):
+        data = dict(version=Snapshot.VERSION, stamp=time.time(), mainnet=mainnet, sections=sections)
+        await asyncio.get_running_loop().run_in_executor(None, self.__write, data)
+
+    def __write(self, data: dict):
+        tmp = f"{self.path}.tmp"
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        with open(tmp, "wb") as f:
+            f.write(zlib.compress(json.dumps(data, separators=(",", ":")).encode()))
+
+        os.replace(tmp, self.path)
@@ -0,0 +1,97 @@
+"""Concurrent initialization of the clients and caches the bot depends on.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from attrdict import AttrDict
+
+from hydra import log
+
+__all__ = "Startup",
+
+
+class Startup:
+    """Named init steps run concurrently when the bot starts.
+
+    A step starts as soon as the steps it comes `after` have finished.
+    `ready()` returns once every critical step is done; the bot starts
+    accepting updates then, while non-critical steps (cache warmups) carry on
+    in the background. A failed critical step fails startup; a failed
+    warmup is only logged.
+    """
+    _steps: Dict[str, Tuple[Callable[[], Awaitable], bool, Tuple[str, ...]]]
+    _tasks: Dict[str, asyncio.Task]
+    _times: Dict[str, float]
+    _began: Optional[float]
+
+    def __init__(self):
+        self._steps = {}
+        self._tasks = {}
+        self._times = {}
+        self._began = None
+
+    def add(self, name: str, fn: Callable[[], Awaitable], *, critical: bool = True, after: Tuple[str, ...] = ()):
+        self._steps[name] = fn, critical, after
+
+    def start(self):
+        """Start the steps not yet started; a no-op when called again.
+        """
+        if self._began is None:
+            self._began = time.monotonic()
+
+        for name in self._steps:
+            if name not in self._tasks:
+                self._tasks[name] = asyncio.get_event_loop().create_task(self.__run(name))
+
+    async def __run(self, name: str):
+        fn, critical, after = self._steps[name]
+
+        await asyncio.gather(*(self._tasks[dep] for dep in after))
+
+        try:
+            await fn()
+        except Exception as exc:
+            if critical:
+                raise
+
+            log.warning(f"Startup: {name} failed: {exc}")
+            return
+
+        self._times[name] = time.monotonic() - self._began
+        log.debug(f"Startup: {name} ready after {round(self._times[name], 2)}s.")
+
+    async def ready(self):
+        """Run the steps and wait for the critical ones.
+        """
+        self.start()
+
+        await asyncio.gather(*(task for name, task in self._tasks.items() if self._steps[name][1]))
+
+        log.info(f"Startup: ready after {round(time.monotonic() - self._began, 2)}s.")
+
+    async def wait(self, name: str):
+        """Wait for a step to finish (successfully or not); returns right away for unknown or unstarted steps.
+        """
+        task = self._tasks.get(name, None)
+
+        if task is not None:
+            await asyncio.gather(asyncio.shield(task), return_exceptions=True)
+
+    def status(self) -> AttrDict:
+        """Step name -> "pending", "ready" or "failed".
+        """
+        return AttrDict({
+            name: (
+                "pending" if name not in self._tasks or not self._tasks[name].done() else
+                "ready" if name in self._times else
+                "failed"
+            )
+            for name in self._steps
+        })
+
+    def close(self):
+        for task in self._tasks.values():
+            task.cancel()
@@ -0,0 +1,156 @@
+"""Per-user tallies of block events over a range of blocks.
+"""
+from __future__ import annotations
+
+import json
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from attrdict import AttrDict
+from num2words import num2words
+
+from hydb.api.schemas import UserAddrResult, UserBase
+
+__all__ = "AddrTally", "Summary"
+
+
+class AddrTally:
+    """Block event totals for one watched address.
+    """
+    __slots__ = "ua", "mined", "reward", "matured", "txes", "recv", "tokens"
+
+    ua: UserAddrResult
+    mined: List[int]
+    reward: Decimal
+    matured: int
+    txes: int
+    recv: Decimal
+    tokens: int
+
+    def __init__(self, ua: UserAddrResult):
+        self.ua = ua
+        self.mined = []
+        self.reward = Decimal(0)
+        self.matured = 0
+        self.txes = 0
+        self.recv = Decimal(0)
+        self.tokens = 0
+
+    def __bool__(self):
+        return bool(self.mined or self.matured or self.txes)
+
+    def dump(self) -> dict:
+        return dict(
+            ua=json.loads(self.ua.json()),
+            mined=self.mined,
+            reward=str(self.reward),
+            matured=self.matured,
+            txes=self.txes,
+            recv=str(self.recv),
+            tokens=self.tokens,
+        )
+
+    @staticmethod
+    def load(data: dict) -> AddrTally:
+        tally = AddrTally(UserAddrResult.parse_obj(data["ua"]))
+        tally.mined = list(data["mined"])
+        tally.reward = Decimal(data["reward"])
+        tally.matured = data["matured"]
+        tally.txes = data["txes"]
+        tally.recv = Decimal(data["recv"])
+        tally.tokens = data["tokens"]
+        return tally
+
+    def add_mined(self, height: int, reward: Decimal):
+        self.mined.append(height)
+        self.reward += reward
+
+    def add_matured(self):
+        self.matured += 1
+
+    def add_txes(self, block_txes: AttrDict):
+        """Add the result of EventManager.__sse_block_event_proc_tx() for this address.
+        """
+        self.txes += len(block_txes.txes)
+        self.recv += block_txes.total_recv
+        self.tokens += sum(
+            len(token_txes)
+            for token_txes_all in block_txes.token_xfrs.values()
+            for token_txes in token_txes_all.values()
+        )
+
+
+class Summary:
+    """Tallies per user and address, added to incrementally as blocks are processed.
+    """
+    first: Optional[int]
+    last: Optional[int]
+    users: Dict[int, UserBase]
+    tallies: Dict[int, Dict[int, AddrTally]]
+
+    def __init__(self):
+        self.first = None
+        self.last = None
+        self.users = {}
+        self.tallies = {}
+
+    def __len__(self):
+        return len(self.tallies)
+
+    def height(self, height: int):
+        self.first = height if self.first is None else min(self.first, height)
+        self.last = height if self.last is None else max(self.last, height)
+
+    def tally(self, ua: UserAddrResult) -> AddrTally:
+        u: UserBase = ua.user
+        self.users[u.tg_user_id] = u
+
+        user_tallies = self.tallies.setdefault(u.tg_user_id, {})
+        tally = user_tallies.get(ua.pkid, None)
+
+        if tally is None:
+            tally = user_tallies[ua.pkid] = AddrTally(ua)
+
+        return tally
+
+    def add(self, tally: AddrTally):
+        """Put back a tally restored with AddrTally.load().
+        """
+        u: UserBase = tally.ua.user
+        self.users[u.tg_user_id] = u
+        self.tallies.setdefault(u.tg_user_id, {})[tally.ua.pkid] = tally
+
+    def pop(self, tg_user_id: int) -> List[AddrTally]:
+        self.users.pop(tg_user_id, None)
+        return [tally for tally in self.tallies.pop(tg_user_id, {}).values() if tally]
+
+    @staticmethod
+    def lines(tally: AddrTally) -> List[str]:
+        """Message lines for one address, without the address header.
+        """
+        lines = []
+
+        if tally.mined:
+            mined = len(tally.mined)
+            lines.append(
+                f"Mined {num2words(mined) if mined < 10 else mined} block{'s' if mined != 1 else ''}: "
+                f"+{round(tally.reward, 2)} HYDRA"
+            )
+
+        if tally.matured:
+            lines.append(
+                f"Matured {num2words(tally.matured) if tally.matured < 10 else tally.matured} block{'s' if tally.matured != 1 else ''}"
+            )
+
+        if tally.txes:
+            line = f"{tally.txes} transaction{'s' if tally.txes != 1 else ''}"
+
+            if tally.recv:
+                line += f": {'+' if tally.recv > 0 else '-'}{abs(round(tally.recv, 8))} HYDRA"
+
+            if tally.tokens:
+                line += f", {tally.tokens} token transfer{'s' if tally.tokens != 1 else ''}"
+
+            lines.append(line)
+
+        return lines
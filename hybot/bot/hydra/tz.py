@@ -64,7 +64,8 @@ async def tz(bot: HydraBot, msg: types.Message):
 
         tz_new_loc = pytz.timezone(tz_new).localize(datetime.now(), is_dst=None).tzname()
 
-        await bot.db.asyncc.user_info_put(
+        await HydraBotData.user_info_put(
+            bot,
             u,
             {
                 "tz": tz_new,
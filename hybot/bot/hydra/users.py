@@ -0,0 +1,93 @@
+"""Cache of full user objects for command handling.
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from attrdict import AttrDict
+
+from hydb.api.schemas import BlockSSEResult, SSEBlockEvent, User
+
+from hybot.util.conf import Config
+
+__all__ = "UserCache",
+
+
+@Config.defaults
+class UserCache:
+    """tg_user_id -> User, as last loaded from the server.
+
+    Entries expire after `ttl` seconds and the least recently used are
+    dropped beyond `size`. The bot's own writes (address and info updates,
+    conf changes, deletion) invalidate the user they change. Mined blocks do
+    the same for their addresses' users, whose block counts have changed.
+    The TTL bounds how stale an entry can get through changes made elsewhere.
+    """
+    conf: AttrDict
+
+    CONF = {
+        "ttl": 120,
+        "size": 4096,
+    }
+
+    generation: int  # Bumped by every invalidation.
+
+    _users: OrderedDict[int, Tuple[float, User]]
+    _stats: AttrDict
+
+    def __init__(self):
+        self.conf = Config.get(UserCache, defaults=True)
+        self.generation = 0
+        self._users = OrderedDict()
+        self._stats = AttrDict(hits=0, misses=0, invalidated=0)
+
+    def __len__(self):
+        return len(self._users)
+
+    def stats(self) -> AttrDict:
+        return AttrDict(size=len(self._users), **self._stats)
+
+    def get(self, tg_user_id: int) -> Optional[User]:
+        entry = self._users.get(tg_user_id, None)
+
+        if entry is None or time.monotonic() - entry[0] >= self.conf.ttl:
+            self._stats.misses += 1
+            return None
+
+        self._stats.hits += 1
+        self._users.move_to_end(tg_user_id)
+        return entry[1]
+
+    def put(self, u: User, generation: Optional[int] = None):
+        """Cache a user; with the `generation` read before loading it, skipped if anything was invalidated since.
+        """
+        if generation is not None and generation != self.generation:
+            return
+
+        self._users[u.tg_user_id] = time.monotonic(), u
+        self._users.move_to_end(u.tg_user_id)
+
+        while len(self._users) > self.conf.size:
+            self._users.popitem(last=False)
+
+    def invalidate(self, tg_user_id: int):
+        self.generation += 1
+
+        if self._users.pop(tg_user_id, None) is not None:
+            self._stats.invalidated += 1
+
+    def clear(self):
+        self._users.clear()
+
+    def update(self, result: BlockSSEResult):
+        """Invalidate the users whose addresses mined the block of a new block event.
+        """
+        if result.event != SSEBlockEvent.create:
+            return
+
+        for addr_hist in result.hist:
+            if addr_hist.mined:
+                for ahu in addr_hist.addr_hist_user:
+                    self.invalidate(ahu.user_addr.user.tg_user_id)
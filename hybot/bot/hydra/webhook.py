@@ -0,0 +1,160 @@
+"""Webhook runtime: Telegram updates served by an embedded aiohttp server.
+"""
+from __future__ import annotations
+
+import asyncio
+import signal
+from typing import Optional, Set
+
+from aiogram import types
+from aiohttp import web
+from attrdict import AttrDict
+
+from hydra import log
+
+from hybot.util.conf import Config
+from . import HydraBot
+
+__all__ = "WebhookServer",
+
+
+@Config.defaults
+class WebhookServer:
+    """Receives updates on `path` and feeds them to the dispatcher.
+
+    Requests must carry `secret` in the X-Telegram-Bot-Api-Secret-Token
+    header when one is configured. Each update is acknowledged right away and
+    handled in the background, at most `concurrency` at a time. On shutdown
+    the server stops accepting updates and waits up to `drain` seconds for
+    those in flight before the dispatcher shuts down.
+
+    With `url` set, the webhook is registered with Telegram at startup. Leave
+    it empty to run locally and POST recorded update JSON to the server.
+    """
+    conf: AttrDict
+    bot: HydraBot
+
+    CONF = {
+        "url": "",           # Public base URL, e.g. https://bot.example.com; empty to skip set_webhook.
+        "host": "127.0.0.1",
+        "port": 8080,
+        "path": "/telegram",
+        "secret": "",        # Telegram secret_token, checked on every request.
+        "concurrency": 32,   # Updates handled at once.
+        "drain": 30,         # Seconds to wait for in-flight updates on shutdown.
+    }
+
+    SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+    _sem: Optional[asyncio.Semaphore]
+    _tasks: Set[asyncio.Task]
+    _draining: bool
+    _stop: Optional[asyncio.Event]
+
+    def __init__(self, bot: HydraBot):
+        self.conf = Config.get(WebhookServer, defaults=True)
+        self.bot = bot
+        self._sem = None
+        self._tasks = set()
+        self._draining = False
+        self._stop = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.conf.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.conf.secret and request.headers.get(WebhookServer.SECRET_HEADER, "") != self.conf.secret:
+            return web.Response(status=401)
+
+        if self._draining:
+            return web.Response(status=503)  # Telegram retries later.
+
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as exc:
+            log.warning(f"Webhook: invalid update: {exc}")
+            return web.Response(status=400)
+
+        task = asyncio.get_running_loop().create_task(self.__process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        return web.Response()
+
+    async def __process(self, update: types.Update):
+        async with self._sem:
+            try:
+                await self.bot.dp.feed_update(self.bot, update)
+            except Exception as exc:
+                log.error(f"Webhook: error handling update {update.update_id}", exc_info=exc)
+
+    async def drain(self):
+        self._draining = True
+
+        if not self._tasks:
+            return
+
+        log.info(f"Webhook: waiting for {len(self._tasks)} update{'s' if len(self._tasks) != 1 else ''} in flight.")
+
+        done, pending = await asyncio.wait(set(self._tasks), timeout=self.conf.drain)
+
+        if pending:
+            log.warning(f"Webhook: cancelling {len(pending)} update{'s' if len(pending) != 1 else ''} still running after {self.conf.drain}s.")
+
+            for task in pending:
+                task.cancel()
+
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def serve(self, handle_signals: bool = True):
+        bot, dp = self.bot, self.bot.dp
+        loop = asyncio.get_running_loop()
+        stop = self._stop = asyncio.Event()
+
+        if handle_signals:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, stop.set)
+                except NotImplementedError:  # Windows.
+                    pass
+
+        self._sem = asyncio.Semaphore(self.conf.concurrency)
+
+        workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+        await dp.emit_startup(bot=bot, **workflow_data)
+
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+
+        try:
+            site = web.TCPSite(runner, self.conf.host, self.conf.port)
+            await site.start()
+
+            if self.conf.url:
+                await bot.set_webhook(
+                    url=self.conf.url.rstrip("/") + self.conf.path,
+                    secret_token=self.conf.secret or None,
+                    max_connections=self.conf.concurrency,
+                    allowed_updates=dp.resolve_used_update_types(),
+                )
+
+            log.info(f"Webhook: serving on {self.conf.host}:{self.conf.port}{self.conf.path}.")
+
+            await stop.wait()
+
+        finally:
+            log.info("Webhook: shutting down.")
+
+            await self.drain()
+            await runner.cleanup()
+            await dp.emit_shutdown(bot=bot, **workflow_data)
+            await bot.session.close()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+    def run(self):
+        return asyncio.run(self.serve())
@@ -18,9 +18,13 @@ class Config:
     DEFAULT = AttrDict()
 
     @staticmethod
-    def get(cls: type, defaults=False, save_defaults=False) -> AttrDict:
+    def get(cls: type, defaults=False, save_defaults=False, name: str = None) -> AttrDict:
+        """Config section `name` (default: the class name), with `cls` defaults.
+        """
+        name = name or cls.__name__
+
         conf = AttrDict(Config.read(create=True).get(
-            cls.__name__, Config.DEFAULT.setdefault(cls.__name__, AttrDict())
+            name, Config.DEFAULT.setdefault(cls.__name__, AttrDict())
         ))
 
         if defaults:
@@ -33,14 +37,14 @@ class Config:
                     conf[k] = v
 
             if updated and save_defaults:
-                Config.set(cls, conf)
+                Config.set(cls, conf, name=name)
 
         return conf
 
     @staticmethod
-    def set(cls: type, data: dict) -> None:
+    def set(cls: type, data: dict, name: str = None) -> None:
         curr_data = Config.read(create=True)
-        curr_data[cls.__name__] = data
+        curr_data[name or cls.__name__] = data
         Config.write(curr_data)
 
     @staticmethod
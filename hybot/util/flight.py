@@ -0,0 +1,74 @@
+"""Per-key coordination of concurrent coroutines.
+"""
+import asyncio
+import contextlib
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable
+
+__all__ = "SingleFlight", "KeyedLocks"
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight call.
+
+    The first caller for a key starts the call; the ones arriving while it
+    runs await the same result (or exception). A waiter being cancelled does
+    not cancel the call for the others.
+    """
+    _calls: Dict[Hashable, asyncio.Future]
+
+    def __init__(self):
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    def running(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key, None)
+
+        if call is None:
+            call = self._calls[key] = asyncio.ensure_future(fn())
+            call.add_done_callback(lambda _: self._calls.pop(key, None))
+
+        return await asyncio.shield(call)
+
+
+class KeyedLocks:
+    """An asyncio.Lock per key, kept only while it is held or waited for.
+    """
+    _locks: Dict[Hashable, asyncio.Lock]
+    _users: Dict[Hashable, int]
+
+    def __init__(self):
+        self._locks = {}
+        self._users = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    def locked(self, key: Hashable) -> bool:
+        lock = self._locks.get(key, None)
+        return lock is not None and lock.locked()
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        lock = self._locks.get(key, None)
+
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+
+        self._users[key] = self._users.get(key, 0) + 1
+
+        try:
+            async with lock:
+                yield
+
+        finally:
+            self._users[key] -= 1
+
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
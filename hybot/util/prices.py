@@ -0,0 +1,253 @@
+"""Fiat price helpers.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import aiohttp
+from attrdict import AttrDict
+
+from hydra import log
+
+from hybot.util.conf import Config
+from hybot.util.gomt import GOMTRPC, PriceClientGOMT
+from hybot.util.misc import fiat_value_decimal_from_price_simple
+
+__all__ = "PriceService", "PriceSnapshot"
+
+PricePair = Tuple[str, str]  # (symbol, currency)
+
+
+@Config.defaults
+class PriceService:
+    """Async fiat prices for the symbols in HydraBot.price_client_map.
+
+    Prices come straight from the KuCoin and BitMart REST APIs over one pooled
+    aiohttp session. Concurrent misses for the same pair share a single
+    request, and a price past its TTL keeps being served while a background
+    refresh runs, up to `max_stale` seconds old.
+    """
+    conf: AttrDict
+    coins: Dict[str, str]
+
+    _cache: Dict[PricePair, Tuple[Decimal, float]]
+    _flight: Dict[PricePair, asyncio.Task]
+    _session: Optional[aiohttp.ClientSession]
+
+    CONF = {
+        "ttl": 180,         # Seconds before a price is refreshed.
+        "ttl_hydra": 60,
+        "max_stale": 900,   # Seconds a stale price is still served while refreshing.
+        "timeout": 10,
+        "connections": 8,
+    }
+
+    KUCOIN_URL = "https://api.kucoin.com/api/v1/prices"
+    GOMT = "GOMT"
+
+    def __init__(self, price_client_map: Dict[str, Any]):
+        self.conf = Config.get(PriceService, defaults=True)
+
+        # Symbol -> KuCoin coin, or GOMT for the BitMart GOMT/USDT ticker.
+        self.coins = {
+            symbol: PriceService.GOMT if isinstance(pc, PriceClientGOMT) else pc.coin
+            for symbol, pc in price_client_map.items()
+        }
+
+        self._cache = {}
+        self._flight = {}
+        self._session = None
+
+    async def get(self, symbol: str, currency: str) -> Decimal:
+        coin = self.coins[symbol]
+
+        if coin == PriceService.GOMT:
+            gomt_usdt, usdt_currc = await asyncio.gather(
+                self.__get((PriceService.GOMT, "USDT")),
+                self.__get((self.coins["USDT"], currency)),
+            )
+
+            return gomt_usdt * usdt_currc
+
+        return await self.__get((coin, currency))
+
+    def cached(self, symbol: str, currency: str) -> Optional[Decimal]:
+        """The last known price within `max_stale`, without fetching; None if there isn't one.
+        """
+        coin = self.coins.get(symbol, None)
+
+        if coin is None:
+            return None
+
+        if coin == PriceService.GOMT:
+            gomt_usdt = self.__cached((PriceService.GOMT, "USDT"))
+            usdt_currc = self.__cached((self.coins["USDT"], currency))
+
+            return gomt_usdt * usdt_currc if gomt_usdt is not None and usdt_currc is not None else None
+
+        return self.__cached((coin, currency))
+
+    def __cached(self, key: PricePair) -> Optional[Decimal]:
+        entry = self._cache.get(key, None)
+
+        if entry is None or time.monotonic() - entry[1] >= self.conf.max_stale:
+            return None
+
+        return entry[0]
+
+    def dump(self) -> List[Tuple[str, str, str, float]]:
+        """The cached prices as (coin, currency, price, age in seconds), for a snapshot.
+        """
+        now = time.monotonic()
+
+        return [
+            (coin, currency, str(value), now - stamp)
+            for (coin, currency), (value, stamp) in self._cache.items()
+            if now - stamp < self.conf.max_stale
+        ]
+
+    def restore(self, prices: Iterable[Tuple[str, str, str, float]], age: float = 0.):
+        """Cache dumped prices still within `max_stale`, `age` seconds after the dump; they are refreshed as usual past their TTL.
+        """
+        now = time.monotonic()
+
+        for coin, currency, value, value_age in prices:
+            value_age += age
+
+            if value_age < self.conf.max_stale and (coin, currency) not in self._cache:
+                self._cache[(coin, currency)] = Decimal(value), now - value_age
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def __ttl(self, key: PricePair) -> float:
+        return self.conf.ttl_hydra if key[0] == "HYDRA" else self.conf.ttl
+
+    async def __get(self, key: PricePair) -> Decimal:
+        entry = self._cache.get(key, None)
+
+        if entry is not None:
+            value, stamp = entry
+            age = time.monotonic() - stamp
+
+            if age < self.__ttl(key):
+                return value
+
+            if age < self.conf.max_stale:
+                self.__refresh(key)
+                return value
+
+        return await asyncio.shield(self.__refresh(key))
+
+    def __refresh(self, key: PricePair) -> asyncio.Task:
+        task = self._flight.get(key, None)
+
+        if task is None:
+            task = self._flight[key] = asyncio.get_running_loop().create_task(self.__fetch(key))
+            task.add_done_callback(lambda t: self.__refreshed(key, t))
+
+        return task
+
+    def __refreshed(self, key: PricePair, task: asyncio.Task):
+        self._flight.pop(key, None)
+
+        if not task.cancelled() and task.exception() is not None:
+            log.warning(f"Price refresh for {key[0]}/{key[1]} failed: {task.exception()}")
+
+    def __http(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.conf.timeout),
+                connector=aiohttp.TCPConnector(limit=self.conf.connections),
+                headers=GOMTRPC.DEFAULT_GET_HEADERS,
+            )
+
+        return self._session
+
+    async def __fetch(self, key: PricePair) -> Decimal:
+        coin, currency = key
+
+        if coin == PriceService.GOMT:
+            async with self.__http().get(GOMTRPC.URL + GOMTRPC.PATH_TICKER) as rsp:
+                rsp.raise_for_status()
+                data = await rsp.json(content_type=None)
+
+            value = data["data"]["tickers"][0]["last_price"]
+
+        else:
+            async with self.__http().get(PriceService.KUCOIN_URL, params=dict(base=currency, currencies=coin)) as rsp:
+                rsp.raise_for_status()
+                data = await rsp.json(content_type=None)
+
+            value = (data.get("data", None) or {}).get(coin, None)
+
+            if value is None:
+                raise ValueError(f"No {coin} price available in {currency}.")
+
+        value = Decimal(value)
+        self._cache[key] = value, time.monotonic()
+        return value
+
+
+class PriceSnapshot:
+    """A fixed (symbol, currency) -> price table.
+
+    Prices are resolved once per pair with `extend()` and then read
+    synchronously, so everything rendered from one snapshot shows the same
+    price. With a `fallback`, `value()` returns it for a price that couldn't
+    be resolved instead of raising.
+    """
+    _prices: Dict[PricePair, asyncio.Future]
+    _resolve: Callable[[str, str], Awaitable[Decimal]]
+    _format: Callable[..., str]
+    _fallback: Optional[str]
+
+    def __init__(self, resolve: Callable[[str, str], Awaitable[Decimal]], format_: Callable[..., str], fallback: Optional[str] = None):
+        self._prices = {}
+        self._resolve = resolve
+        self._format = format_
+        self._fallback = fallback
+
+    def __contains__(self, pair: PricePair) -> bool:
+        return pair in self._prices
+
+    async def extend(self, pairs: Iterable[PricePair]) -> PriceSnapshot:
+        """Resolve any pairs not yet in the snapshot (concurrently, once each).
+        """
+        pairs = set(pairs)
+
+        for pair in pairs:
+            if pair not in self._prices:
+                self._prices[pair] = asyncio.ensure_future(self._resolve(*pair))
+
+        if pairs:
+            await asyncio.gather(*(self._prices[pair] for pair in pairs), return_exceptions=True)
+
+        return self
+
+    def price(self, symbol: str, currency: str) -> Decimal:
+        fut = self._prices.get((symbol, currency), None)
+
+        if fut is None or not fut.done():
+            raise KeyError(f"Price for {symbol}/{currency} is not in the snapshot")
+
+        return fut.result()
+
+    def value_dec(self, symbol: str, currency: str, value: Union[Decimal, int, str]) -> Decimal:
+        return fiat_value_decimal_from_price_simple(self.price(symbol, currency), value)
+
+    def value(self, symbol: str, currency: str, value: Union[Decimal, int, str], *, with_name=True) -> str:
+        try:
+            value_dec = self.value_dec(symbol, currency, value)
+        except (LookupError, ValueError):
+            if self._fallback is None:
+                raise
+
+            return self._fallback
+
+        return self._format(currency, value_dec, with_name=with_name)
@@ -0,0 +1,78 @@
+"""Rate limiting helpers.
+"""
+import time
+from typing import Optional
+
+__all__ = "TokenBucket",
+
+
+class TokenBucket:
+    """Token bucket on the monotonic clock.
+
+    `rate` tokens are added per second up to `burst`; `hold()` empties the
+    bucket until a point in the future (e.g. a Telegram retry_after).
+    """
+    rate: float
+    burst: float
+    tokens: float
+    stamp: float
+    until: float
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = float(rate)
+        self.burst = max(1., float(burst))
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.until = 0.
+
+    def __refill(self, now: float):
+        if now > self.stamp:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def delay(self, now: Optional[float] = None) -> float:
+        """Seconds until a token is available, 0 if one is available now.
+        """
+        now = time.monotonic() if now is None else now
+
+        if now < self.until:
+            return self.until - now
+
+        self.__refill(now)
+
+        if self.tokens >= 1:
+            return 0.
+
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def available(self, now: Optional[float] = None) -> float:
+        """Tokens available now (0 while held).
+        """
+        now = time.monotonic() if now is None else now
+
+        if now < self.until:
+            return 0.
+
+        self.__refill(now)
+        return max(0., self.tokens)
+
+    def take(self, now: Optional[float] = None):
+        self.__refill(time.monotonic() if now is None else now)
+        self.tokens -= 1
+
+    def hold(self, seconds: float, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        self.until = max(self.until, now + seconds)
+        self.tokens = 0.
+        self.stamp = max(self.stamp, self.until)
+
+    def idle(self, now: Optional[float] = None) -> bool:
+        """True when the bucket is full and can be discarded.
+        """
+        now = time.monotonic() if now is None else now
+
+        if now < self.until:
+            return False
+
+        self.__refill(now)
+        return self.tokens >= self.burst